@@ -1,39 +1,103 @@
 from dotenv import load_dotenv
 import streamlit as st
-import os
-import google.generativeai as genai
-from PIL import Image
 import base64
+import logging
+import os
+import time
 import urllib.parse
+import uuid
+
+import config
+from image_pipeline import prepare_image
+from batch import run_batch
+from label_ocr import ocr_stats, start_ocr_warmup
+from ingredient_rules import rule_verdict
+from nutrition import MealEstimate, calorie_table_html
+from prompts import PROFESSIONAL_USER, normalize_mode, select_prompt
+from metrics import RequestTrace, stage, start_metrics_server
+from resilience import ModelUnavailable
+from translation import ENGLISH, get_translator
+from history import get_history, upload_hash
+from upload_memory import get_upload_budget, preview_image
+from analysis_service import (
+    analyze,
+    final_response,
+    format_safety_tags,
+    image_parts_for,
+    model_answer,
+    precheck,
+    remember_check,
+    repeated_check,
+    split_disclaimer,
+    summarize_verdict,
+)
 
 # Load environment variables
 load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-# Function to load Gemini model and get response
-def get_gemini_response(input_prompt, image, user_input):
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    response = model.generate_content([input_prompt, image[0], user_input])
-    return response.text
+logger = logging.getLogger(__name__)
+page_started = time.perf_counter()
+
+# Start loading the OCR reader in the background so it is warm by the first check
+start_ocr_warmup()
+
+# Serve Prometheus metrics on NURTUREAI_METRICS_PORT (if set)
+start_metrics_server()
+
+# Identifies this browser session in the shared model queue
+def session_key():
+    if "session_key" not in st.session_state:
+        st.session_state["session_key"] = uuid.uuid4().hex
+    return st.session_state["session_key"]
+
+# Keep a reference to a stored result for this session's recent checks (ids only,
+# the results themselves stay in the history store)
+def remember_in_session(history_id):
+    if history_id is None:
+        return
+    ids = [i for i in st.session_state.get("history_ids", []) if i != history_id]
+    st.session_state["history_ids"] = [history_id] + ids[:config.HISTORY_SESSION_ITEMS - 1]
+
+# Function to normalize the uploaded image once per upload (reused across reruns).
+# The buffer lives in the shared upload budget, which may spill it to disk or free it
+# while the session is idle; it is prepared again from the upload when needed. A batch
+# file is held next to the other files of the batch (`replace=False`); batch workers
+# pass the session explicitly since they cannot read the session state.
+def prepare_upload(uploaded_file, session=None, replace=True):
+    budget = get_upload_budget()
+    session = session or session_key()
+    held = budget.get(session, uploaded_file.file_id)
+    if held is None:
+        raw = uploaded_file.getvalue()
+        held = budget.hold(
+            session, uploaded_file.file_id, prepare_image(raw, uploaded_file.type), upload_hash(raw), len(raw),
+            replace=replace,
+        )
+    return held
 
 # Function to process the uploaded image
 def input_image_setup(uploaded_file):
     if uploaded_file is not None:
-        bytes_data = uploaded_file.getvalue()
-        image_parts = [{
-            "mime_type": uploaded_file.type,
-            "data": bytes_data
-        }]
+        prepared = prepare_upload(uploaded_file).prepared
+        image_parts = image_parts_for(prepared)
         return image_parts
     else:
         raise FileNotFoundError("No file uploaded")
 
-# Ensure medical disclaimer is added
-def ensure_medical_disclaimer(text):
-    disclaimer = "⚠️ Please consult a healthcare professional for personalized advice."
-    if disclaimer not in text:
-        text += f"\n\n{disclaimer}"
-    return text
+# Render an analysis, moving the disclaimer into its own box
+def render_analysis(safe_response, mode, meal=None):
+    # Calorie results are shown without the safe/unsafe tags
+    formatted_response = safe_response if "Calories" in mode else format_safety_tags(safe_response)
+    main_content, disclaimer = split_disclaimer(formatted_response)
+    if meal is not None:
+        # Itemized table computed from the local nutrition table
+        st.markdown(calorie_table_html(meal), unsafe_allow_html=True)
+        if meal.assessment:
+            st.markdown(meal.assessment)
+    else:
+        st.markdown(main_content, unsafe_allow_html=True)
+    if disclaimer:
+        st.markdown(f"<div class='disclaimer-box'>{disclaimer}</div>", unsafe_allow_html=True)
 
 # Function to create a WhatsApp share link with text
 def get_whatsapp_share_link(text):
@@ -54,369 +118,27 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Static CSS and JavaScript, read from disk once per server process
+@st.cache_resource
+def load_static_assets():
+    static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    with open(os.path.join(static_dir, "nurtureai.css"), encoding="utf-8") as f:
+        css = f.read()
+    with open(os.path.join(static_dir, "whatsapp_modal.js"), encoding="utf-8") as f:
+        js = f.read()
+    return f"<style>\n{css}</style>", f"<script>\n{js}</script>"
+
+page_css, page_js = load_static_assets()
+
 # Custom CSS with dark color scheme
-st.markdown("""
-<style>
-    /* Global Styles */
-    @import url('https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600&display=swap');
-    
-    html, body, [class*="css"] {
-        font-family: 'Poppins', sans-serif;
-        color: #E2E8F0;
-    }
-    
-    /* Dark mode for Streamlit components */
-    .stApp {
-        background-color: #1A202C;
-    }
-    
-    /* Headers */
-    .main-header {
-        font-size: 2.5rem;
-        text-align: center;
-        margin-bottom: 1rem;
-        font-weight: 600;
-        background: linear-gradient(120deg, #38B2AC, #4299E1);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-    }
-    
-    .sub-header {
-        font-size: 1.5rem;
-        color: #90CDF4;
-        margin-top: 1.5rem;
-        margin-bottom: 1rem;
-        font-weight: 500;
-    }
-    
-    /* Cards and Containers */
-    .category-card {
-        background-color: #2D3748;
-        border-radius: 10px;
-        padding: 20px;
-        margin-bottom: 20px;
-        border-left: 5px solid #38B2AC;
-        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.3);
-    }
-    
-    .user-type-card {
-        background-color: #2D3748;
-        border-radius: 10px;
-        padding: 20px;
-        margin-bottom: 20px;
-        border-left: 5px solid #4299E1;
-        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.3);
-    }
-    
-    .upload-card {
-        background-color: #2D3748;
-        border-radius: 10px;
-        padding: 20px;
-        margin-bottom: 20px;
-        border-left: 5px solid #63B3ED;
-        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.3);
-    }
-    
-    .results-card {
-        background-color: #2D3748;
-        border-radius: 10px;
-        padding: 25px;
-        margin-top: 20px;
-        border-left: 5px solid #A0AEC0;
-        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.3);
-    }
-    
-    /* Icons and Status */
-    .icon-text {
-        display: flex;
-        align-items: center;
-        margin-bottom: 10px;
-    }
-    
-    .icon {
-        margin-right: 10px;
-        color: #38B2AC;
-    }
-    
-    .safe-tag {
-        color: #E6FFFA;
-        font-weight: 600;
-        padding: 3px 8px;
-        background-color: #285E61;
-        border-radius: 4px;
-        display: inline-block;
-    }
-    
-    .unsafe-tag {
-        color: #FFF5F5;
-        font-weight: 600;
-        padding: 3px 8px; 
-        background-color: #742A2A;
-        border-radius: 4px;
-        display: inline-block;
-    }
-    
-    .disclaimer-box {
-        background-color: #3C2A1E;
-        color: #FBD38D;
-        padding: 12px 16px;
-        border-radius: 8px;
-        margin: 15px 0;
-        border: 1px solid #744210;
-        font-size: 0.9rem;
-    }
-    
-    /* Buttons */
-    .stButton > button {
-        background-color: #38B2AC;
-        color: white;
-        font-weight: 500;
-        border-radius: 8px;
-        padding: 10px 24px;
-        border: none;
-        box-shadow: 0 2px 5px rgba(0, 0, 0, 0.2);
-        transition: all 0.3s ease;
-    }
-    
-    .stButton > button:hover {
-        background-color: #2C7A7B;
-        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.4);
-        transform: translateY(-2px);
-    }
-    
-    /* WhatsApp Button */
-    .whatsapp-button {
-        background-color: #25D366;
-        color: white;
-        font-weight: 500;
-        border-radius: 8px;
-        padding: 10px 24px;
-        border: none;
-        display: inline-flex;
-        align-items: center;
-        justify-content: center;
-        gap: 10px;
-        text-decoration: none;
-        margin: 10px 0;
-        box-shadow: 0 2px 5px rgba(0, 0, 0, 0.2);
-        transition: all 0.3s ease;
-    }
-    
-    .whatsapp-button:hover {
-        background-color: #128C7E;
-        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.4);
-        transform: translateY(-2px);
-    }
-    
-    .whatsapp-modal {
-        position: fixed;
-        top: 0;
-        left: 0;
-        width: 100%;
-        height: 100%;
-        background-color: rgba(0, 0, 0, 0.7);
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        z-index: 1000;
-    }
-    
-    .whatsapp-modal-content {
-        background-color: #2D3748;
-        padding: 30px;
-        border-radius: 15px;
-        width: 400px;
-        max-width: 90%;
-        box-shadow: 0 0 20px rgba(0, 0, 0, 0.5);
-    }
-    
-    .whatsapp-option {
-        background-color: #38B2AC;
-        color: white;
-        padding: 15px;
-        margin: 10px 0;
-        border-radius: 8px;
-        cursor: pointer;
-        display: flex;
-        align-items: center;
-        gap: 10px;
-        transition: all 0.3s ease;
-    }
-    
-    .whatsapp-option:hover {
-        background-color: #2C7A7B;
-        transform: translateY(-2px);
-    }
-    
-    .whatsapp-close {
-        background-color: #4A5568;
-        color: white;
-        padding: 10px 15px;
-        border-radius: 8px;
-        cursor: pointer;
-        text-align: center;
-        margin-top: 20px;
-    }
-    
-    /* Text inputs */
-    .stTextInput > div > div > input {
-        background-color: #4A5568;
-        color: #E2E8F0;
-        border: 1px solid #4A5568;
-    }
-    
-    /* Select boxes */
-    .stSelectbox > div > div {
-        background-color: #4A5568;
-        color: #E2E8F0;
-        border: 1px solid #4A5568;
-    }
-    
-    /* Radio buttons */
-    div.stRadio > div {
-        background-color: #4A5568;
-        padding: 10px;
-        border-radius: 8px;
-    }
-    
-    div.stRadio > div > label {
-        background-color: #2D3748;
-        color: #E2E8F0;
-        padding: 10px 15px;
-        border-radius: 6px;
-        margin: 5px;
-        box-shadow: 0 1px 3px rgba(0,0,0,0.2);
-        transition: all 0.2s ease;
-    }
-    
-    div.stRadio > div > label:hover {
-        background-color: #4A5568;
-        box-shadow: 0 2px 5px rgba(0,0,0,0.3);
-    }
-    
-    /* Footer */
-    .footer {
-        margin-top: 3rem;
-        padding-top: 1rem;
-        border-top: 1px solid #4A5568;
-        display: flex;
-        justify-content: space-between;
-        font-size: 0.8rem;
-        color: #A0AEC0;
-    }
-    
-    /* Category Icons */
-    .category-icon {
-        font-size: 24px;
-        margin-right: 10px;
-        vertical-align: middle;
-    }
-    
-    /* Upload Preview */
-    .upload-preview {
-        border: 1px dashed #63B3ED;
-        border-radius: 8px;
-        padding: 10px;
-        text-align: center;
-    }
-    
-    /* Links */
-    a {
-        color: #63B3ED;
-        text-decoration: none;
-        transition: all 0.2s ease;
-    }
-    
-    a:hover {
-        color: #90CDF4;
-        text-decoration: underline;
-    }
-    
-    /* Streamlit text elements */
-    p, div, span, label, .stMarkdown {
-        color: #E2E8F0;
-    }
-    
-    /* Info box */
-    .stAlert {
-        background-color: #2C3E50;
-        color: #A0AEC0;
-    }
-    
-    /* Calorie Counter Styles */
-    .calorie-card {
-        background-color: #2D3748;
-        border-radius: 10px;
-        padding: 20px;
-        margin-bottom: 20px;
-        border-left: 5px solid #ED8936;
-        box-shadow: 0 4px 8px rgba(0, 0, 0, 0.3);
-    }
-    
-    .calorie-table {
-        width: 100%;
-        margin-top: 15px;
-        border-collapse: separate;
-        border-spacing: 0;
-    }
-    
-    .calorie-table th {
-        background-color: #4A5568;
-        color: #E2E8F0;
-        padding: 10px;
-        text-align: left;
-        border-top-left-radius: 8px;
-        border-top-right-radius: 8px;
-    }
-    
-    .calorie-table td {
-        padding: 10px;
-        border-top: 1px solid #4A5568;
-    }
-    
-    .calorie-total {
-        font-weight: bold;
-        color: #ED8936;
-        font-size: 1.2rem;
-        margin-top: 15px;
-        padding: 10px;
-        background-color: #3C2A1E;
-        border-radius: 8px;
-        display: inline-block;
-    }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(page_css, unsafe_allow_html=True)
 
 # Add WhatsApp modal JavaScript for popup
-st.markdown("""
-<script>
-function showWhatsAppModal() {
-    document.getElementById('whatsapp-modal').style.display = 'flex';
-}
-
-function hideWhatsAppModal() {
-    document.getElementById('whatsapp-modal').style.display = 'none';
-}
-
-function openWhatsAppChat() {
-    window.open('__WHATSAPP_CHAT_LINK__', '_blank');
-    hideWhatsAppModal();
-}
-
-function shareResultsOnWhatsApp() {
-    window.open('__WHATSAPP_SHARE_LINK__', '_blank');
-    hideWhatsAppModal();
-}
-</script>
-""", unsafe_allow_html=True)
+st.markdown(page_js, unsafe_allow_html=True)
 
 # App header with icon
 st.markdown("<h1 class='main-header'>🩺 NurtureAI: Health Assistant</h1>", unsafe_allow_html=True)
 
-# Track if we have analysis results to share
-has_analysis_results = False
-analysis_text = ""
-
 # Sidebar
 with st.sidebar:
     st.image("https://i.imgur.com/jQrTAdQ.png", width=100)  # Replace with your logo
@@ -445,6 +167,12 @@ with st.sidebar:
     </a>
     """, unsafe_allow_html=True)
     
+    # Label reading (OCR) fast-path stats
+    if config.OCR_ENABLED and ocr_stats():
+        with st.expander("🔤 Label reading stats"):
+            for ocr_mode, counts in ocr_stats().items():
+                st.markdown(f"**{ocr_mode}**: {counts['text_only']} of {counts['attempts']} checks read from the label text")
+
     st.markdown("### Disclaimer")
     st.info("This app provides general information and is not a substitute for professional medical advice.")
     
@@ -452,325 +180,366 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("<div style='text-align: center; color: #A0AEC0;'>Version 2.2</div>", unsafe_allow_html=True)
 
-# Main layout with columns
-col1, col2 = st.columns([3, 2])
-
-with col1:
-    # Category selection with icons
-    st.markdown("<div class='category-card'>", unsafe_allow_html=True)
-    st.markdown("<p class='sub-header'>Step 1: Choose a Category</p>", unsafe_allow_html=True)
-    
-    mode = st.radio(
-        "Select what you want to analyze:",
-        (
-            "🍎 Food Safety Checker", 
-            "💊 Drug/Medicine Safety Checker", 
-            "🧴 Cosmetic Product Safety Checker",
-            "🔢 Check Calories"
-        ),
-        key="category"
-    )
+# Main panel: steps 1-5, preview and results. It runs as a fragment, so choosing a
+# category, user type or image reruns only this panel instead of the whole page.
+@st.fragment
+def analysis_panel():
+    started = time.perf_counter()
+
+    # Main layout with columns
+    col1, col2 = st.columns([3, 2])
+
+    with col1:
+        # Category selection with icons
+        st.markdown("<div class='category-card'>", unsafe_allow_html=True)
+        st.markdown("<p class='sub-header'>Step 1: Choose a Category</p>", unsafe_allow_html=True)
+    
+        mode = st.radio(
+            "Select what you want to analyze:",
+            (
+                "🍎 Food Safety Checker", 
+                "💊 Drug/Medicine Safety Checker", 
+                "🧴 Cosmetic Product Safety Checker",
+                "🔢 Check Calories"
+            ),
+            key="category"
+        )
     
-    # Display category description based on selection
-    if "Food" in mode:
-        st.markdown("Analyze food products, ingredients, supplements, and beverages for safety.")
-    elif "Drug" in mode:
-        st.markdown("Check medications, over-the-counter drugs, and supplements for safety concerns.")
-    elif "Cosmetic" in mode:
-        st.markdown("Evaluate skincare, makeup, and personal care products for harmful ingredients.")
-    elif "Calories" in mode:
-        st.markdown("Calculate total calories and get nutritional breakdown of food items in your image.")
-    st.markdown("</div>", unsafe_allow_html=True)
+        # Display category description based on selection
+        if "Food" in mode:
+            st.markdown("Analyze food products, ingredients, supplements, and beverages for safety.")
+        elif "Drug" in mode:
+            st.markdown("Check medications, over-the-counter drugs, and supplements for safety concerns.")
+        elif "Cosmetic" in mode:
+            st.markdown("Evaluate skincare, makeup, and personal care products for harmful ingredients.")
+        elif "Calories" in mode:
+            st.markdown("Calculate total calories and get nutritional breakdown of food items in your image.")
+        st.markdown("</div>", unsafe_allow_html=True)
     
-    # User type selection (hide for calorie checker)
-    if "Calories" not in mode:
-        st.markdown("<div class='user-type-card'>", unsafe_allow_html=True)
-        st.markdown("<p class='sub-header'>Step 2: Select User Type</p>", unsafe_allow_html=True)
+        # User type selection (hide for calorie checker)
+        if "Calories" not in mode:
+            st.markdown("<div class='user-type-card'>", unsafe_allow_html=True)
+            st.markdown("<p class='sub-header'>Step 2: Select User Type</p>", unsafe_allow_html=True)
         
-        user_type = st.selectbox(
-            "Are you a healthcare/medical professional?",
-            ("No, I am a regular user", "Yes, I am a healthcare professional")
-        )
+            user_type = st.selectbox(
+                "Are you a healthcare/medical professional?",
+                ("No, I am a regular user", "Yes, I am a healthcare professional")
+            )
         
-        # Explanation of different outputs
-        if user_type == "No, I am a regular user":
-            st.markdown("You'll receive simplified explanations with essential safety information.")
+            # Explanation of different outputs
+            if user_type == "No, I am a regular user":
+                st.markdown("You'll receive simplified explanations with essential safety information.")
+            else:
+                st.markdown("You'll receive more detailed, technical information with clinical references.")
+            st.markdown("</div>", unsafe_allow_html=True)
         else:
-            st.markdown("You'll receive more detailed, technical information with clinical references.")
+            # Set a default user type for calorie checker
+            user_type = "No, I am a regular user"
+    
+        # Image upload section
+        st.markdown("<div class='upload-card'>", unsafe_allow_html=True)
+        st.markdown("<p class='sub-header'>Step 3: Upload Image</p>", unsafe_allow_html=True)
+    
+        # Get category name for upload prompt
+        if "Food" in mode:
+            category_name = "food item"
+        elif "Drug" in mode or "Medicine" in mode:
+            category_name = "medicine/drug"
+        elif "Cosmetic" in mode:
+            category_name = "cosmetic product"
+        elif "Calories" in mode:
+            category_name = "meal or food items"
+    
+        batch_mode = st.checkbox("📦 Check several products at once", key="batch_mode")
+        if batch_mode:
+            uploaded_files = st.file_uploader(
+                f"Upload images of each {category_name} (up to {config.BATCH_MAX_FILES})",
+                type=["jpg", "jpeg", "png"],
+                accept_multiple_files=True
+            )
+            uploaded_file = None
+        else:
+            uploaded_files = []
+            uploaded_file = st.file_uploader(f"Upload an image of the {category_name}", type=["jpg", "jpeg", "png"])
+    
+        # Specific question
+        st.markdown("<p class='sub-header'>Step 4: Ask a Specific Question (Optional)</p>", unsafe_allow_html=True)
+    
+        # Different placeholder text based on category
+        placeholder_text = ""
+        if "Food" in mode:
+            placeholder_text = "E.g., Is this safe during the first trimester of pregnancy?"
+        elif "Drug" in mode:
+            placeholder_text = "E.g., Can I take this while breastfeeding?"
+        elif "Cosmetic" in mode:
+            placeholder_text = "E.g., Are there any harmful ingredients for sensitive skin?"
+        elif "Calories" in mode:
+            placeholder_text = "E.g., How does this compare to my daily caloric needs?"
+    
+        # The question and button share a form, so typing doesn't rerun anything until "Check Now"
+        with st.form("question_form", border=False):
+            user_input = st.text_input("Your question:", placeholder=placeholder_text, key="input")
+            language = st.selectbox("Answer language:", (ENGLISH, "Hausa"), key="language")
+
+            # Submit button
+            st.markdown("<p class='sub-header'>Step 5: Get Analysis</p>", unsafe_allow_html=True)
+            submit = st.form_submit_button("🔍 Check Now")
         st.markdown("</div>", unsafe_allow_html=True)
-    else:
-        # Set a default user type for calorie checker
-        user_type = "No, I am a regular user"
-    
-    # Image upload section
-    st.markdown("<div class='upload-card'>", unsafe_allow_html=True)
-    st.markdown("<p class='sub-header'>Step 3: Upload Image</p>", unsafe_allow_html=True)
-    
-    # Get category name for upload prompt
-    if "Food" in mode:
-        category_name = "food item"
-    elif "Drug" in mode or "Medicine" in mode:
-        category_name = "medicine/drug"
-    elif "Cosmetic" in mode:
-        category_name = "cosmetic product"
-    elif "Calories" in mode:
-        category_name = "meal or food items"
-    
-    uploaded_file = st.file_uploader(f"Upload an image of the {category_name}", type=["jpg", "jpeg", "png"])
-    
-    # Specific question
-    st.markdown("<p class='sub-header'>Step 4: Ask a Specific Question (Optional)</p>", unsafe_allow_html=True)
-    
-    # Different placeholder text based on category
-    placeholder_text = ""
-    if "Food" in mode:
-        placeholder_text = "E.g., Is this safe during the first trimester of pregnancy?"
-    elif "Drug" in mode:
-        placeholder_text = "E.g., Can I take this while breastfeeding?"
-    elif "Cosmetic" in mode:
-        placeholder_text = "E.g., Are there any harmful ingredients for sensitive skin?"
-    elif "Calories" in mode:
-        placeholder_text = "E.g., How does this compare to my daily caloric needs?"
-    
-    user_input = st.text_input("Your question:", placeholder=placeholder_text, key="input")
-    
-    # Submit button
-    st.markdown("<p class='sub-header'>Step 5: Get Analysis</p>", unsafe_allow_html=True)
-    submit = st.button("🔍 Check Now")
-    st.markdown("</div>", unsafe_allow_html=True)
 
-with col2:
-    # Preview area
-    if uploaded_file is not None:
-        image = Image.open(uploaded_file)
-        st.markdown("<p class='sub-header'>Preview</p>", unsafe_allow_html=True)
-        st.markdown("<div class='upload-preview'>", unsafe_allow_html=True)
-        st.image(image, caption=f"Uploaded {category_name}", use_container_width=True)
+    with col2:
+        # Preview area
+        if uploaded_file is not None:
+            # The preview shows the same normalized buffer that is sent for analysis
+            with stage("preview_prepare"):
+                prepared = prepare_upload(uploaded_file).prepared
+            st.markdown("<p class='sub-header'>Preview</p>", unsafe_allow_html=True)
+            st.markdown("<div class='upload-preview'>", unsafe_allow_html=True)
+            st.image(preview_image(prepared.data), caption=f"Uploaded {category_name}", use_container_width=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+            st.caption(f"Optimized upload: {prepared.describe()}")
+        elif uploaded_files:
+            # Batch files are held in the upload budget too; drop files removed from the uploader
+            get_upload_budget().retain(session_key(), {f.file_id for f in uploaded_files})
+            with stage("preview_prepare"):
+                previews = [preview_image(prepare_upload(f, replace=False).prepared.data) for f in uploaded_files[:6]]
+            st.markdown("<p class='sub-header'>Preview</p>", unsafe_allow_html=True)
+            st.image(previews, width=120)
+            st.caption(f"{len(uploaded_files)} images ready for batch analysis")
+        else:
+            # Nothing uploaded: free this session's buffer straight away
+            get_upload_budget().release(session_key())
+            st.markdown("<p class='sub-header'>Preview</p>", unsafe_allow_html=True)
+            # Dark mode preview box
+            st.markdown("""
+            <div style="background-color:#2D3748; padding:2rem; border-radius:10px; text-align:center; height:300px; display:flex; flex-direction:column; justify-content:center; align-items:center; border:1px dashed #63B3ED;">
+                <div style="font-size:3rem; margin-bottom:1rem;">📸</div>
+                <h3 style="color:#E2E8F0;">Upload an Image</h3>
+                <p style="color:#CBD5E0;">Please upload an image to analyze</p>
+            </div>
+            """, unsafe_allow_html=True)
+
+    # Handle batch submission: analyze every image concurrently and fill the table as results arrive
+    def run_batch_analysis(files, mode, user_type, user_input, language):
+        rows = [{"Image": f.name, "Verdict": "⏳ Waiting", "Summary": ""} for f in files]
+        st.markdown("<div class='results-card'>", unsafe_allow_html=True)
+        st.markdown("<h2 class='sub-header'>📝 Batch Results</h2>", unsafe_allow_html=True)
+        progress = st.progress(0.0)
+        table = st.empty()
+        table.table(rows)
+
+        results = [None] * len(files)
+        completed = 0
+        # The whole batch queues as this session, so it takes turns with other users.
+        # Each file is prepared into the session's upload budget, so a large batch
+        # spills to disk like a single large upload instead of bypassing the limits.
+        user_key = session_key()
+
+        def analyze_file(f):
+            held = prepare_upload(f, session=user_key, replace=False)
+            return analyze(
+                f.getvalue(), f.type, mode, user_type, user_input, prepared=held.prepared,
+                channel="batch", user_key=user_key, language=language,
+            )
+
+        for index, result, error in run_batch(files, analyze_file, config.BATCH_CONCURRENCY):
+            completed += 1
+            if error is not None:
+                rows[index].update({"Verdict": "⚠️ Failed", "Summary": str(error)})
+            else:
+                results[index] = result
+                remember_in_session(result.history_id)
+                verdict, summary = summarize_verdict(result.response)
+                rows[index].update({"Verdict": verdict + (" ⚡" if result.source else ""), "Summary": summary})
+            progress.progress(completed / len(files))
+            table.table(rows)
+
+        for f, result in zip(files, results):
+            if result is not None:
+                with st.expander(f"{f.name}"):
+                    # The calorie table is in English, so translated results show the text report
+                    render_analysis(result.response, mode, result.nutrition if language == ENGLISH else None)
+
+        report = "\n\n".join(f"{f.name}:\n{r.response}" for f, r in zip(files, results) if r is not None)
+        st.download_button(
+            label="💾 Save Batch Results",
+            data=report,
+            file_name="nurtureai_batch_analysis.txt",
+            mime="text/plain"
+        )
         st.markdown("</div>", unsafe_allow_html=True)
-    else:
-        st.markdown("<p class='sub-header'>Preview</p>", unsafe_allow_html=True)
-        # Dark mode preview box
-        st.markdown("""
-        <div style="background-color:#2D3748; padding:2rem; border-radius:10px; text-align:center; height:300px; display:flex; flex-direction:column; justify-content:center; align-items:center; border:1px dashed #63B3ED;">
-            <div style="font-size:3rem; margin-bottom:1rem;">📸</div>
-            <h3 style="color:#E2E8F0;">Upload an Image</h3>
-            <p style="color:#CBD5E0;">Please upload an image to analyze</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-# PROMPTS for each type
-food_prompt_regular = """
-You are a professional nutritionist advising a regular user.
-
-TASK:
-- Is the food product safe for pregnant women, breastfeeding mothers, babies, or general users?
-- Highlight major concerns: allergens, high sugar/salt/fat, additives.
-- Be brief and simple (2-4 sentences).
-- Only mention risks if medically confirmed (WHO, Mayo Clinic).
-- Suggest healthier alternatives if needed.
-
-Always end with:
-"⚠️ Please consult a healthcare professional for personalized advice."
-"""
-
-food_prompt_pro = """
-You are a clinical nutritionist advising a healthcare professional.
-
-TASK:
-- Provide nutritional breakdown (macros and calories if visible).
-- Highlight food safety issues (allergens, additives, unsafe preservatives).
-- Reference scientific studies if applicable.
-- Keep it concise but professional (around 6-8 sentences).
-- Recommend evidence-based alternatives if unhealthy.
-
-Always end with:
-"⚠️ Please consult a healthcare professional for personalized advice."
-"""
-
-drug_prompt_regular = """
-You are a pharmacist helping a regular user.
-
-TASK:
-- State if the drug/medicine is safe or NOT safe for pregnant women, breastfeeding mothers, children.
-- Warn about dangerous ingredients (e.g., isotretinoin, warfarin, NSAIDs during pregnancy).
-- Keep it brief and simple (2-4 sentences).
-
-Example Output:
-✅ Safe. OR ❌ Not Safe - Contains [ingredient] which may cause [issue].
-
-Always end with:
-"⚠️ Please consult a healthcare professional for personalized advice."
-"""
-
-drug_prompt_pro = """
-You are a clinical pharmacist advising a healthcare professional.
-
-TASK:
-- Analyze active ingredients and contraindications during pregnancy, lactation, and for pediatric use.
-- Provide pharmacological warnings and cite regulatory guidance (FDA Pregnancy Categories, WHO, PubMed).
-- Keep it detailed but compact (6-8 sentences).
-
-Always end with:
-"⚠️ Please consult a healthcare professional for personalized advice."
-"""
-
-cosmetic_prompt_regular = """
-You are a dermatologist helping a regular user.
-
-TASK:
-- Say if the cosmetic product is safe for pregnant women, breastfeeding mothers, babies, or sensitive users.
-- Highlight harmful chemicals (parabens, hydroquinone, mercury, retinoids, etc.)
-- Be simple and concise (2-4 sentences).
-
-Example Output:
-✅ Safe. OR ❌ Not Safe - Contains [ingredient] that may cause [harm].
-
-Always end with:
-"⚠️ Please consult a healthcare professional for personalized advice."
-"""
-
-cosmetic_prompt_pro = """
-You are a dermatopharmacologist helping a healthcare professional.
-
-TASK:
-- Analyze cosmetic product ingredients scientifically for toxicity, allergenicity, and pregnancy risk.
-- Cite evidence-based resources (EWG, FDA, WHO, PubMed).
-- Keep it professional and concise (6-8 sentences).
-
-Always end with:
-"⚠️ Please consult a healthcare professional for personalized advice."
-"""
-
-# NEW PROMPT for calorie checking
-calorie_prompt = """
-You are an expert nutritionist analyzing food items from an image.
-
-TASK:
-- Identify all visible food items in the image.
-- Calculate the approximate calories for each item.
-- Provide a detailed breakdown in this exact format:
-  1. Item 1 - X calories
-  2. Item 2 - X calories
-  (continue for all items)
-- Calculate and show the total calories.
-- Include a brief nutritional assessment (1-2 sentences).
-- If portions are unclear, base calculations on standard serving sizes.
-
-Always end with:
-"⚠️ Please consult a healthcare professional for personalized advice."
-"""
-
-# Handle submission and display results
-if submit:
-    try:
-        if uploaded_file is None:
-            st.error("⚠️ Please upload an image to analyze")
+
+    # Handle submission and display results
+    if submit and batch_mode:
+        if not uploaded_files:
+            st.error("⚠️ Please upload at least one image to analyze")
+        elif len(uploaded_files) > config.BATCH_MAX_FILES:
+            st.error(f"⚠️ Please upload at most {config.BATCH_MAX_FILES} images per batch")
         else:
-            # Show spinner while processing
-            with st.spinner("Analyzing image... Please wait"):
-                image_data = input_image_setup(uploaded_file)
-
-                # Clean mode string to get just the category
-                clean_mode = mode.split(" ")[0] if " " in mode else mode
-
-                # Select correct prompt
-                if "Food" in mode:
-                    input_prompt = food_prompt_regular if user_type == "No, I am a regular user" else food_prompt_pro
-                elif "Drug" in mode or "Medicine" in mode:
-                    input_prompt = drug_prompt_regular if user_type == "No, I am a regular user" else drug_prompt_pro
-                elif "Cosmetic" in mode:
-                    input_prompt = cosmetic_prompt_regular if user_type == "No, I am a regular user" else cosmetic_prompt_pro
-                elif "Calories" in mode:
-                    input_prompt = calorie_prompt
-
-                # Get AI response
-                response = get_gemini_response(input_prompt, image_data, user_input)
-
-                # Always add disclaimer
-                safe_response = ensure_medical_disclaimer(response)
-
-                # Store result for sharing
-                analysis_text = safe_response
-                has_analysis_results = True
-
-                # Get WhatsApp share link for the results
-                whatsapp_share_link = get_whatsapp_share_link(f"NurtureAI Analysis Results for {category_name}:\n\n{safe_response}")
-
-                # Display result with appropriate styling
-                st.markdown("<div class='results-card'>", unsafe_allow_html=True)
-                st.markdown("<h2 class='sub-header'>📝 Analysis Results</h2>", unsafe_allow_html=True)
-
-                # Special formatting for calorie checker
-                if "Calories" in mode:
-                    formatted_response = safe_response
-                    if "⚠️" in formatted_response:
-                        parts = formatted_response.split("⚠️")
-                        main_content = parts[0]
-                        disclaimer = "⚠️" + parts[1]
-                        st.markdown(main_content, unsafe_allow_html=True)
-                        st.markdown(f"<div class='disclaimer-box'>{disclaimer}</div>", unsafe_allow_html=True)
+            try:
+                run_batch_analysis(uploaded_files, mode, user_type, user_input, language)
+            except Exception as e:
+                st.error(f"An unexpected error occurred: {e}")
+    elif submit:
+        try:
+            if uploaded_file is None:
+                st.error("⚠️ Please upload an image to analyze")
+            else:
+                # Time each stage of this check for the metrics endpoint and request log
+                with RequestTrace(normalize_mode(mode), "professional" if user_type == PROFESSIONAL_USER else "regular", "web"):
+                    # Show spinner while processing
+                    with st.spinner("Analyzing image... Please wait"):
+                        # The same check done recently is answered from the history straight away
+                        image_hash = prepare_upload(uploaded_file).image_hash
+                        with stage("history_lookup"):
+                            past = repeated_check(image_hash, normalize_mode(mode), user_type, user_input, language)
+
+                        if past is None:
+                            with stage("image_prepare"):
+                                image_data = input_image_setup(uploaded_file)
+
+                            # Clean mode string to get just the category
+                            clean_mode = mode.split(" ")[0] if " " in mode else mode
+
+                            # Select correct prompt
+                            input_prompt = select_prompt(mode, user_type)
+
+                            # Cache, label text, ingredient rules and past verdicts are checked before the model
+                            check = precheck(input_prompt, image_data, mode, user_type, user_input)
+                            response, response_source = check.response, check.source
+                            label_text, rule_matches = check.label_text, check.rule_matches
+                        else:
+                            response, response_source, label_text, rule_matches = past.response, "history", None, []
+
+                    # Display result with appropriate styling
+                    st.markdown("<div class='results-card'>", unsafe_allow_html=True)
+                    st.markdown("<h2 class='sub-header'>📝 Analysis Results</h2>", unsafe_allow_html=True)
+                    if response_source == "history":
+                        st.caption(f"⚡ Same check as on {time.strftime('%d %b %H:%M', time.localtime(past.created))}")
+                    elif response_source == "cache":
+                        st.caption("⚡ Served from a recent identical check")
+                    elif response_source == "similar":
+                        st.caption("⚡ Matched a previously checked photo of the same product")
+                    elif response_source == "verdicts":
+                        st.caption("⚡ Matched a previous verdict for the same product")
+                    elif label_text:
+                        st.caption("🔤 Analyzed from the text read off the label")
+
+                    verdict_area = st.empty()
+                    result_area = st.empty()
+                    if response is None:
+                        if rule_matches:
+                            verdict_area.markdown(format_safety_tags(rule_verdict(rule_matches)), unsafe_allow_html=True)
+
+                        # Stream the answer into the results card as it arrives. Calorie answers
+                        # are item lines that only become a table once complete.
+                        def show_partial(text):
+                            result_area.markdown(format_safety_tags(text), unsafe_allow_html=True)
+
+                        # Show the place in the shared model queue while waiting
+                        def show_queue(ahead, wait):
+                            if ahead is None:
+                                result_area.markdown("⏳ Analyzing image... Please wait")
+                            elif ahead:
+                                checks = "check" if ahead == 1 else "checks"
+                                result_area.info(f"⏳ {ahead} {checks} ahead of you · about {wait:.0f}s to go")
+
+                        result_area.markdown("⏳ Analyzing image... Please wait")
+                        response, model_source = model_answer(
+                            check, input_prompt, image_data, mode, user_type, user_input,
+                            on_chunk=show_partial if config.MODEL_STREAMING and "Calories" not in mode else None,
+                            on_wait=show_queue,
+                            user_key=session_key(),
+                        )
+                        # The finished answer carries the local verdict and notes itself
+                        verdict_area.empty()
+                        if model_source == "coalesced":
+                            st.caption("⚡ Shared with an identical check that was already in progress")
+                        elif model_source == "rules":
+                            st.caption("⏳ The full analysis is unavailable right now; showing the local ingredient check")
+                        response_source = model_source
+
+                    if past is not None:
+                        safe_response = past.response
+                        meal = MealEstimate.from_dict(past.nutrition) if past.nutrition and language == ENGLISH else None
                     else:
-                        st.markdown(formatted_response, unsafe_allow_html=True)
-                else:
-                    formatted_response = safe_response
-                    if "✅" in formatted_response:
-                        formatted_response = formatted_response.replace("✅", "<span class='safe-tag'>✅ SAFE</span>")
-                    if "❌" in formatted_response:
-                        formatted_response = formatted_response.replace("❌", "<span class='unsafe-tag'>❌ NOT SAFE</span>")
-
-                    if "⚠️" in formatted_response:
-                        parts = formatted_response.split("⚠️")
-                        main_content = parts[0]
-                        disclaimer = "⚠️" + parts[1]
-                        st.markdown(main_content, unsafe_allow_html=True)
-                        st.markdown(f"<div class='disclaimer-box'>{disclaimer}</div>", unsafe_allow_html=True)
-                    else:
-                        st.markdown(formatted_response, unsafe_allow_html=True)
-
-                # Add action buttons (Save, Share to WhatsApp)
-                col_btn1, col_btn2, col_btn3 = st.columns(3)
-
-                with col_btn1:
-                    st.download_button(
-                        label="💾 Save Results",
-                        data=safe_response,
-                        file_name=f"nurtureai_{category_name}_analysis.txt",
-                        mime="text/plain"
-                    )
-
-                with col_btn2:
-                    # WhatsApp share button
-                    st.markdown(f"""
-                        <a href="{whatsapp_share_link}" target="_blank" class="whatsapp-button">
-                            <svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="currentColor">
-                                <path d="M17.472 14.382c..."/>
-                            </svg>
-                            Share on WhatsApp
-                        </a>
+                        # Always add disclaimer; calorie totals are computed locally
+                        safe_response, meal = final_response(mode, response)
+                        if language != ENGLISH:
+                            # Recurring sentences come from the translation memory, the rest in one model call
+                            safe_response = get_translator().translate(safe_response, language, session_key())
+                        remember_in_session(remember_check(
+                            session_key(), "web", normalize_mode(mode), user_type, language, image_hash,
+                            user_input, safe_response, response_source, meal,
+                        ))
+                        if language != ENGLISH:
+                            meal = None
+
+                    # Get WhatsApp share link for the results
+                    whatsapp_share_link = get_whatsapp_share_link(f"NurtureAI Analysis Results for {category_name}:\n\n{safe_response}")
+
+                    with stage("render"), result_area.container():
+                        render_analysis(safe_response, mode, meal)
+
+                    # Add action buttons (Save, Share to WhatsApp)
+                    col_btn1, col_btn2, col_btn3 = st.columns(3)
+
+                    with col_btn1:
+                        st.download_button(
+                            label="💾 Save Results",
+                            data=safe_response,
+                            file_name=f"nurtureai_{category_name}_analysis.txt",
+                            mime="text/plain"
+                        )
+
+                    with col_btn2:
+                        # WhatsApp share button
+                        st.markdown(f"""
+                            <a href="{whatsapp_share_link}" target="_blank" class="whatsapp-button">
+                                <svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="currentColor">
+                                    <path d="M17.472 14.382c..."/>
+                                </svg>
+                                Share on WhatsApp
+                            </a>
+                        """, unsafe_allow_html=True)
+
+                    with col_btn3:
+                        # WhatsApp chat button for follow-up
+                        chat_link = get_whatsapp_chat_link()
+                        st.markdown(f"""
+                            <a href="{chat_link}" target="_blank" class="whatsapp-button" style="background-color: #128C7E;">
+                                <svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="currentColor">
+                                    <path d="M17.472 14.382c..."/>
+                                </svg>
+                                Chat with Expert
+                            </a>
+                        """, unsafe_allow_html=True)
+
+                    st.markdown("</div>", unsafe_allow_html=True)
+
+                    # Add a footer with additional information
+                    st.markdown("<div class='footer'>", unsafe_allow_html=True)
+                    st.markdown("""
+                        <div>
+                            © 2025 NurtureAI | All rights reserved.
+                        </div>
                     """, unsafe_allow_html=True)
-
-                with col_btn3:
-                    # WhatsApp chat button for follow-up
-                    chat_link = get_whatsapp_chat_link()
-                    st.markdown(f"""
-                        <a href="{chat_link}" target="_blank" class="whatsapp-button" style="background-color: #128C7E;">
-                            <svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="0 0 24 24" fill="currentColor">
-                                <path d="M17.472 14.382c..."/>
-                            </svg>
-                            Chat with Expert
-                        </a>
-                    """, unsafe_allow_html=True)
-
-                st.markdown("</div>", unsafe_allow_html=True)
-
-                # Add a footer with additional information
-                st.markdown("<div class='footer'>", unsafe_allow_html=True)
-                st.markdown("""
-                    <div>
-                        © 2025 NurtureAI | All rights reserved.
-                    </div>
-                """, unsafe_allow_html=True)
-                st.markdown("</div>", unsafe_allow_html=True)
-
-    except Exception as e:
-        st.error(f"An unexpected error occurred: {e}")
+                    st.markdown("</div>", unsafe_allow_html=True)
+
+        except ModelUnavailable as e:
+            st.warning(f"⏳ {e}")
+        except Exception as e:
+            st.error(f"An unexpected error occurred: {e}")
+
+    # This session's earlier checks, read back from the history store by id
+    history_ids = st.session_state.get("history_ids")
+    if history_ids:
+        with st.expander("🕘 Recent checks"):
+            for entry in get_history().get_many(history_ids):
+                verdict, summary = summarize_verdict(entry.response)
+                checked = time.strftime("%d %b %H:%M", time.localtime(entry.created))
+                st.markdown(f"**{verdict}** · {entry.mode} · {checked}  \n{summary}")
+
+    logger.debug("Analysis panel run took %.1f ms", (time.perf_counter() - started) * 1000)
+
+analysis_panel()
+logger.debug("Page run took %.1f ms", (time.perf_counter() - page_started) * 1000)
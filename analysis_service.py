@@ -0,0 +1,409 @@
+import logging
+from collections import namedtuple
+
+import config
+from prompts import PROFESSIONAL_USER, normalize_mode, normalize_user_type, select_prompt
+from response_cache import get_response_cache, make_cache_key
+from perceptual_index import dhash_bytes, get_perceptual_index, make_scope
+from gemini_client import get_gemini_client
+from image_pipeline import prepare_image
+from label_ocr import label_text_for, label_text_part
+from ingredient_rules import label_matches, match_ingredients, question_matches, rule_verdict
+from nutrition import MealEstimate, calorie_report, estimate_meal
+from sms import SHORT_DISCLAIMER, render_sms
+from verdict_store import product_text_for, retrieve_verdicts, store_verdict_async
+from guidelines import retrieve_guidelines
+from metrics import RequestTrace, current_trace, registry, stage
+from resilience import ModelTimeout, ModelUnavailable, get_resilient_caller
+from single_flight import get_single_flight
+from model_scheduler import get_model_scheduler
+from translation import ENGLISH, get_translator, normalize_language
+from history import get_history, upload_hash
+from upload_memory import payload_bytes
+
+# The analysis pipeline without any Streamlit dependency: image preparation,
+# prompt selection, the cache/OCR/rules/retrieval pre-checks, the Gemini call and
+# result formatting. The web app, batch mode and the HTTP API all go through here.
+
+logger = logging.getLogger(__name__)
+
+DISCLAIMER = "⚠️ Please consult a healthcare professional for personalized advice."
+
+# What is known before the model is called. `response` is set when a cache,
+# rule or past verdict already answers the question.
+Precheck = namedtuple("Precheck", "response source label_text rule_matches grounding product_text")
+
+AnalysisResult = namedtuple(
+    "AnalysisResult",
+    "mode user_type response source label_text matched_ingredients rule_notes bytes_saved nutrition language history_id",
+)
+
+
+# Image parts for the model request from a prepared image
+def image_parts_for(prepared):
+    return [{
+        "mime_type": prepared.mime_type,
+        "data": prepared.data
+    }]
+
+# Build the model request; when the label text was read locally it replaces the image,
+# and grounding from similar past verdicts and guideline passages is added before the question
+def build_contents(input_prompt, image, user_input, label_text=None, grounding=None):
+    if label_text:
+        payload = label_text_part(label_text)
+    else:
+        # A spilled upload is copied to bytes only for this request
+        payload = {"mime_type": image[0]["mime_type"], "data": payload_bytes(image[0]["data"])}
+    contents = [input_prompt, payload]
+    if grounding:
+        contents.append(grounding)
+    contents.append(user_input)
+    return contents
+
+# Record the size of what is actually sent upstream (label text replaces the image)
+def _record_payload(image, label_text):
+    trace = current_trace()
+    if trace is not None:
+        trace.set(payload_bytes=len(label_text.encode("utf-8")) if label_text else len(image[0]["data"]))
+
+# Function to get a response from the shared Gemini client, within the mode's
+# deadline and hedged when slow (see resilience.py)
+def get_gemini_response(input_prompt, image, user_input, label_text=None, grounding=None, mode=None):
+    _record_payload(image, label_text)
+    client = get_gemini_client()
+    contents = build_contents(input_prompt, image, user_input, label_text, grounding)
+    with stage("model"):
+        return get_resilient_caller().call(
+            normalize_mode(mode) if mode else "", lambda timeout: client.generate(contents, timeout=timeout)
+        )
+
+# Function to stream a response from the shared Gemini client, chunk by chunk
+def stream_gemini_response(input_prompt, image, user_input, label_text=None, grounding=None, mode=None):
+    _record_payload(image, label_text)
+    client = get_gemini_client()
+    contents = build_contents(input_prompt, image, user_input, label_text, grounding)
+    return get_resilient_caller().stream(
+        normalize_mode(mode) if mode else "", lambda timeout: client.stream(contents, timeout=timeout)
+    )
+
+# Perceptual hashes (coarse, detail) of the image payload, or None if they can't be computed
+def image_phash(image):
+    try:
+        return dhash_bytes(image[0]["data"])
+    except Exception:
+        return None
+
+# Look for a previous answer in the response cache and the near-duplicate index.
+# Returns (text, source) where source is "cache" or "similar", or (None, None) on a miss.
+def lookup_cached_response(input_prompt, image, user_input):
+    key = make_cache_key(image[0]["data"], input_prompt, user_input)
+    if config.CACHE_ENABLED:
+        cached = get_response_cache().get(key)
+        if cached is not None:
+            return cached, "cache"
+
+    if config.PHASH_ENABLED:
+        hashes = image_phash(image)
+        if hashes is not None:
+            phash, detail = hashes
+            match = get_perceptual_index().lookup(phash, make_scope(input_prompt, user_input), detail)
+            if match is not None:
+                if config.CACHE_ENABLED:
+                    get_response_cache().put(key, match[0])
+                return match[0], "similar"
+    return None, None
+
+# Store a fresh model answer so repeat and near-duplicate checks can reuse it
+def remember_response(input_prompt, image, user_input, response):
+    if config.CACHE_ENABLED:
+        get_response_cache().put(make_cache_key(image[0]["data"], input_prompt, user_input), response)
+    if config.PHASH_ENABLED:
+        hashes = image_phash(image)
+        if hashes is not None:
+            phash, detail = hashes
+            get_perceptual_index().add(phash, make_scope(input_prompt, user_input), response, detail)
+
+# Run every local check that can answer (or improve) the request before the model call
+def precheck(input_prompt, image, mode, user_type, user_input):
+    mode = normalize_mode(mode)
+    check = _precheck(input_prompt, image, mode, user_type, user_input)
+    trace = current_trace()
+    if trace is not None and check.response is not None:
+        trace.set(source=check.source)
+    return check
+
+def _precheck(input_prompt, image, mode, user_type, user_input):
+    with stage("cache_lookup"):
+        response, source = lookup_cached_response(input_prompt, image, user_input)
+    if response is not None:
+        return Precheck(response, source, None, [], None, "")
+
+    # Drug and cosmetic labels can be read locally and sent as text
+    with stage("ocr"):
+        label_text = label_text_for(mode, image[0]["data"])
+    # Known red-flag ingredients give an instant local verdict
+    with stage("rules"):
+        rule_matches = match_ingredients(mode, label_text, user_input)
+    product_text = product_text_for(label_text, user_input)
+    # Only ingredients on the label decide the verdict; one named in the question may not be in the product
+    if label_matches(rule_matches) and not config.RULES_EXPLAIN:
+        return Precheck(rule_verdict(rule_matches), "rules", label_text, rule_matches, None, product_text)
+
+    # Past verdicts for similar products are reused or used as grounding
+    with stage("retrieval"):
+        response, grounding = retrieve_verdicts(mode, user_type, product_text)
+    if response is None:
+        # Professional answers cite passages from the ingested guidelines
+        with stage("guidelines"):
+            guidance = retrieve_guidelines(mode, user_type, product_text or user_input)
+        grounding = "\n\n".join(part for part in (grounding, guidance) if part) or None
+    return Precheck(response, "verdicts" if response is not None else None, label_text, rule_matches, grounding, product_text)
+
+# Combine a fresh model answer with any local verdict (before it) and the notes on
+# ingredients named in the question (after it, ahead of the model's disclaimer),
+# and store it for reuse
+def complete_analysis(check, input_prompt, image, mode, user_type, user_input, model_response):
+    response = model_response
+    if label_matches(check.rule_matches):
+        response = rule_verdict(label_matches(check.rule_matches)) + "\n\n" + response
+    if question_matches(check.rule_matches):
+        notes = rule_verdict(question_matches(check.rule_matches))
+        body, marker, disclaimer = response.rpartition("⚠️")
+        response = f"{body.rstrip()}\n\n{notes}\n\n{marker}{disclaimer}" if marker else f"{response}\n\n{notes}"
+    with stage("cache_store"):
+        remember_response(input_prompt, image, user_input, response)
+    store_verdict_async(normalize_mode(mode), user_type, check.product_text, response)
+    return response
+
+# Local answer to serve when the model is unavailable (breaker open or deadline
+# passed): the rule verdict (or the note on ingredients named in the question)
+# if any red-flag ingredient matched, else None
+def fallback_response(check):
+    if not check.rule_matches:
+        return None
+    trace = current_trace()
+    if trace is not None:
+        trace.set(source="rules")
+    return rule_verdict(check.rule_matches)
+
+# Get the model's answer for a pre-checked request and finish it (rule verdict,
+# caches, verdict store). Identical requests in flight at the same time share one
+# upstream call, which runs on the shared model workers in user_key's turn.
+# With on_chunk, the answer is streamed as on_chunk(text_so_far); only the leading
+# request streams, the others get the finished answer. on_wait(requests_ahead,
+# estimated_wait_seconds) is called while the request is queued.
+# Returns (response, source): source is None for a fresh answer, "coalesced" when
+# another request's answer was shared, or "rules" for the local fallback while
+# the model is unavailable or overloaded.
+def model_answer(check, input_prompt, image, mode, user_type, user_input, on_chunk=None, on_wait=None,
+                 user_key=None):
+    def upstream(emit):
+        if on_chunk is None:
+            return get_gemini_response(input_prompt, image, user_input, check.label_text, check.grounding, mode=mode)
+        for chunk in stream_gemini_response(input_prompt, image, user_input, check.label_text, check.grounding, mode=mode):
+            emit(chunk)
+
+    def run():
+        # Callers without a key each count as their own user
+        ticket = get_model_scheduler().submit(user_key or object(), upstream)
+        with stage("model_queue"):
+            ticket.wait_started(on_wait)
+        model_response = ticket.result() if on_chunk is None else _stream_to(on_chunk, ticket.stream())
+        return complete_analysis(check, input_prompt, image, mode, user_type, user_input, model_response)
+
+    try:
+        if not config.SINGLE_FLIGHT_ENABLED:
+            return run(), None
+        # Followers have no timeout of their own: they wait as long as the leader
+        # (queue, rate limit and deadline) and end with its answer or error
+        response, shared = get_single_flight().do(make_cache_key(image[0]["data"], input_prompt, user_input), run)
+    except (ModelUnavailable, TimeoutError) as e:
+        response = fallback_response(check)
+        if response is None:
+            if isinstance(e, ModelUnavailable):
+                raise
+            raise ModelTimeout(str(e)) from e
+        return response, "rules"
+
+    if not shared:
+        return response, None
+    trace = current_trace()
+    if trace is not None:
+        trace.set(source="coalesced")
+    return response, "coalesced"
+
+def _stream_to(on_chunk, chunks):
+    with stage("model_first_chunk"):
+        text = next(chunks, "")
+    on_chunk(text)
+    with stage("model_stream"):
+        for chunk in chunks:
+            text += chunk
+            on_chunk(text)
+    return text
+
+# Run the whole pipeline for one image
+def analyze(image_bytes, mime_type, mode, user_type="", user_input="", prepared=None,
+            channel="api", user_key=None, language=None):
+    mode = normalize_mode(mode)
+    user_type = normalize_user_type(user_type)
+    language = normalize_language(language)
+    user_input = user_input or ""
+    image_hash = upload_hash(image_bytes)
+    with RequestTrace(mode, "professional" if user_type == PROFESSIONAL_USER else "regular", channel):
+        # A repeat of a recent check is answered before the image is even prepared
+        with stage("history_lookup"):
+            past = repeated_check(image_hash, mode, user_type, user_input, language)
+        if past is not None:
+            return result_from_history(past)
+        with stage("image_prepare"):
+            prepared = prepared or prepare_image(image_bytes, mime_type)
+        image = image_parts_for(prepared)
+        input_prompt = select_prompt(mode, user_type)
+
+        check = precheck(input_prompt, image, mode, user_type, user_input)
+        response, source = check.response, check.source
+        if response is None:
+            response, source = model_answer(
+                check, input_prompt, image, mode, user_type, user_input, user_key=user_key
+            )
+        response, meal = final_response(mode, response)
+        response = get_translator().translate(response, language, user_key)
+
+    history_id = remember_check(user_key, channel, mode, user_type, language, image_hash, user_input, response, source, meal)
+    return AnalysisResult(
+        mode=mode,
+        user_type=user_type,
+        response=response,
+        source=source,
+        label_text=check.label_text,
+        matched_ingredients=[m.ingredient for m in label_matches(check.rule_matches)],
+        rule_notes=[rule_verdict([m]) for m in question_matches(check.rule_matches)],
+        bytes_saved=prepared.bytes_saved,
+        nutrition=meal,
+        language=language,
+        history_id=history_id,
+    )
+
+# The latest answer to the same check (see history.py), or None
+def repeated_check(image_hash, mode, user_type, user_input, language):
+    if not config.HISTORY_ENABLED:
+        return None
+    try:
+        entry = get_history().find_repeat(mode, user_type, language, image_hash, user_input)
+    except Exception as e:
+        logger.warning("History lookup failed: %s", e)
+        return None
+    if entry is not None:
+        registry.increment("nurtureai_history_repeats_total", {"mode": mode})
+        trace = current_trace()
+        if trace is not None:
+            trace.set(source="history")
+    return entry
+
+# Store a final answer in the history; returns its id (None when it wasn't stored)
+def remember_check(user_key, channel, mode, user_type, language, image_hash, user_input, response, source, meal):
+    if not config.HISTORY_ENABLED:
+        return None
+    try:
+        return get_history().record(
+            user_key, channel, mode, user_type, language, image_hash, user_input, response, source,
+            meal.to_dict() if meal is not None else None,
+        )
+    except Exception as e:
+        logger.warning("Could not store analysis history: %s", e)
+        return None
+
+def result_from_history(entry):
+    return AnalysisResult(
+        mode=entry.mode,
+        user_type=entry.user_type,
+        response=entry.response,
+        source="history",
+        label_text=None,
+        matched_ingredients=[],
+        rule_notes=[],
+        bytes_saved=0,
+        nutrition=MealEstimate.from_dict(entry.nutrition) if entry.nutrition else None,
+        language=entry.language,
+        history_id=entry.id,
+    )
+
+# The text shown to the user, plus the locally computed meal breakdown in calorie
+# mode (None otherwise, or when the response lists no items)
+def final_response(mode, response):
+    meal = estimate_meal(response) if normalize_mode(mode) == "Calories" else None
+    if meal is not None:
+        response = calorie_report(meal)
+    return ensure_medical_disclaimer(response), meal
+
+# Ensure medical disclaimer is added
+def ensure_medical_disclaimer(text):
+    if DISCLAIMER not in text:
+        text += f"\n\n{DISCLAIMER}"
+    return text
+
+# Replace the ✅/❌ markers with the styled safe/unsafe tags
+def format_safety_tags(text):
+    if "✅" in text:
+        text = text.replace("✅", "<span class='safe-tag'>✅ SAFE</span>")
+    if "❌" in text:
+        text = text.replace("❌", "<span class='unsafe-tag'>❌ NOT SAFE</span>")
+    return text
+
+# Split a response into its main content and the trailing disclaimer (None if there is none)
+def split_disclaimer(text):
+    if "⚠️" not in text:
+        return text, None
+    parts = text.split("⚠️")
+    return parts[0], "⚠️" + parts[1]
+
+# Short verdict and first line of a response, for tables and structured output
+def summarize_verdict(text):
+    if "❌" in text:
+        verdict = "❌ Not safe"
+    elif "✅" in text:
+        verdict = "✅ Safe"
+    else:
+        verdict = "ℹ️ See details"
+    summary = next((line.strip() for line in text.splitlines() if line.strip()), "")
+    return verdict, summary[:160]
+
+# JSON-ready dict for an analysis result
+def result_to_dict(result):
+    verdict, summary = summarize_verdict(result.response)
+    main_content, disclaimer = split_disclaimer(result.response)
+    return {
+        "mode": result.mode,
+        "user_type": "professional" if result.user_type == PROFESSIONAL_USER else "regular",
+        "verdict": verdict,
+        "summary": summary,
+        "analysis": main_content.strip(),
+        "disclaimer": disclaimer,
+        "response": result.response,
+        "source": result.source or "model",
+        "matched_ingredients": result.matched_ingredients,
+        "rule_notes": result.rule_notes,
+        "bytes_saved": result.bytes_saved,
+        "nutrition": result.nutrition.to_dict() if result.nutrition else None,
+        "language": result.language,
+        "history_id": result.history_id,
+        "sms": sms_to_dict(render_sms(result.response, disclaimer=localized_sms_disclaimer(result.language))),
+    }
+
+# The SMS disclaimer in the result's language (None keeps the English default)
+def localized_sms_disclaimer(language):
+    if language in (None, ENGLISH):
+        return None
+    return get_translator().translate(SHORT_DISCLAIMER, language)
+
+# SMS rendering of a response for the messaging channels
+def sms_to_dict(message):
+    return {
+        "text": message.text,
+        "segments": message.segments,
+        "segment_count": message.segment_count,
+        "encoding": message.encoding,
+        "cost": message.cost,
+        "currency": config.SMS_CURRENCY,
+    }
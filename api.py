@@ -0,0 +1,178 @@
+import anyio
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+import config
+from analysis_service import analyze, result_to_dict
+from label_ocr import start_ocr_warmup
+from job_queue import QueueFull, get_job_queue, start_workers
+from resilience import ModelUnavailable, get_resilient_caller
+from single_flight import get_single_flight
+from model_scheduler import get_model_scheduler
+from translation import get_translator
+from embedding_cache import CachedEmbedder, get_embedder
+from image_pipeline import InvalidImage, check_image
+from metrics import render_metrics
+from prompts import normalize_mode, normalize_user_type
+
+# Headless HTTP API for the analysis pipeline, for the WhatsApp/SMS channels.
+# Run with:  uvicorn api:app --host 0.0.0.0 --port 8000
+#
+# Requests are handled on the event loop; the blocking pipeline runs in worker
+# threads, capped by NURTUREAI_API_MAX_WORKERS, so one process serves many
+# concurrent webhook calls while the model semaphore and rate limiter keep
+# upstream usage within quota.
+
+app = FastAPI(title="NurtureAI API", version="2.2")
+
+ALLOWED_TYPES = ("image/jpeg", "image/png", "image/webp")
+
+_workers = None
+_job_workers = None
+
+
+@app.on_event("startup")
+async def warm_up():
+    global _workers, _job_workers
+    # The limiter must be created inside the running event loop
+    _workers = anyio.CapacityLimiter(config.API_MAX_WORKERS)
+    start_ocr_warmup()
+    if config.QUEUE_WORKERS > 0:
+        _job_workers = start_workers()
+
+
+@app.on_event("shutdown")
+async def shut_down():
+    if _job_workers is not None:
+        _job_workers.stop(timeout=5)
+
+
+@app.get("/health")
+async def health():
+    embedder = get_embedder()
+    return {
+        "status": "ok",
+        "model_breaker": get_resilient_caller().breaker.state,
+        "single_flight": get_single_flight().stats(),
+        "model_queue": get_model_scheduler().stats(),
+        "translation": get_translator().stats(),
+        "embedding_cache": embedder.cache.stats() if isinstance(embedder, CachedEmbedder) else None,
+    }
+
+
+# Validate the form fields and read the image bytes; undecodable images get 422
+async def read_request(image, mode, user_type):
+    try:
+        mode = normalize_mode(mode)
+        user_type = normalize_user_type(user_type)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if image.content_type not in ALLOWED_TYPES:
+        raise HTTPException(status_code=415, detail=f"Unsupported image type: {image.content_type}")
+
+    data = await image.read()
+    if not data:
+        raise HTTPException(status_code=422, detail="Empty image")
+    if len(data) > config.API_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    try:
+        await anyio.to_thread.run_sync(lambda: check_image(data), limiter=_workers)
+    except InvalidImage as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return mode, user_type, data
+
+
+# Who a request counts as in the shared model queue: the sender's number or the
+# caller's own user id; the client address only when neither is given, since
+# behind a proxy or messaging gateway every request comes from the same address
+def queue_user_key(request, reply_to="", user_id=""):
+    if reply_to.strip():
+        return reply_to.strip()
+    if user_id.strip():
+        return f"user:{user_id.strip()}"
+    return request.client.host if request.client else None
+
+
+# Analyze a product photo. Form fields: image (file), mode, user_type, question,
+# language, and reply_to (sender number) or user_id to identify the end user.
+@app.post("/analyze")
+async def analyze_image(
+    request: Request,
+    image: UploadFile = File(...),
+    mode: str = Form(...),
+    user_type: str = Form("regular"),
+    question: str = Form(""),
+    language: str = Form("en"),
+    reply_to: str = Form(""),
+    user_id: str = Form(""),
+):
+    mode, user_type, data = await read_request(image, mode, user_type)
+    # Each user takes turns with the others in the shared model queue
+    user_key = queue_user_key(request, reply_to, user_id)
+    try:
+        result = await anyio.to_thread.run_sync(
+            lambda: analyze(data, image.content_type, mode, user_type, question, user_key=user_key, language=language),
+            limiter=_workers,
+        )
+    except InvalidImage as e:
+        # Passed the structure check but the pixel data is broken (e.g. truncated)
+        raise HTTPException(status_code=422, detail=str(e))
+    except ModelUnavailable as e:
+        retry_after = int(get_resilient_caller().breaker.cooldown)
+        return JSONResponse({"detail": str(e)}, status_code=503, headers={"Retry-After": str(retry_after)})
+    return result_to_dict(result)
+
+
+# Queue a messaging request (e.g. an inbound WhatsApp photo) and acknowledge at once.
+# message_id is the idempotency key: redelivered webhooks return the existing job.
+@app.post("/jobs", status_code=202)
+async def enqueue_job(
+    message_id: str = Form(...),
+    image: UploadFile = File(...),
+    mode: str = Form(...),
+    user_type: str = Form("regular"),
+    question: str = Form(""),
+    reply_to: str = Form(""),
+    language: str = Form("en"),
+    user_id: str = Form(""),
+):
+    mode, user_type, data = await read_request(image, mode, user_type)
+    payload = {
+        "mime_type": image.content_type,
+        "mode": mode,
+        "user_type": user_type,
+        "question": question,
+        "reply_to": reply_to,
+        "user_id": user_id,
+        "language": language,
+    }
+    queue = get_job_queue()
+    try:
+        job_id, created = await anyio.to_thread.run_sync(lambda: queue.enqueue(payload, data, message_id))
+    except QueueFull as e:
+        stats = queue.stats()
+        retry_after = max(1, int(stats["oldest_age_seconds"]))
+        return JSONResponse(
+            {"detail": str(e), "queue": stats}, status_code=503, headers={"Retry-After": str(retry_after)}
+        )
+    return {"job_id": job_id, "created": created, "status": "queued" if created else "duplicate"}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await anyio.to_thread.run_sync(lambda: get_job_queue().get(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+# Queue depth and oldest-job age, for autoscaling and alerting
+@app.get("/queue/stats")
+async def queue_stats():
+    return await anyio.to_thread.run_sync(get_job_queue().stats)
+
+
+# Prometheus-style metrics for this process
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return render_metrics()
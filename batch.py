@@ -0,0 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Runs many analyses concurrently. Items are fanned out to a thread pool and
+# results are yielded as each one finishes, so the caller can render them
+# progressively; a 20-item batch takes roughly as long as its slowest call
+# (subject to the rate limiter) rather than the sum of all calls.
+
+
+# Run analyze(item) for every item; yields (index, result, error) in completion order
+def run_batch(items, analyze, concurrency, initializer=None):
+    items = list(items)
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items))), initializer=initializer) as executor:
+        futures = {executor.submit(analyze, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield index, future.result(), None
+            except Exception as e:
+                yield index, None, e
@@ -0,0 +1,295 @@
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Offline benchmark for NurtureAI. The real Gemini API is replaced with
+# FakeGeminiClient, so runs are free, repeatable and need no network.
+#
+#   python benchmark.py pipeline --requests 100 --concurrency 1,4,16
+#   python benchmark.py app --sessions 1,2,4,8
+#   python benchmark.py all --output bench.json
+#
+# "pipeline" drives analysis_service for every mode and user type at each
+# concurrency level; "app" runs headless Streamlit sessions (AppTest) at
+# increasing concurrency, one process per session. Results are printed as
+# JSON: p50/p95/p99 latency, throughput, error counts, CPU and peak RSS.
+# Answer caches (response cache, perceptual index and analysis history) are
+# off unless --cache is given, and every concurrency level asks different
+# questions, so no level is answered from an earlier one.
+
+CASES = [
+    ("Food", "regular"),
+    ("Food", "professional"),
+    ("Drug", "regular"),
+    ("Drug", "professional"),
+    ("Cosmetic", "regular"),
+    ("Cosmetic", "professional"),
+    ("Calories", "regular"),
+]
+
+APP_CATEGORIES = (
+    "🍎 Food Safety Checker",
+    "💊 Drug/Medicine Safety Checker",
+    "🧴 Cosmetic Product Safety Checker",
+    "🔢 Check Calories",
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline NurtureAI benchmark with a fake Gemini backend")
+    parser.add_argument("suite", choices=("pipeline", "app", "all"))
+    parser.add_argument("--requests", type=int, default=50, help="requests per mode/user type and concurrency level")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated pipeline concurrency levels")
+    parser.add_argument("--sessions", default="1,2,4,8", help="comma-separated concurrent AppTest session counts")
+    parser.add_argument("--interactions", type=int, default=8, help="widget interactions per AppTest session")
+    parser.add_argument("--stream", action="store_true", help="use streaming responses and report time to first chunk")
+    parser.add_argument("--cache", action="store_true", help="keep the answer caches on: response cache, perceptual index and history (default: off)")
+    parser.add_argument("--latency-median", type=float, default=1.0, help="median fake model latency (s)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal sigma of the fake latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake calls that fail")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction of fake calls that hang until timed out")
+    parser.add_argument("--first-chunk-delay", type=float, default=0.3, help="fake time to first streamed chunk (s)")
+    parser.add_argument("--chunk-interval", type=float, default=0.05, help="fake delay between streamed chunks (s)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+# Point the app at a throwaway data directory and turn off features that would hide model latency
+def configure_environment(args):
+    os.environ.setdefault("NURTUREAI_DATA_DIR", tempfile.mkdtemp(prefix="nurtureai-bench-"))
+    os.environ["NURTUREAI_FAKE_BACKEND"] = "1"
+    os.environ["NURTUREAI_FAKE_LATENCY_MEDIAN"] = str(args.latency_median)
+    os.environ["NURTUREAI_FAKE_LATENCY_SIGMA"] = str(args.latency_sigma)
+    os.environ["NURTUREAI_FAKE_ERROR_RATE"] = str(args.error_rate)
+    os.environ["NURTUREAI_FAKE_HANG_RATE"] = str(args.hang_rate)
+    os.environ["NURTUREAI_MODEL_RATE_PER_MINUTE"] = "1000000"
+    os.environ["NURTUREAI_MODEL_BURST"] = "1000000"
+    os.environ["NURTUREAI_OCR_ENABLED"] = "0"
+    os.environ["NURTUREAI_VERDICTS_ENABLED"] = "0"
+    if not args.cache:
+        os.environ["NURTUREAI_CACHE_ENABLED"] = "0"
+        os.environ["NURTUREAI_PHASH_ENABLED"] = "0"
+        os.environ["NURTUREAI_HISTORY_ENABLED"] = "0"
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def latency_summary(values):
+    return {
+        "p50_ms": _ms(percentile(values, 50)),
+        "p95_ms": _ms(percentile(values, 95)),
+        "p99_ms": _ms(percentile(values, 99)),
+        "max_ms": _ms(max(values) if values else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+# Peak resident set size of this process so far, in MB
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024, 1)
+
+# Phone-photo-sized synthetic product images, distinct so caches can't short-circuit
+def synthetic_images(count, size=(2000, 1500)):
+    from PIL import Image, ImageDraw
+
+    images = []
+    for i in range(count):
+        image = Image.new("RGB", size, ((i * 37) % 256, (i * 91) % 256, (i * 53) % 256))
+        draw = ImageDraw.Draw(image)
+        for j in range(12):
+            x, y = (i * 131 + j * 157) % size[0], (i * 71 + j * 113) % size[1]
+            draw.rectangle([x, y, x + 300, y + 200], fill=((j * 40) % 256, (i * 17) % 256, 200))
+            draw.text((x + 10, y + 10), f"Product {i}-{j}", fill=(255, 255, 255))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=92)
+        images.append(buffer.getvalue())
+    return images
+
+
+def run_pipeline(args):
+    import analysis_service
+    from fake_gemini import FakeGeminiClient
+    from gemini_client import set_gemini_client
+    from prompts import normalize_mode, normalize_user_type, select_prompt
+
+    fake = FakeGeminiClient(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        hang_rate=args.hang_rate,
+        first_chunk_delay=args.first_chunk_delay,
+        chunk_interval=args.chunk_interval,
+        seed=args.seed,
+    )
+    set_gemini_client(fake)
+    images = synthetic_images(min(args.requests, 64))
+
+    def one_request(level, index, mode, user_type):
+        image_bytes = images[(level * args.requests + index) % len(images)]
+        question = f"Is product {index} safe during pregnancy? (run {level})"
+        started = time.perf_counter()
+        first_chunk = None
+        if not args.stream:
+            analysis_service.analyze(image_bytes, "image/jpeg", mode, user_type, question)
+        else:
+            from image_pipeline import prepare_image
+
+            mode_name, user_label = normalize_mode(mode), normalize_user_type(user_type)
+            prepared = prepare_image(image_bytes, "image/jpeg")
+            image = analysis_service.image_parts_for(prepared)
+            prompt = select_prompt(mode_name, user_label)
+            check = analysis_service.precheck(prompt, image, mode_name, user_label, question)
+            if check.response is None:
+                chunks = []
+                for chunk in analysis_service.stream_gemini_response(
+                    prompt, image, question, check.label_text, check.grounding, mode=mode_name
+                ):
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - started
+                    chunks.append(chunk)
+                analysis_service.complete_analysis(check, prompt, image, mode_name, user_label, question, "".join(chunks))
+        return time.perf_counter() - started, first_chunk
+
+    results = []
+    for level, concurrency in enumerate(int(c) for c in args.concurrency.split(",") if c.strip()):
+        for mode, user_type in CASES:
+            latencies, first_chunks, errors = [], [], 0
+            cpu_before = time.process_time()
+            wall_before = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [executor.submit(one_request, level, i, mode, user_type) for i in range(args.requests)]
+                for future in futures:
+                    try:
+                        latency, first_chunk = future.result()
+                    except Exception:
+                        errors += 1
+                        continue
+                    latencies.append(latency)
+                    if first_chunk is not None:
+                        first_chunks.append(first_chunk)
+            wall = time.perf_counter() - wall_before
+            cpu = time.process_time() - cpu_before
+            entry = {
+                "suite": "pipeline",
+                "mode": mode,
+                "user_type": user_type,
+                "concurrency": concurrency,
+                "requests": args.requests,
+                "errors": errors,
+                "throughput_rps": round(args.requests / wall, 2) if wall else None,
+                "wall_s": round(wall, 3),
+                "cpu_s": round(cpu, 3),
+                "cpu_ms_per_request": round(cpu * 1000 / args.requests, 2),
+                "peak_rss_mb": peak_rss_mb(),
+                **latency_summary(latencies),
+            }
+            if args.stream:
+                entry["first_chunk"] = latency_summary(first_chunks)
+            results.append(entry)
+            print(f"pipeline {mode}/{user_type} x{concurrency}: p50={entry['p50_ms']}ms "
+                  f"p99={entry['p99_ms']}ms {entry['throughput_rps']} req/s", file=sys.stderr)
+    return results
+
+
+# One headless session in its own process (AppTest isn't safe to run from
+# several threads at once). CPU and peak RSS cover the whole process, including
+# the thread AppTest runs the script on.
+def app_session(app_path, index, interactions):
+    from streamlit.testing.v1 import AppTest
+
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    app = AppTest.from_file(app_path, default_timeout=60)
+    app.run()
+    first_render = time.perf_counter() - started
+    cpu_rendered = time.process_time()
+    timings = []
+    for i in range(interactions):
+        category = APP_CATEGORIES[(index + i) % len(APP_CATEGORIES)]
+        began = time.perf_counter()
+        app.radio(key="category").set_value(category).run()
+        timings.append(time.perf_counter() - began)
+    failed = bool(app.exception)
+    cpu_after = time.process_time()
+    return first_render, timings, cpu_after - cpu_before, cpu_after - cpu_rendered, peak_rss_mb(), failed
+
+
+def run_app(args):
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Nurtureai.py")
+
+    results = []
+    for sessions in [int(s) for s in args.sessions.split(",") if s.strip()]:
+        wall_before = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=sessions) as executor:
+            futures = [executor.submit(app_session, app_path, i, args.interactions) for i in range(sessions)]
+            outcomes = [future.result() for future in futures]
+        wall = time.perf_counter() - wall_before
+        first_renders = [o[0] for o in outcomes]
+        interactions = [t for o in outcomes for t in o[1]]
+        cpu = [o[2] for o in outcomes]
+        interaction_cpu = [o[3] for o in outcomes]
+        rss = [o[4] for o in outcomes]
+        entry = {
+            "suite": "app",
+            "sessions": sessions,
+            "errors": sum(1 for o in outcomes if o[5]),
+            "first_render": latency_summary(first_renders),
+            "interaction": latency_summary(interactions),
+            "interactions_per_s": round(len(interactions) / wall, 2) if wall else None,
+            "cpu_ms_per_session": round(1000 * sum(cpu) / sessions, 2),
+            "cpu_ms_per_interaction": round(1000 * sum(interaction_cpu) / len(interactions), 2) if interactions else None,
+            "peak_rss_mb": max(rss),
+            "peak_rss_per_session_mb": round(sum(rss) / sessions, 1),
+        }
+        results.append(entry)
+        print(f"app x{sessions}: interaction p50={entry['interaction']['p50_ms']}ms "
+              f"p99={entry['interaction']['p99_ms']}ms", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": [],
+    }
+    if args.suite in ("pipeline", "all"):
+        report["results"] += run_pipeline(args)
+    if args.suite in ("app", "all"):
+        report["results"] += run_app(args)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
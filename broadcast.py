@@ -0,0 +1,244 @@
+import argparse
+import csv
+import datetime
+import json
+import logging
+import math
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import config
+from analysis_service import DISCLAIMER, localized_sms_disclaimer, split_disclaimer
+from gemini_client import get_gemini_client
+from model_scheduler import get_model_scheduler
+from prompts import BROADCAST_AUDIENCES, broadcast_prompt, normalize_user_type
+from resilience import get_resilient_caller
+from sms import render_sms
+from translation import get_translator, normalize_language
+
+# Weekly personalized broadcasts. Subscribers are grouped into cohorts by
+# pregnancy week or postpartum stage, language and user type; each cohort's
+# message is generated once (concurrently, through the shared rate limiter and
+# model queue) and then fanned out to its members with a personal greeting.
+# Model calls scale with the number of cohorts (at most a few hundred), not
+# with the number of subscribers.
+#
+#   python broadcast.py recipients.csv --output outbox.jsonl
+#
+# recipients.csv columns: id, name, phone, language, user_type, and one of
+# pregnancy_week, due_date, postpartum_week or birth_date (dates as YYYY-MM-DD).
+
+logger = logging.getLogger(__name__)
+
+Recipient = namedtuple("Recipient", "id name phone stage language user_type")
+Cohort = namedtuple("Cohort", "stage language user_type")
+
+GREETINGS = {
+    "English": "Hello {name},",
+    "Hausa": "Sannu {name},",
+    "Yoruba": "Ẹ n lẹ {name},",
+    "Igbo": "Ndewo {name},",
+    "Nigerian Pidgin": "How far {name},",
+}
+
+# Sent to a cohort whose message could not be generated within the window
+FALLBACK_MESSAGE = (
+    "Keep going to your clinic visits, eat a mix of local foods like beans, eggs, fish and green "
+    "vegetables, drink clean water and rest well. Go to the clinic at once if you have bleeding, "
+    "a severe headache, fever or swelling."
+)
+
+# Postpartum weeks are weekly cohorts up to this week, monthly after it
+POSTPARTUM_WEEKLY_UNTIL = 6
+POSTPARTUM_LAST_MONTH = 12
+
+
+def _weeks_between(start, end):
+    return (end - start).days // 7
+
+def _date(value):
+    return datetime.date.fromisoformat(value.strip()) if value and value.strip() else None
+
+def _int(value):
+    return int(value) if value not in (None, "") else None
+
+# Stage of a subscriber on `today`: ("pregnancy", week), ("postpartum_week", week),
+# ("postpartum_month", month), or None when it is unknown or past the programme
+def stage_for(row, today):
+    week = _int(row.get("pregnancy_week"))
+    due_date = _date(row.get("due_date"))
+    if week is None and due_date is not None and due_date >= today:
+        week = 40 - _weeks_between(today, due_date)
+    if week is not None:
+        return ("pregnancy", min(max(week, 1), 42))
+
+    week = _int(row.get("postpartum_week"))
+    birth_date = _date(row.get("birth_date")) or (due_date if due_date is not None and due_date < today else None)
+    if week is None and birth_date is not None:
+        week = _weeks_between(birth_date, today) + 1
+    if week is None:
+        return None
+    if week <= POSTPARTUM_WEEKLY_UNTIL:
+        return ("postpartum_week", max(week, 1))
+    month = math.ceil(week * 7 / 30.44)
+    return ("postpartum_month", month) if month <= POSTPARTUM_LAST_MONTH else None
+
+def stage_label(stage):
+    kind, number = stage
+    if kind == "pregnancy":
+        return f"week {number} of pregnancy"
+    if kind == "postpartum_week":
+        return f"week {number} after giving birth"
+    return f"month {number} after giving birth"
+
+# Read subscribers from a CSV file; returns (recipients, rows skipped)
+def load_recipients(path, today=None):
+    today = today or datetime.date.today()
+    recipients, skipped = [], 0
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            try:
+                stage = stage_for(row, today)
+                user_type = normalize_user_type(row.get("user_type"))
+            except ValueError as e:
+                logger.warning("Skipping recipient %s: %s", row.get("id"), e)
+                stage = None
+            if stage is None:
+                skipped += 1
+                continue
+            recipients.append(Recipient(
+                id=row.get("id", ""),
+                name=(row.get("name") or "").strip(),
+                phone=(row.get("phone") or "").strip(),
+                stage=stage,
+                language=normalize_language(row.get("language")),
+                user_type=user_type,
+            ))
+    return recipients, skipped
+
+def group_cohorts(recipients):
+    cohorts = {}
+    for recipient in recipients:
+        cohorts.setdefault(Cohort(recipient.stage, recipient.language, recipient.user_type), []).append(recipient)
+    return cohorts
+
+def cohort_prompt(cohort):
+    return broadcast_prompt.format(
+        stage=stage_label(cohort.stage),
+        audience=BROADCAST_AUDIENCES[cohort.user_type],
+        language=cohort.language,
+    )
+
+# Generate one cohort's message, giving up at the window deadline (time.monotonic())
+# whether it is still queued for the model or waiting for its answer
+def generate_cohort_message(cohort, deadline):
+    if time.monotonic() >= deadline:
+        raise TimeoutError("Broadcast window ended before this cohort's turn")
+    client = get_gemini_client()
+    contents = [cohort_prompt(cohort)]
+    # Broadcasts queue as one user, so they take turns with interactive checks
+    ticket = get_model_scheduler().submit(
+        "broadcast",
+        lambda emit: get_resilient_caller().call("Broadcast", lambda timeout: client.generate(contents, timeout=timeout)),
+    )
+    message = ticket.result(timeout=_remaining(deadline))
+    return with_disclaimer(message, cohort.language, _remaining(deadline))
+
+# Seconds left until `deadline` (time.monotonic())
+def _remaining(deadline):
+    return max(0.0, deadline - time.monotonic())
+
+# The message with the medical disclaimer in the cohort's language (from the
+# translation memory, or the model within `timeout` seconds)
+def with_disclaimer(message, language, timeout=None):
+    body, _ = split_disclaimer(message)
+    disclaimer = get_translator().translate(DISCLAIMER, language, user_key="broadcast", timeout=timeout)
+    return f"{body.strip()}\n\n{disclaimer}"
+
+# Add the subscriber's greeting to her cohort's message
+def personalize(message, recipient):
+    first_name = recipient.name.split()[0] if recipient.name else ""
+    greeting = GREETINGS.get(recipient.language, GREETINGS["English"]).format(name=first_name)
+    return f"{greeting.replace(' ,', ',')} {message}"
+
+# Generate every cohort's message, then yield one outbox entry per subscriber.
+# `report` is filled in as the run progresses.
+def run_broadcast(recipients, report, window=None, concurrency=None):
+    window = config.BROADCAST_WINDOW_SECONDS if window is None else window
+    concurrency = concurrency or config.BROADCAST_CONCURRENCY
+    cohorts = group_cohorts(recipients)
+    keys = list(cohorts)
+    started = time.monotonic()
+    deadline = started + window
+
+    messages, fallbacks = {}, 0
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(keys))))
+    futures = [executor.submit(generate_cohort_message, cohort, deadline) for cohort in keys]
+    # Cohorts still generating when the window ends are not waited for
+    done, _ = wait(futures, timeout=_remaining(deadline))
+    executor.shutdown(wait=False, cancel_futures=True)
+    for cohort, future in zip(keys, futures):
+        if future in done and future.exception() is None:
+            messages[cohort] = future.result()
+            continue
+        error = future.exception() if future in done else "the broadcast window ended first"
+        logger.warning("Using the fallback message for %s: %s", cohort, error)
+        # Past the window, only the translation memory is used
+        timeout = _remaining(deadline)
+        message = get_translator().translate(FALLBACK_MESSAGE, cohort.language, user_key="broadcast", timeout=timeout)
+        messages[cohort] = with_disclaimer(message, cohort.language, _remaining(deadline))
+        fallbacks += 1
+    report.update({
+        "recipients": len(recipients),
+        "cohorts": len(keys),
+        "model_calls": len(keys) - fallbacks,
+        "fallbacks": fallbacks,
+        "generation_seconds": round(time.monotonic() - started, 2),
+        "segments": 0,
+        "cost": 0.0,
+        "currency": config.SMS_CURRENCY,
+    })
+
+    for cohort, members in cohorts.items():
+        disclaimer = localized_sms_disclaimer(cohort.language)
+        for recipient in members:
+            text = personalize(messages[cohort], recipient)
+            sms = render_sms(text, disclaimer=disclaimer)
+            report["segments"] += sms.segment_count
+            report["cost"] = round(report["cost"] + sms.cost, 4)
+            yield {
+                "recipient_id": recipient.id,
+                "phone": recipient.phone,
+                "language": cohort.language,
+                "stage": stage_label(cohort.stage),
+                "text": text,
+                "sms": sms.text,
+                "sms_segments": sms.segment_count,
+                "sms_cost": sms.cost,
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate NurtureAI's weekly cohort broadcast")
+    parser.add_argument("recipients", help="CSV of subscribers")
+    parser.add_argument("--output", required=True, help="JSONL outbox to write, one message per subscriber")
+    parser.add_argument("--date", help="send date (YYYY-MM-DD), for stages computed from due or birth dates")
+    parser.add_argument("--window", type=float, help="seconds allowed for generating cohort messages")
+    parser.add_argument("--concurrency", type=int, help="cohort messages generated at once")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    today = datetime.date.fromisoformat(args.date) if args.date else None
+    recipients, skipped = load_recipients(args.recipients, today)
+    report = {"skipped": skipped}
+    with open(args.output, "w", encoding="utf-8") as f:
+        for entry in run_broadcast(recipients, report, args.window, args.concurrency):
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+
+from dotenv import load_dotenv
+
+# Shared settings for NurtureAI, read from the environment and .env
+load_dotenv()
+
+# Helper to read an integer setting
+def env_int(name, default):
+    value = os.getenv(name)
+    try:
+        return int(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+
+# Helper to read a float setting
+def env_float(name, default):
+    value = os.getenv(name)
+    try:
+        return float(value) if value not in (None, "") else default
+    except ValueError:
+        return default
+
+# Helper to read an on/off setting
+def env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# Directory for local caches, indexes and databases
+DATA_DIR = os.getenv("NURTUREAI_DATA_DIR", ".nurtureai")
+
+# Build a path inside the data directory, creating the directory if needed
+def data_path(*parts):
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+# Response cache
+CACHE_ENABLED = env_bool("NURTUREAI_CACHE_ENABLED", True)
+CACHE_MEMORY_ITEMS = env_int("NURTUREAI_CACHE_MEMORY_ITEMS", 256)
+CACHE_TTL_SECONDS = env_int("NURTUREAI_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+CACHE_MAX_BYTES = env_int("NURTUREAI_CACHE_MAX_MB", 64) * 1024 * 1024
+
+# Near-duplicate photo lookup
+PHASH_ENABLED = env_bool("NURTUREAI_PHASH_ENABLED", True)
+PHASH_SIMILARITY = env_float("NURTUREAI_PHASH_SIMILARITY", 0.85)
+PHASH_DETAIL_SIMILARITY = env_float("NURTUREAI_PHASH_DETAIL_SIMILARITY", 0.86)
+
+# Gemini model client
+MODEL_NAME = os.getenv("NURTUREAI_MODEL_NAME", "gemini-1.5-flash")
+MODEL_TIMEOUT_SECONDS = env_float("NURTUREAI_MODEL_TIMEOUT_SECONDS", 60.0)
+MODEL_MAX_CONCURRENCY = env_int("NURTUREAI_MODEL_MAX_CONCURRENCY", 16)
+MODEL_STREAMING = env_bool("NURTUREAI_MODEL_STREAMING", True)
+
+# Deadlines per mode for a whole model call, hedged requests and the circuit breaker
+MODEL_DEADLINES = {
+    mode: env_float(f"NURTUREAI_MODEL_DEADLINE_{mode.upper()}", default)
+    for mode, default in (("Food", 20.0), ("Drug", 30.0), ("Cosmetic", 20.0), ("Calories", 25.0))
+}
+HEDGE_ENABLED = env_bool("NURTUREAI_HEDGE_ENABLED", True)
+HEDGE_PERCENTILE = env_float("NURTUREAI_HEDGE_PERCENTILE", 95.0)
+HEDGE_MIN_DELAY = env_float("NURTUREAI_HEDGE_MIN_DELAY", 1.0)
+BREAKER_FAILURES = env_int("NURTUREAI_BREAKER_FAILURES", 5)
+BREAKER_WINDOW = env_float("NURTUREAI_BREAKER_WINDOW", 30.0)
+BREAKER_COOLDOWN = env_float("NURTUREAI_BREAKER_COOLDOWN", 30.0)
+# Share one upstream call between identical checks that are in flight at the same time
+SINGLE_FLIGHT_ENABLED = env_bool("NURTUREAI_SINGLE_FLIGHT_ENABLED", True)
+
+# Shared model-call workers with a fair per-user queue and load shedding
+MODEL_WORKERS = env_int("NURTUREAI_MODEL_WORKERS", MODEL_MAX_CONCURRENCY)
+MODEL_QUEUE_MAX = env_int("NURTUREAI_MODEL_QUEUE_MAX", 200)
+MODEL_QUEUE_PER_USER = env_int("NURTUREAI_MODEL_QUEUE_PER_USER", 8)
+MODEL_QUEUE_MAX_WAIT = env_float("NURTUREAI_MODEL_QUEUE_MAX_WAIT", 120.0)
+
+# SMS rendering of results
+SMS_MAX_SEGMENTS = env_int("NURTUREAI_SMS_MAX_SEGMENTS", 3)
+SMS_SEGMENT_COST = env_float("NURTUREAI_SMS_SEGMENT_COST", 4.0)
+SMS_CURRENCY = os.getenv("NURTUREAI_SMS_CURRENCY", "NGN")
+
+# Weekly cohort broadcasts
+BROADCAST_CONCURRENCY = env_int("NURTUREAI_BROADCAST_CONCURRENCY", 4)
+BROADCAST_WINDOW_SECONDS = env_float("NURTUREAI_BROADCAST_WINDOW_SECONDS", 3600.0)
+
+# Translation memory for localized results
+TRANSLATION_ENABLED = env_bool("NURTUREAI_TRANSLATION_ENABLED", True)
+TRANSLATION_SEED_PATH = os.getenv("NURTUREAI_TRANSLATION_SEED_PATH", "")
+TRANSLATION_FUZZY_THRESHOLD = env_float("NURTUREAI_TRANSLATION_FUZZY_THRESHOLD", 0.9)
+
+# Local stand-in for Gemini (benchmarks and offline testing)
+FAKE_BACKEND = env_bool("NURTUREAI_FAKE_BACKEND", False)
+FAKE_LATENCY_MEDIAN = env_float("NURTUREAI_FAKE_LATENCY_MEDIAN", 1.5)
+FAKE_LATENCY_SIGMA = env_float("NURTUREAI_FAKE_LATENCY_SIGMA", 0.5)
+FAKE_ERROR_RATE = env_float("NURTUREAI_FAKE_ERROR_RATE", 0.0)
+FAKE_HANG_RATE = env_float("NURTUREAI_FAKE_HANG_RATE", 0.0)
+
+# Upload normalization
+IMAGE_MAX_EDGE = env_int("NURTUREAI_IMAGE_MAX_EDGE", 1280)
+IMAGE_MAX_BYTES = env_int("NURTUREAI_IMAGE_MAX_KB", 400) * 1024
+IMAGE_FORMAT = os.getenv("NURTUREAI_IMAGE_FORMAT", "JPEG")
+
+# Memory budget for the web app's prepared uploads (larger payloads are spilled
+# to memory-mapped temporary files) and how long an idle session keeps its buffers
+UPLOAD_SESSION_MAX_BYTES = env_int("NURTUREAI_UPLOAD_SESSION_MAX_MB", 8) * 1024 * 1024
+UPLOAD_TOTAL_MAX_BYTES = env_int("NURTUREAI_UPLOAD_TOTAL_MAX_MB", 256) * 1024 * 1024
+UPLOAD_SPILL_BYTES = env_int("NURTUREAI_UPLOAD_SPILL_KB", 1024) * 1024
+UPLOAD_IDLE_SECONDS = env_float("NURTUREAI_UPLOAD_IDLE_SECONDS", 900.0)
+UPLOAD_SPILL_DIR = os.getenv("NURTUREAI_UPLOAD_SPILL_DIR") or None
+
+# Model call rate limit (matches the API quota) and batch analysis
+MODEL_RATE_PER_MINUTE = env_float("NURTUREAI_MODEL_RATE_PER_MINUTE", 60.0)
+MODEL_BURST = env_int("NURTUREAI_MODEL_BURST", 5)
+BATCH_CONCURRENCY = env_int("NURTUREAI_BATCH_CONCURRENCY", 4)
+BATCH_MAX_FILES = env_int("NURTUREAI_BATCH_MAX_FILES", 20)
+
+# OCR pre-pass for drug and cosmetic labels
+OCR_ENABLED = env_bool("NURTUREAI_OCR_ENABLED", False)
+OCR_LANGUAGES = [lang.strip() for lang in os.getenv("NURTUREAI_OCR_LANGUAGES", "en").split(",") if lang.strip()]
+OCR_MIN_CONFIDENCE = env_float("NURTUREAI_OCR_MIN_CONFIDENCE", 0.8)
+OCR_MIN_CHARS = env_int("NURTUREAI_OCR_MIN_CHARS", 40)
+
+# Local red-flag ingredient rules
+RULES_ENABLED = env_bool("NURTUREAI_RULES_ENABLED", True)
+RULES_PATH = os.getenv("NURTUREAI_RULES_PATH", "")
+RULES_EXPLAIN = env_bool("NURTUREAI_RULES_EXPLAIN", True)
+
+# Local nutrition table for the calorie checker
+NUTRITION_PATH = os.getenv("NURTUREAI_NUTRITION_PATH", "")
+
+# Persistent embedding cache shared by the verdict store and guideline index
+EMBEDDING_CACHE_ENABLED = env_bool("NURTUREAI_EMBEDDING_CACHE_ENABLED", True)
+EMBEDDING_CACHE_DTYPE = os.getenv("NURTUREAI_EMBEDDING_CACHE_DTYPE", "float16")
+EMBEDDING_CACHE_COMPACT_AFTER = env_int("NURTUREAI_EMBEDDING_CACHE_COMPACT_AFTER", 10000)
+EMBEDDING_CACHE_COMPACT_INTERVAL = env_float("NURTUREAI_EMBEDDING_CACHE_COMPACT_INTERVAL", 60.0)
+
+# Vector store of past verdicts
+VERDICTS_ENABLED = env_bool("NURTUREAI_VERDICTS_ENABLED", True)
+EMBEDDING_MODEL = os.getenv("NURTUREAI_EMBEDDING_MODEL", "models/text-embedding-004")
+VERDICTS_TOP_K = env_int("NURTUREAI_VERDICTS_TOP_K", 3)
+VERDICTS_DIRECT_SIMILARITY = env_float("NURTUREAI_VERDICTS_DIRECT_SIMILARITY", 0.97)
+VERDICTS_GROUNDING_SIMILARITY = env_float("NURTUREAI_VERDICTS_GROUNDING_SIMILARITY", 0.8)
+VERDICTS_MERGE_EVERY = env_int("NURTUREAI_VERDICTS_MERGE_EVERY", 64)
+VERDICTS_STORE_QUEUE = env_int("NURTUREAI_VERDICTS_STORE_QUEUE", 256)
+VERDICTS_STORE_WORKERS = env_int("NURTUREAI_VERDICTS_STORE_WORKERS", 2)
+
+# Guideline passages retrieved for the professional prompts
+GUIDELINES_ENABLED = env_bool("NURTUREAI_GUIDELINES_ENABLED", True)
+GUIDELINES_TOP_K = env_int("NURTUREAI_GUIDELINES_TOP_K", 3)
+GUIDELINES_MIN_SIMILARITY = env_float("NURTUREAI_GUIDELINES_MIN_SIMILARITY", 0.6)
+GUIDELINES_CHUNK_CHARS = env_int("NURTUREAI_GUIDELINES_CHUNK_CHARS", 1000)
+GUIDELINES_EMBED_BATCH = env_int("NURTUREAI_GUIDELINES_EMBED_BATCH", 32)
+GUIDELINES_EMBED_WORKERS = env_int("NURTUREAI_GUIDELINES_EMBED_WORKERS", 4)
+GUIDELINES_OCR_MIN_CHARS = env_int("NURTUREAI_GUIDELINES_OCR_MIN_CHARS", 100)
+
+# History of completed analyses (repeat checks are answered from it)
+HISTORY_ENABLED = env_bool("NURTUREAI_HISTORY_ENABLED", True)
+HISTORY_REUSE_SECONDS = env_int("NURTUREAI_HISTORY_REUSE_SECONDS", 7 * 24 * 3600)
+HISTORY_RETENTION_DAYS = env_int("NURTUREAI_HISTORY_RETENTION_DAYS", 180)
+HISTORY_SESSION_ITEMS = env_int("NURTUREAI_HISTORY_SESSION_ITEMS", 20)
+
+# Headless HTTP API
+API_MAX_WORKERS = env_int("NURTUREAI_API_MAX_WORKERS", 32)
+API_MAX_UPLOAD_BYTES = env_int("NURTUREAI_API_MAX_UPLOAD_MB", 15) * 1024 * 1024
+
+# Durable job queue for messaging channels
+QUEUE_WORKERS = env_int("NURTUREAI_QUEUE_WORKERS", 4)
+QUEUE_VISIBILITY_TIMEOUT = env_float("NURTUREAI_QUEUE_VISIBILITY_TIMEOUT", 120.0)
+QUEUE_MAX_ATTEMPTS = env_int("NURTUREAI_QUEUE_MAX_ATTEMPTS", 5)
+QUEUE_MAX_DEPTH = env_int("NURTUREAI_QUEUE_MAX_DEPTH", 10000)
+QUEUE_RESULT_RETENTION_HOURS = env_float("NURTUREAI_QUEUE_RESULT_RETENTION_HOURS", 24.0)
+
+# Request tracing and metrics
+METRICS_PORT = env_int("NURTUREAI_METRICS_PORT", 0)
+METRICS_LOG_REQUESTS = env_bool("NURTUREAI_METRICS_LOG_REQUESTS", True)
@@ -0,0 +1,317 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import config
+from gemini_client import get_gemini_client
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, one process per data directory
+    fcntl = None
+
+# Persistent embedding cache shared by every process using the data directory.
+# Vectors are keyed by a hash of (model, task type, text), so the verdict store
+# and guideline index never embed the same text twice, across restarts and
+# across autoscaled workers.
+#
+# Storage is four files next to each other:
+#   <name>.vectors  fixed-size rows (float16 by default), memory-mapped
+#   <name>.index    (key, row) records sorted by key, memory-mapped and binary-searched
+#   <name>.log      (key, row) records appended since the last compaction
+#   <name>.json     dimension and dtype
+# Opening the cache maps the files and reads only the (short) log, so start-up
+# time does not depend on the number of vectors, and processes share the pages
+# through the OS page cache. New vectors are appended under a file lock; other
+# processes see them on their next miss. A background thread folds the log into
+# a new sorted index (dropping duplicate rows) once it grows past a threshold.
+
+logger = logging.getLogger(__name__)
+
+INDEX_DTYPE = np.dtype([("key", "<u8"), ("row", "<u8")])
+# Rows copied per step when compacting
+COMPACT_BATCH = 65536
+
+
+def embedding_key(model, task_type, text):
+    digest = hashlib.blake2b(f"{model}\0{task_type}\0{text}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class EmbeddingCache:
+    def __init__(self, path, dtype="float16", compact_after=10000):
+        self.compact_after = compact_after
+        self._dtype = np.dtype(dtype)
+        self._vectors_path = path + ".vectors"
+        self._index_path = path + ".index"
+        self._log_path = path + ".log"
+        self._meta_path = path + ".json"
+        self._lock_path = path + ".lock"
+        self.dimension = None
+        self.hits = 0
+        self.misses = 0
+        self._index_version = None
+        self._keys = self._rows = np.zeros(0, dtype="<u8")
+        self._recent = {}
+        self._log_pos = 0
+        self._vectors = None
+        self._vector_rows = 0
+        self._lock = threading.RLock()
+        self._compactor = None
+        with self._file_lock(exclusive=False):
+            self._refresh()
+
+    # Thread lock plus an flock on the lock file (shared for reading the files'
+    # state, exclusive for appending or compacting)
+    @contextmanager
+    def _file_lock(self, exclusive):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path, "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _row_bytes(self):
+        return self.dimension * self._dtype.itemsize
+
+    # Bring the mapped files up to date with what other processes have written
+    def _refresh(self):
+        try:
+            stat = os.stat(self._index_path)
+            version = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            version = None
+        if version != self._index_version:
+            # A compaction replaced the files: remap everything and reread the log
+            index = np.zeros(0, dtype=INDEX_DTYPE)
+            if version is not None and os.path.getsize(self._index_path):
+                index = np.memmap(self._index_path, dtype=INDEX_DTYPE, mode="r")
+            self._keys, self._rows = index["key"], index["row"]
+            self._recent, self._log_pos = {}, 0
+            self._vectors, self._vector_rows = None, 0
+            self._index_version = version
+
+        if self.dimension is None and os.path.exists(self._meta_path):
+            # The file's dtype wins over the configured one
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dimension, self._dtype = meta["dimension"], np.dtype(meta["dtype"])
+
+        if os.path.exists(self._log_path) and os.path.getsize(self._log_path) > self._log_pos:
+            with open(self._log_path, "rb") as f:
+                f.seek(self._log_pos)
+                data = f.read()
+            whole = len(data) - len(data) % INDEX_DTYPE.itemsize
+            records = np.frombuffer(data[:whole], dtype=INDEX_DTYPE)
+            self._recent.update(zip(records["key"].tolist(), records["row"].tolist()))
+            self._log_pos += whole
+
+        if self.dimension and os.path.exists(self._vectors_path):
+            rows = os.path.getsize(self._vectors_path) // self._row_bytes()
+            if rows > self._vector_rows:
+                self._vectors = np.memmap(self._vectors_path, dtype=self._dtype, mode="r", shape=(rows, self.dimension))
+                self._vector_rows = rows
+
+    # Whether another process has appended or compacted since the last refresh
+    def _stale(self):
+        try:
+            stat = os.stat(self._index_path)
+            if (stat.st_ino, stat.st_mtime_ns) != self._index_version:
+                return True
+        except FileNotFoundError:
+            if self._index_version is not None:
+                return True
+        try:
+            return os.path.getsize(self._log_path) > self._log_pos
+        except FileNotFoundError:
+            return False
+
+    def _row(self, key):
+        row = self._recent.get(key)
+        if row is not None:
+            return row
+        position = int(np.searchsorted(self._keys, np.uint64(key)))
+        if position < len(self._keys) and int(self._keys[position]) == key:
+            return int(self._rows[position])
+        return None
+
+    def _lookup(self, key):
+        row = self._row(key)
+        if row is not None and row < self._vector_rows:
+            return np.array(self._vectors[row], dtype=np.float32)
+        return None
+
+    # Cached vectors (float32) for keys, None where missing
+    def get_many(self, keys):
+        with self._lock:
+            vectors = [self._lookup(key) for key in keys]
+            if any(v is None for v in vectors) and self._stale():
+                with self._file_lock(exclusive=False):
+                    self._refresh()
+                vectors = [v if v is not None else self._lookup(key) for key, v in zip(keys, vectors)]
+            found = sum(v is not None for v in vectors)
+            self.hits += found
+            self.misses += len(vectors) - found
+        return vectors
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    # Append vectors for keys that are not cached yet
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._file_lock(exclusive=True):
+            self._refresh()
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dimension": self.dimension, "dtype": self._dtype.name}, f)
+            if vectors.shape[1] != self.dimension:
+                logger.warning("Not caching %d-dimensional embeddings in a %d-dimensional cache",
+                               vectors.shape[1], self.dimension)
+                return
+            new = {}
+            for key, vector in zip(keys, vectors):
+                if self._row(key) is None:
+                    new[key] = vector
+            if not new:
+                return
+            # Drop any partial row or record left by a crashed writer before appending
+            row_bytes = self._row_bytes()
+            first_row = self._append(self._vectors_path, row_bytes, np.stack(list(new.values())).astype(self._dtype))
+            records = np.array([(key, first_row + i) for i, key in enumerate(new)], dtype=INDEX_DTYPE)
+            self._append(self._log_path, INDEX_DTYPE.itemsize, records)
+            self._refresh()
+
+    def put(self, key, vector):
+        self.put_many([key], [vector])
+
+    # Append an array to a file of fixed-size records; returns the first new record number
+    @staticmethod
+    def _append(path, record_bytes, array):
+        with open(path, "ab") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size % record_bytes:
+                f.truncate(size - size % record_bytes)
+            f.write(array.tobytes())
+        return size // record_bytes
+
+    # Fold the log into a new sorted index and rewrite the vectors without
+    # duplicate or orphaned rows. Other processes keep reading their mapped
+    # copies and switch over on their next refresh.
+    def compact(self, force=False):
+        with self._file_lock(exclusive=True):
+            self._refresh()
+            if not self._recent and not force:
+                return False
+            if not force and len(self._recent) < self.compact_after:
+                return False
+            started = time.perf_counter()
+            recent_keys = np.fromiter(self._recent.keys(), dtype="<u8", count=len(self._recent))
+            recent_rows = np.fromiter(self._recent.values(), dtype="<u8", count=len(self._recent))
+            # The log wins over the index for a key present in both
+            keys = np.concatenate([recent_keys, np.asarray(self._keys)])
+            rows = np.concatenate([recent_rows, np.asarray(self._rows)])
+            keys, first = np.unique(keys, return_index=True)
+            rows = rows[first]
+            keep = rows < self._vector_rows
+            keys, rows = keys[keep], rows[keep]
+
+            with open(self._vectors_path + ".tmp", "wb") as f:
+                for start in range(0, len(rows), COMPACT_BATCH):
+                    f.write(np.ascontiguousarray(self._vectors[rows[start:start + COMPACT_BATCH]]).tobytes())
+            index = np.zeros(len(keys), dtype=INDEX_DTYPE)
+            index["key"], index["row"] = keys, np.arange(len(keys), dtype="<u8")
+            index.tofile(self._index_path + ".tmp")
+            # Readers map files under the shared lock, so they never see one file replaced without the other
+            os.replace(self._vectors_path + ".tmp", self._vectors_path)
+            os.replace(self._index_path + ".tmp", self._index_path)
+            open(self._log_path, "wb").close()
+            self._refresh()
+        logger.info("Compacted embedding cache to %d vectors in %.2fs", len(keys), time.perf_counter() - started)
+        return True
+
+    # Check every `interval` seconds whether the log is due for compaction
+    def start_compactor(self, interval=60.0):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact()
+                except Exception as e:
+                    logger.warning("Embedding cache compaction failed: %s", e)
+
+        with self._lock:
+            if self._compactor is None:
+                self._compactor = threading.Thread(target=run, name="embedding-compactor", daemon=True)
+                self._compactor.start()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "vectors": len(self._keys) + len(self._recent),
+                "uncompacted": len(self._recent),
+                "dtype": self._dtype.name,
+                "bytes": self._vector_rows * self._row_bytes() if self.dimension else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+class CachedEmbedder:
+    def __init__(self, client, cache, model):
+        self.client = client
+        self.cache = cache
+        self.model = model
+
+    # Same interface as the client's embed, served from the cache when possible
+    def embed(self, text, task_type="retrieval_document"):
+        return self.embed_batch([text], task_type)[0]
+
+    def embed_batch(self, texts, task_type="retrieval_document"):
+        texts = list(texts)
+        keys = [embedding_key(self.model, task_type, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = np.asarray(self.client.embed_batch([texts[i] for i in missing], task_type), dtype=np.float32)
+            self.cache.put_many([keys[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+        return vectors
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+# Get the shared embedder: the model client behind the persistent cache (or the bare client when disabled)
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                client = get_gemini_client()
+                if not config.EMBEDDING_CACHE_ENABLED:
+                    _embedder = client
+                else:
+                    cache = EmbeddingCache(
+                        config.data_path("embeddings"),
+                        dtype=config.EMBEDDING_CACHE_DTYPE,
+                        compact_after=config.EMBEDDING_CACHE_COMPACT_AFTER,
+                    )
+                    cache.start_compactor(config.EMBEDDING_CACHE_COMPACT_INTERVAL)
+                    _embedder = CachedEmbedder(client, cache, config.EMBEDDING_MODEL)
+    return _embedder
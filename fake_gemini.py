@@ -0,0 +1,113 @@
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+
+# Local stand-in for the Gemini client, for benchmarks and offline testing. It has
+# the same generate/stream/embed interface as GeminiClient, answers in the style
+# the prompts ask for, and simulates latency (log-normal around a median), errors,
+# hung calls and streaming chunk timing. Enable it in the app with
+# NURTUREAI_FAKE_BACKEND=1.
+
+
+class FakeBackendError(Exception):
+    pass
+
+
+class FakeGeminiClient:
+    def __init__(self, latency_median=1.5, latency_sigma=0.5, error_rate=0.0, first_chunk_delay=0.4,
+                 chunk_interval=0.05, chunks=8, embedding_dimension=768, seed=None, hang_rate=0.0,
+                 hang_seconds=120.0):
+        self.model_name = "fake-gemini"
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_interval = chunk_interval
+        self.chunks = chunks
+        self.embedding_dimension = embedding_dimension
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            latency = self.latency_median * math.exp(self._random.gauss(0, self.latency_sigma))
+            failed = self._random.random() < self.error_rate
+            # A hung call only returns after hang_seconds (or the caller's timeout)
+            if self._random.random() < self.hang_rate:
+                latency = self.hang_seconds
+        return latency, failed
+
+    # Canned answer in the format each prompt asks for
+    def _answer(self, contents):
+        prompt = contents[0] if contents and isinstance(contents[0], str) else ""
+        question = contents[-1] if contents and isinstance(contents[-1], str) else ""
+        disclaimer = "⚠️ Please consult a healthcare professional for personalized advice."
+        if "Translate each numbered sentence" in prompt:
+            # Tagged echo of each numbered sentence, e.g. "1. [Hausa] ..."
+            language = prompt.split(" into ", 1)[1].split(".", 1)[0]
+            return "\n".join(
+                f"{number}. [{language}] {sentence}" for number, sentence in re.findall(r"^(\d+)\. (.*)$", question, re.MULTILINE)
+            )
+        if "weekly update" in prompt:
+            body = (
+                "Your baby is growing fast this week. Eat beans, eggs, fish and green vegetables like ugwu "
+                "for iron and protein. Go to the clinic at once if you have bleeding, a severe headache or swelling."
+            )
+        elif "calories" in prompt.lower():
+            body = (
+                "ITEM: Jollof rice | 1 plate | 250 | 410\n"
+                "ITEM: Fried plantain | 6 slices | 80 | 185\n"
+                "ITEM: Grilled chicken | 1 thigh | 120 | 230\n\n"
+                "ASSESSMENT: A balanced meal with good protein; watch the oil in the plantain."
+            )
+        else:
+            safe = int(hashlib.sha256(question.encode("utf-8")).hexdigest(), 16) % 3 != 0
+            if safe:
+                body = "✅ Safe. No ingredients of concern were found for pregnancy or breastfeeding."
+            else:
+                body = "❌ Not Safe - Contains an ingredient that is not recommended during pregnancy."
+            if "regular user" not in prompt:
+                body += " " + " ".join(["Clinical detail sentence."] * 6)
+        return f"{body}\n\n{disclaimer}"
+
+    def generate(self, contents, timeout=None):
+        latency, failed = self._draw()
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake backend timed out after {timeout:.1f}s")
+        time.sleep(latency)
+        if failed:
+            raise FakeBackendError("Simulated model error")
+        return self._answer(contents)
+
+    def stream(self, contents, timeout=None):
+        latency, failed = self._draw()
+        text = self._answer(contents)
+        delay = self.hang_seconds if latency >= self.hang_seconds else self.first_chunk_delay
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake backend timed out after {timeout:.1f}s")
+        time.sleep(delay)
+        if failed:
+            raise FakeBackendError("Simulated model error")
+        size = max(1, math.ceil(len(text) / self.chunks))
+        for start in range(0, len(text), size):
+            if start:
+                time.sleep(self.chunk_interval)
+            yield text[start:start + size]
+
+    # Deterministic pseudo-embedding so similar texts map to the same vector
+    def embed(self, text, task_type="retrieval_document"):
+        seed = int(hashlib.sha256(" ".join(text.lower().split()).encode("utf-8")).hexdigest(), 16)
+        generator = random.Random(seed)
+        return [generator.gauss(0, 1) for _ in range(self.embedding_dimension)]
+
+    def embed_batch(self, texts, task_type="retrieval_document"):
+        return [self.embed(text, task_type) for text in texts]
@@ -0,0 +1,106 @@
+import os
+import threading
+
+import google.generativeai as genai
+
+import config
+from metrics import record_tokens
+
+# Process-wide Gemini client. genai.configure and the GenerativeModel are set up
+# once and shared by every session, so the underlying connection is reused
+# instead of being rebuilt (and re-handshaked) per request. A semaphore caps how
+# many calls are in flight at once.
+
+
+# Add the token counts reported by the API to the current request's trace
+def _record_usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        record_tokens(getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0))
+
+
+class GeminiClient:
+    def __init__(self, api_key, model_name, timeout, max_concurrency):
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.timeout = timeout
+        self.model = genai.GenerativeModel(model_name)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _request_options(self, timeout=None):
+        timeout = timeout if timeout is not None else self.timeout
+        return {"timeout": timeout} if timeout else None
+
+    # Send a prompt (text and image parts) and return the response text
+    def generate(self, contents, timeout=None):
+        with self._slots:
+            response = self.model.generate_content(contents, request_options=self._request_options(timeout))
+        _record_usage(response)
+        return response.text
+
+    # Send a prompt and yield the response text chunk by chunk as it arrives
+    def stream(self, contents, timeout=None):
+        with self._slots:
+            response = self.model.generate_content(
+                contents, stream=True, request_options=self._request_options(timeout)
+            )
+            for chunk in response:
+                text = getattr(chunk, "text", "")
+                if text:
+                    yield text
+        _record_usage(response)
+
+    # Embed a text for retrieval ("retrieval_document" when storing, "retrieval_query" when searching)
+    def embed(self, text, task_type="retrieval_document"):
+        with self._slots:
+            result = genai.embed_content(
+                model=config.EMBEDDING_MODEL,
+                content=text,
+                task_type=task_type,
+                request_options=self._request_options(),
+            )
+        return result["embedding"]
+
+    # Embed several texts in one request; returns one vector per text
+    def embed_batch(self, texts, task_type="retrieval_document"):
+        with self._slots:
+            result = genai.embed_content(
+                model=config.EMBEDDING_MODEL,
+                content=list(texts),
+                task_type=task_type,
+                request_options=self._request_options(),
+            )
+        return result["embedding"]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+# Get the shared client, creating it on first use
+def get_gemini_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None and config.FAKE_BACKEND:
+                from fake_gemini import FakeGeminiClient
+                _client = FakeGeminiClient(
+                    latency_median=config.FAKE_LATENCY_MEDIAN,
+                    latency_sigma=config.FAKE_LATENCY_SIGMA,
+                    error_rate=config.FAKE_ERROR_RATE,
+                    hang_rate=config.FAKE_HANG_RATE,
+                )
+            elif _client is None:
+                _client = GeminiClient(
+                    api_key=os.getenv("GOOGLE_API_KEY"),
+                    model_name=config.MODEL_NAME,
+                    timeout=config.MODEL_TIMEOUT_SECONDS,
+                    max_concurrency=config.MODEL_MAX_CONCURRENCY,
+                )
+    return _client
+
+# Replace the shared client (e.g. with a FakeGeminiClient in benchmarks); returns the previous one
+def set_gemini_client(client):
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+    return previous
@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+import config
+from embedding_cache import get_embedder
+from label_ocr import extract_label_text, load_ocr_reader
+from prompts import PROFESSIONAL_USER
+
+# Searchable index of health guideline PDFs (WHO, FDA, national guidelines) for
+# the professional prompts, which ask the model to cite guidance: the passages
+# closest to the product and question are added to the request, so citations
+# come from the documents rather than from the model's memory.
+#
+#   python guidelines.py guidelines/            # ingest every PDF in a folder
+#   python guidelines.py --search "isotretinoin in pregnancy"
+#
+# Ingestion streams each PDF page by page: a page's text is extracted (or, for
+# scanned pages with no text layer, rendered with pdf2image and read with OCR),
+# cut into passages, and passages are embedded in batches on a small worker
+# pool and written to SQLite as each batch completes. Only a few batches are in
+# memory at once, so a 1,000-page document ingests with flat memory. Files are
+# keyed by content hash and skipped when unchanged. The FAISS index file is
+# rebuilt from the stored vectors at the end of a run and opened memory-mapped
+# by the app, which picks up a new file without a restart.
+
+logger = logging.getLogger(__name__)
+
+Passage = namedtuple("Passage", "id score title page text")
+
+# Passages shorter than this (running headers, page numbers) are not indexed
+MIN_PASSAGE_CHARS = 80
+# Vectors read per step when the index is rebuilt
+REBUILD_BATCH = 4096
+
+_HYPHENATION = re.compile(r"(\w)-\n(\w)")
+_SPACES = re.compile(r"\s+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(])")
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Cut a page's text into passages of at most max_chars, at sentence boundaries where possible
+def split_passages(text, max_chars):
+    text = _SPACES.sub(" ", _HYPHENATION.sub(r"\1\2", text)).strip()
+    passages, current = [], ""
+    for sentence in _SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            passages.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            passages.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        passages.append(current)
+    return [p for p in passages if len(p) >= MIN_PASSAGE_CHARS]
+
+# Text of a scanned page read with OCR, or None when OCR is unavailable
+def _ocr_page(path, number):
+    reader = load_ocr_reader()
+    if reader is None:
+        return None
+    try:
+        from pdf2image import convert_from_path
+        images = convert_from_path(path, dpi=200, first_page=number, last_page=number)
+    except Exception as e:
+        logger.warning("Could not render page %d of %s for OCR: %s", number, path, e)
+        return None
+    if not images:
+        return None
+    text, _ = extract_label_text(np.asarray(images[0].convert("RGB")), reader)
+    return text
+
+def _title(reader, path):
+    try:
+        title = reader.metadata.title if reader.metadata else None
+    except Exception:
+        title = None
+    return (title or "").strip() or os.path.splitext(os.path.basename(path))[0]
+
+# Yield (page number, passage) for a PDF, one page at a time; `counts` is updated as pages are read
+def iter_passages(reader, path, counts, max_chars, ocr_min_chars):
+    for number, page in enumerate(reader.pages, 1):
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            logger.warning("Could not extract text from page %d of %s: %s", number, path, e)
+            text = ""
+        if len(text.strip()) < ocr_min_chars:
+            scanned = _ocr_page(path, number)
+            if scanned and len(scanned) > len(text):
+                text = scanned
+                counts["ocr_pages"] += 1
+        counts["pages"] += 1
+        for passage in split_passages(text, max_chars):
+            yield number, passage
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class GuidelineIndex:
+    def __init__(self, index_path, db_path, embed, embed_batch):
+        self.index_path = index_path
+        self.embed = embed
+        self.embed_batch = embed_batch
+        self._index = None
+        self._index_mtime = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " path TEXT PRIMARY KEY,"
+            " sha256 TEXT NOT NULL,"
+            " title TEXT NOT NULL,"
+            " pages INTEGER NOT NULL,"
+            " ocr_pages INTEGER NOT NULL,"
+            " passages INTEGER NOT NULL,"
+            " ingested REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS passages ("
+            " id INTEGER PRIMARY KEY,"
+            " document TEXT NOT NULL,"
+            " title TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " vector BLOB NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS passages_document ON passages (document)")
+
+    # Embed batches on a worker pool, yielding (batch, vectors) in order with at
+    # most 2 * workers batches in flight
+    def _embedded(self, batches, workers):
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="guideline-embed") as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append((batch, executor.submit(self.embed_batch, [text for _, text in batch], "retrieval_document")))
+                if len(pending) >= 2 * workers:
+                    batch, future = pending.popleft()
+                    yield batch, future.result()
+            while pending:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+
+    # Ingest one PDF unless a file with the same content is already indexed.
+    # Returns a report with the status ("ingested", "unchanged" or "duplicate") and counts.
+    def ingest(self, path, max_chars=1000, batch_size=32, workers=4, ocr_min_chars=100):
+        from PyPDF2 import PdfReader
+
+        path = os.path.abspath(path)
+        started = time.perf_counter()
+        sha256 = file_sha256(path)
+        row = self._db.execute("SELECT path FROM documents WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is not None:
+            return {"path": path, "status": "unchanged" if row[0] == path else "duplicate"}
+
+        reader = PdfReader(path)
+        title = _title(reader, path)
+        # Passages of an older version, or of an interrupted run, are replaced
+        self._db.execute("DELETE FROM documents WHERE path = ?", (path,))
+        self._db.execute("DELETE FROM passages WHERE document = ?", (path,))
+        counts = {"pages": 0, "ocr_pages": 0, "passages": 0}
+        passages = iter_passages(reader, path, counts, max_chars, ocr_min_chars)
+        for batch, vectors in self._embedded(_batches(passages, batch_size), workers):
+            vectors = _normalize(vectors)
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT INTO passages (document, title, page, text, vector) VALUES (?, ?, ?, ?, ?)",
+                [(path, title, page, text, vector.tobytes()) for (page, text), vector in zip(batch, vectors)],
+            )
+            self._db.execute("COMMIT")
+            counts["passages"] += len(batch)
+        # Recorded last, so a document is only skipped once it was fully ingested
+        self._db.execute(
+            "INSERT INTO documents (path, sha256, title, pages, ocr_pages, passages, ingested) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, sha256, title, counts["pages"], counts["ocr_pages"], counts["passages"], time.time()),
+        )
+        return {"path": path, "status": "ingested", "title": title, **counts,
+                "seconds": round(time.perf_counter() - started, 2)}
+
+    # Write the FAISS index file from the stored vectors of fully ingested documents
+    def rebuild(self):
+        index = None
+        cursor = self._db.execute(
+            "SELECT p.id, p.vector FROM passages p JOIN documents d ON d.path = p.document ORDER BY p.id"
+        )
+        while True:
+            rows = cursor.fetchmany(REBUILD_BATCH)
+            if not rows:
+                break
+            vectors = np.stack([np.frombuffer(vector, dtype="float32") for _, vector in rows])
+            if index is None:
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+            index.add_with_ids(vectors, np.array([row_id for row_id, _ in rows], dtype="int64"))
+        if index is None:
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            return 0
+        tmp_path = self.index_path + ".tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+        return index.ntotal
+
+    # The index file, memory-mapped; reopened when ingestion has replaced it
+    def _current(self):
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if mtime != self._index_mtime:
+                try:
+                    self._index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    self._index = faiss.read_index(self.index_path)
+                self._index_mtime = mtime
+            return self._index
+
+    # Top-k passages for a query (nothing is embedded while the index is empty)
+    def search(self, text, k=3):
+        index = self._current()
+        if index is None or index.ntotal == 0:
+            return []
+        vector = _normalize(self.embed(text, "retrieval_query"))
+        scores, ids = index.search(vector, min(k, index.ntotal))
+        found = {int(row_id): float(score) for score, row_id in zip(scores[0], ids[0]) if row_id >= 0}
+        if not found:
+            return []
+        placeholders = ",".join("?" * len(found))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, title, page, text FROM passages WHERE id IN ({placeholders})", tuple(found)
+            ).fetchall()
+        passages = [Passage(row[0], found[row[0]], *row[1:]) for row in rows]
+        passages.sort(key=lambda p: p.score, reverse=True)
+        return passages
+
+    def stats(self):
+        documents, pages, ocr_pages, passages = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(pages), 0), COALESCE(SUM(ocr_pages), 0), COALESCE(SUM(passages), 0) FROM documents"
+        ).fetchone()
+        return {"documents": documents, "pages": pages, "ocr_pages": ocr_pages, "passages": passages}
+
+
+# Guideline text added to the request, numbered for citation
+def guideline_text(passages):
+    lines = ["Guideline passages (base clinical statements on these and cite them as [number, source, page]):"]
+    for number, p in enumerate(passages, 1):
+        lines.append(f"[{number}] {p.title}, p. {p.page}: {p.text}")
+    return "\n".join(lines)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+# Get the shared guideline index, opening it on first use
+def get_guideline_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                embedder = get_embedder()
+                _index = GuidelineIndex(
+                    config.data_path("guidelines.faiss"),
+                    config.data_path("guidelines.sqlite3"),
+                    embed=embedder.embed,
+                    embed_batch=embedder.embed_batch,
+                )
+    return _index
+
+# Grounding text of the guideline passages for a professional check, or None
+def retrieve_guidelines(mode, user_type, query):
+    if not config.GUIDELINES_ENABLED or user_type != PROFESSIONAL_USER or mode == "Calories" or not query:
+        return None
+    try:
+        passages = get_guideline_index().search(f"{mode}: {query}", k=config.GUIDELINES_TOP_K)
+    except Exception as e:
+        logger.warning("Guideline retrieval failed: %s", e)
+        return None
+    passages = [p for p in passages if p.score >= config.GUIDELINES_MIN_SIMILARITY]
+    return guideline_text(passages) if passages else None
+
+
+def _pdf_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                yield from (os.path.join(root, name) for name in sorted(names) if name.lower().endswith(".pdf"))
+        else:
+            yield path
+
+# Peak resident memory of this process in MB (None where it can't be read)
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest health guideline PDFs into NurtureAI's guideline index")
+    parser.add_argument("paths", nargs="*", help="PDF files or folders of PDFs")
+    parser.add_argument("--search", help="print the passages closest to this query instead of ingesting")
+    parser.add_argument("-k", type=int, default=5, help="passages to print with --search")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    index = get_guideline_index()
+
+    if args.search:
+        for p in index.search(args.search, k=args.k):
+            print(f"{p.score:.3f}  {p.title}, p. {p.page}: {p.text[:300]}")
+        return
+
+    changed = False
+    for path in _pdf_paths(args.paths):
+        try:
+            report = index.ingest(
+                path,
+                max_chars=config.GUIDELINES_CHUNK_CHARS,
+                batch_size=config.GUIDELINES_EMBED_BATCH,
+                workers=config.GUIDELINES_EMBED_WORKERS,
+                ocr_min_chars=config.GUIDELINES_OCR_MIN_CHARS,
+            )
+        except Exception as e:
+            logger.error("Could not ingest %s: %s", path, e)
+            report = {"path": path, "status": "failed", "error": str(e)}
+        changed = changed or report["status"] == "ingested"
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+    if changed:
+        index.rebuild()
+    json.dump({**index.stats(), "peak_rss_mb": _peak_rss_mb()}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
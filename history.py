@@ -0,0 +1,132 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import config
+from response_cache import normalize_question
+
+# History of completed analyses. Every final answer is stored with the hashes
+# of its inputs (the uploaded bytes and the normalized question, never the
+# image or question itself), who asked and through which channel. A check that
+# repeats one answered recently is served straight from here, before the image
+# is even prepared. Callers keep only the row ids, so a long web session holds
+# a short list of integers rather than images and result texts.
+
+HistoryEntry = namedtuple(
+    "HistoryEntry", "id user_key channel mode user_type language image_hash response source nutrition created"
+)
+
+_COLUMNS = "id, user_key, channel, mode, user_type, language, image_hash, response, source, nutrition, created"
+
+# Sources that are not replayed for repeat checks: the local ingredient verdict
+# is instant anyway and also stands in for the model while it is unavailable
+NOT_REUSED = ("rules",)
+
+
+def upload_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def question_hash(user_input):
+    return hashlib.sha256(normalize_question(user_input).encode("utf-8")).hexdigest()
+
+def _entry(row):
+    row = list(row)
+    row[9] = json.loads(row[9]) if row[9] else None
+    return HistoryEntry(*row)
+
+
+class AnalysisHistory:
+    def __init__(self, path, reuse_seconds=7 * 24 * 3600, retention_seconds=180 * 24 * 3600):
+        self.reuse_seconds = reuse_seconds
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " id INTEGER PRIMARY KEY,"
+            " user_key TEXT,"
+            " channel TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " user_type TEXT NOT NULL,"
+            " language TEXT NOT NULL,"
+            " image_hash TEXT NOT NULL,"
+            " question_hash TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " nutrition TEXT,"
+            " created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS analyses_user ON analyses (user_key, created)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS analyses_mode ON analyses (mode, created)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS analyses_check"
+            " ON analyses (image_hash, mode, user_type, language, question_hash, created)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS analyses_created ON analyses (created)")
+        self._db.execute("DELETE FROM analyses WHERE created < ?", (time.time() - retention_seconds,))
+
+    # Store a final answer; returns its id
+    def record(self, user_key, channel, mode, user_type, language, image_hash, user_input, response, source,
+               nutrition=None):
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO analyses (user_key, channel, mode, user_type, language, image_hash, question_hash,"
+                " response, source, nutrition, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_key, channel, mode, user_type, language, image_hash, question_hash(user_input), response,
+                 source or "model", json.dumps(nutrition) if nutrition else None, time.time()),
+            )
+            return cursor.lastrowid
+
+    # The latest answer to the same check (same upload, mode, user type, language
+    # and question) within the reuse window, or None
+    def find_repeat(self, mode, user_type, language, image_hash, user_input):
+        placeholders = ",".join("?" * len(NOT_REUSED))
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {_COLUMNS} FROM analyses"
+                " WHERE image_hash = ? AND mode = ? AND user_type = ? AND language = ? AND question_hash = ?"
+                f" AND created >= ? AND source NOT IN ({placeholders})"
+                " ORDER BY created DESC LIMIT 1",
+                (image_hash, mode, user_type, language, question_hash(user_input),
+                 time.time() - self.reuse_seconds, *NOT_REUSED),
+            ).fetchone()
+        return _entry(row) if row is not None else None
+
+    # Entries by id, in the order given (missing or expired ids are skipped)
+    def get_many(self, ids):
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self._db.execute(f"SELECT {_COLUMNS} FROM analyses WHERE id IN ({placeholders})", tuple(ids)).fetchall()
+        entries = {row[0]: _entry(row) for row in rows}
+        return [entries[i] for i in ids if i in entries]
+
+    # A user's most recent entries, newest first
+    def recent(self, user_key, limit=20):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {_COLUMNS} FROM analyses WHERE user_key = ? ORDER BY created DESC LIMIT ?", (user_key, limit)
+            ).fetchall()
+        return [_entry(row) for row in rows]
+
+
+_history = None
+_history_lock = threading.Lock()
+
+# Get the process-wide analysis history, opening it on first use
+def get_history():
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                _history = AnalysisHistory(
+                    config.data_path("history.sqlite3"),
+                    reuse_seconds=config.HISTORY_REUSE_SECONDS,
+                    retention_seconds=config.HISTORY_RETENTION_DAYS * 24 * 3600,
+                )
+    return _history
@@ -0,0 +1,111 @@
+import io
+import logging
+from collections import namedtuple
+
+from PIL import Image, ImageOps
+
+import config
+
+# Normalizes uploaded photos before they are previewed or sent to the model.
+# The upload is decoded once (using JPEG draft mode so large photos are decoded
+# at reduced scale), rotated according to its EXIF orientation, downscaled to a
+# maximum edge and re-encoded under a byte budget. The resulting buffer is shared
+# by the preview and the model payload.
+
+logger = logging.getLogger(__name__)
+
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+QUALITY_STEPS = (85, 75, 65, 55, 45)
+# What PIL raises for data it can't read as an image
+DECODE_ERRORS = (OSError, SyntaxError, Image.DecompressionBombError)
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+class PreparedImage(namedtuple("PreparedImage", "data mime_type width height original_bytes")):
+    __slots__ = ()
+
+    @property
+    def bytes_saved(self):
+        return max(0, self.original_bytes - len(self.data))
+
+    # Short human-readable report of the upload savings
+    def describe(self):
+        saved = self.bytes_saved
+        if not saved:
+            return f"{self.width}×{self.height}, {_format_size(len(self.data))}"
+        percent = 100.0 * saved / self.original_bytes
+        return (
+            f"{self.width}×{self.height}, {_format_size(self.original_bytes)} → "
+            f"{_format_size(len(self.data))} ({percent:.0f}% smaller)"
+        )
+
+
+def _format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.0f} KB"
+
+# Flatten transparency onto white so PNG cut-outs don't turn black as JPEG
+def _to_rgb(image):
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+# Encode with decreasing quality until the payload fits the byte budget
+def _encode(image, image_format, max_bytes):
+    data = b""
+    for quality in QUALITY_STEPS:
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=quality, optimize=True)
+        data = buffer.getvalue()
+        if len(data) <= max_bytes:
+            break
+    return data
+
+# Raise InvalidImage unless the bytes look like an image PIL can read (cheap:
+# checks the structure without decoding the pixels)
+def check_image(raw_bytes):
+    try:
+        with Image.open(io.BytesIO(raw_bytes)) as image:
+            image.verify()
+    except DECODE_ERRORS as e:
+        raise InvalidImage("The upload is not a readable JPEG, PNG or WebP image") from e
+
+# Decode, orient, downscale and re-encode an uploaded image; raises InvalidImage
+# when the upload can't be decoded
+def prepare_image(raw_bytes, mime_type, max_edge=None, max_bytes=None, image_format=None):
+    max_edge = max_edge or config.IMAGE_MAX_EDGE
+    max_bytes = max_bytes or config.IMAGE_MAX_BYTES
+    image_format = (image_format or config.IMAGE_FORMAT).upper()
+    if image_format not in FORMAT_MIME_TYPES:
+        image_format = "JPEG"
+
+    try:
+        with Image.open(io.BytesIO(raw_bytes)) as image:
+            # Let the JPEG decoder scale down by a power of two while decoding
+            image.draft("RGB", (max_edge, max_edge))
+            has_orientation = image.getexif().get(0x0112, 1) != 1
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            image = _to_rgb(image)
+    except DECODE_ERRORS as e:
+        raise InvalidImage("The upload is not a readable JPEG, PNG or WebP image") from e
+    width, height = image.size
+    data = _encode(image, image_format, max_bytes)
+    mime = FORMAT_MIME_TYPES[image_format]
+
+    # Keep the original if it was already small enough and re-encoding didn't help
+    if len(raw_bytes) <= len(data) and not has_orientation and mime_type in FORMAT_MIME_TYPES.values():
+        with Image.open(io.BytesIO(raw_bytes)) as original:
+            if max(original.size) <= max_edge:
+                data, mime = raw_bytes, mime_type
+
+    prepared = PreparedImage(data, mime, width, height, len(raw_bytes))
+    logger.info("Prepared upload: %s (saved %d bytes)", prepared.describe(), prepared.bytes_saved)
+    return prepared
@@ -0,0 +1,151 @@
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+import config
+
+# Local rule engine for well-known red-flag ingredients. All brand names, INN
+# names and common misspellings from the versioned table are compiled into one
+# Aho-Corasick automaton, so scanning label text or a question is linear in the
+# text length no matter how large the table grows. A match on the label gives an
+# immediate ❌ verdict without waiting for the model; an ingredient only named in
+# the user's question ("can I take this instead of ibuprofen?") is not on the
+# product, so it only gets a note.
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ingredient_rules.json")
+
+# on_label: found in the label text (False when only the question mentions it)
+IngredientMatch = namedtuple("IngredientMatch", "ingredient term reason start end on_label", defaults=(True,))
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+# Lowercase and collapse everything but letters and digits to single spaces
+def normalize_text(text):
+    return _NON_WORD.sub(" ", (text or "").lower()).strip()
+
+
+class AhoCorasick:
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+    # Add a pattern with an associated value (call build() afterwards)
+    def add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(pattern), value))
+
+    # Compute failure links breadth-first
+    def build(self):
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+        return self
+
+    # Yield (start, end, value) for every pattern occurrence in the text
+    def iter(self, text):
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in output[state]:
+                yield index - length + 1, index + 1, value
+
+
+class IngredientRules:
+    def __init__(self, rules, version=None):
+        self.version = version
+        self.modes = {}
+        self._matcher = AhoCorasick()
+        for rule in rules:
+            entry = (rule["ingredient"], rule["reason"])
+            self.modes[rule["ingredient"]] = tuple(rule.get("modes", ()))
+            for term in set([rule["ingredient"]] + list(rule.get("synonyms", []))):
+                normalized = normalize_text(term)
+                if normalized:
+                    self._matcher.add(normalized, (normalized, entry))
+        self._matcher.build()
+
+    @classmethod
+    def load(cls, path=DEFAULT_RULES_PATH):
+        with open(path, encoding="utf-8") as f:
+            table = json.load(f)
+        return cls(table["rules"], version=table.get("version"))
+
+    # Find red-flag ingredients in the texts; only whole-word matches count
+    def match(self, mode, *texts):
+        found = {}
+        for text in texts:
+            normalized = normalize_text(text)
+            for start, end, (term, (ingredient, reason)) in self._matcher.iter(normalized):
+                if start > 0 and normalized[start - 1] != " ":
+                    continue
+                if end < len(normalized) and normalized[end] != " ":
+                    continue
+                if mode is not None and not any(name in mode for name in self.modes[ingredient]):
+                    continue
+                if ingredient not in found:
+                    found[ingredient] = IngredientMatch(ingredient, term, reason, start, end)
+        return list(found.values())
+
+
+# Matches found on the label itself
+def label_matches(matches):
+    return [m for m in matches if m.on_label]
+
+# Matches only named in the question (they get a note, not a verdict)
+def question_matches(matches):
+    return [m for m in matches if not m.on_label]
+
+# Build the verdict text for matched ingredients in the prompts' output style
+def rule_verdict(matches):
+    lines = [
+        f"❌ Not Safe - Contains {m.ingredient}. {m.reason}" if m.on_label else f"ℹ️ You asked about {m.ingredient}: {m.reason}"
+        for m in matches
+    ]
+    return "\n\n".join(lines)
+
+
+_rules = None
+_rules_lock = threading.Lock()
+
+# Get the shared rule table, loading and compiling it on first use
+def get_ingredient_rules():
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = IngredientRules.load(config.RULES_PATH or DEFAULT_RULES_PATH)
+    return _rules
+
+# Match the label text and question for the selected category; label matches
+# come first, question-only matches are marked on_label=False
+def match_ingredients(mode, label_text, user_input=None):
+    if not config.RULES_ENABLED:
+        return []
+    rules = get_ingredient_rules()
+    on_label = rules.match(mode, label_text) if label_text else []
+    labelled = {m.ingredient for m in on_label}
+    asked = rules.match(mode, user_input) if user_input else []
+    return on_label + [m._replace(on_label=False) for m in asked if m.ingredient not in labelled]
@@ -0,0 +1,360 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import config
+
+# Durable local job queue for inbound messaging requests (e.g. a WhatsApp photo).
+# The webhook enqueues and acknowledges right away; a worker pool drains the
+# queue and runs the normal analysis pipeline.
+#
+# - Jobs live in SQLite (WAL), so they survive restarts.
+# - A claimed job is leased for a visibility timeout, renewed while its handler
+#   runs; if the worker dies, the lease expires and another worker picks the job
+#   up. The attempt number is the lease token: a worker whose lease was taken
+#   over can no longer complete, fail or renew the job.
+# - Failures are retried with full-jitter exponential backoff and moved to the
+#   dead-letter state after max attempts. Bad input (a ValueError, such as an
+#   image that can't be decoded) fails the same way every time, so it is
+#   dead-lettered at once.
+# - The inbound message ID is the idempotency key, so webhook redeliveries don't
+#   create duplicate jobs.
+# - enqueue() refuses new work once the queue is at its maximum depth, so a
+#   burst degrades into fast "try later" answers instead of timeouts.
+# - A job whose lease expires on its last attempt (its worker crashed or hung
+#   every time) is dead-lettered instead of leased again.
+# - Finished jobs (and their results) are purged after a retention period;
+#   dead-lettered jobs are kept for inspection but lose their image.
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+# Seconds between purges of finished jobs
+PURGE_INTERVAL = 600.0
+# Handler errors that retrying can't fix
+NON_RETRYABLE = (ValueError,)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, path, visibility_timeout=120, max_attempts=5, max_depth=10000,
+                 backoff_base=2.0, backoff_cap=300.0):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.max_depth = max_depth
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " idempotency_key TEXT UNIQUE,"
+            " payload TEXT NOT NULL,"
+            " blob BLOB,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " available_at REAL NOT NULL,"
+            " lease_expires REAL,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL,"
+            " result TEXT,"
+            " last_error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)")
+
+    # Add a job; returns (job_id, created). An existing job with the same key is returned instead.
+    def enqueue(self, payload, blob=None, idempotency_key=None):
+        now = time.time()
+        with self._lock:
+            if idempotency_key is not None:
+                row = self._db.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                if row is not None:
+                    return row[0], False
+            depth = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchone()[0]
+            if depth >= self.max_depth:
+                raise QueueFull(f"Queue is full ({depth} jobs waiting)")
+            job_id = uuid.uuid4().hex
+            try:
+                self._db.execute(
+                    "INSERT INTO jobs (id, idempotency_key, payload, blob, status, available_at, created, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, idempotency_key, json.dumps(payload), blob, QUEUED, now, now, now),
+                )
+            except sqlite3.IntegrityError:
+                # Another process enqueued the same message in the meantime
+                row = self._db.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                return row[0], False
+            return job_id, True
+
+    # Lease the next ready job (or one whose lease expired); returns a job dict or None
+    def claim(self):
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                dead = self._db.execute(
+                    "UPDATE jobs SET status = ?, last_error = ?, lease_expires = NULL, updated = ?"
+                    " WHERE status = ? AND lease_expires <= ? AND attempts >= ?",
+                    (DEAD, "Lease expired on the last attempt", now, RUNNING, now, self.max_attempts),
+                ).rowcount
+                if dead:
+                    logger.error("Dead-lettered %d job(s) whose lease expired on their last attempt", dead)
+                row = self._db.execute(
+                    "SELECT id, payload, blob, attempts FROM jobs"
+                    " WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_expires <= ? AND attempts < ?)"
+                    " ORDER BY available_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now, self.max_attempts),
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                job_id, payload, blob, attempts = row
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, attempts = ?, lease_expires = ?, updated = ? WHERE id = ?",
+                    (RUNNING, attempts + 1, now + self.visibility_timeout, now, job_id),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return {"id": job_id, "payload": json.loads(payload), "blob": blob, "attempts": attempts + 1}
+
+    # Extend the lease of a running job; False if the lease was lost to another worker
+    def renew(self, job_id, attempts):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND status = ? AND attempts = ?",
+                (now + self.visibility_timeout, now, job_id, RUNNING, attempts),
+            )
+        return cursor.rowcount == 1
+
+    # Mark a job as finished with its result; False (and nothing changes) if the
+    # lease for this attempt was lost
+    def complete(self, job_id, attempts, result):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, lease_expires = NULL, blob = NULL, updated = ?"
+                " WHERE id = ? AND status = ? AND attempts = ?",
+                (DONE, json.dumps(result), now, job_id, RUNNING, attempts),
+            )
+        return cursor.rowcount == 1
+
+    # Record a failure: retry later with jittered backoff, or dead-letter after max
+    # attempts (or at once when `retry` is False). False (and nothing changes) if
+    # the lease for this attempt was lost.
+    def fail(self, job_id, attempts, error, retry=True):
+        now = time.time()
+        with self._lock:
+            if not retry or attempts >= self.max_attempts:
+                cursor = self._db.execute(
+                    "UPDATE jobs SET status = ?, last_error = ?, lease_expires = NULL, updated = ?"
+                    " WHERE id = ? AND status = ? AND attempts = ?",
+                    (DEAD, str(error), now, job_id, RUNNING, attempts),
+                )
+                if cursor.rowcount == 1:
+                    logger.error("Job %s dead-lettered after %d attempts: %s", job_id, attempts, error)
+                return cursor.rowcount == 1
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempts)))
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, last_error = ?, lease_expires = NULL, updated = ?"
+                " WHERE id = ? AND status = ? AND attempts = ?",
+                (QUEUED, now + delay, str(error), now, job_id, RUNNING, attempts),
+            )
+        return cursor.rowcount == 1
+
+    # Status, attempts, result and last error of a job (None if unknown)
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, attempts, result, last_error, created, updated FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, attempts, result, last_error, created, updated = row
+        return {
+            "id": job_id,
+            "status": status,
+            "attempts": attempts,
+            "result": json.loads(result) if result else None,
+            "error": last_error,
+            "created": created,
+            "updated": updated,
+        }
+
+    # Queue depth, dead-letter count and the age of the oldest waiting job
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = self._db.execute(
+                "SELECT MIN(created) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchone()[0]
+        return {
+            "depth": counts.get(QUEUED, 0) + counts.get(RUNNING, 0),
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "done": counts.get(DONE, 0),
+            "dead": counts.get(DEAD, 0),
+            "oldest_age_seconds": round(now - oldest, 3) if oldest else 0.0,
+            "max_depth": self.max_depth,
+        }
+
+    # Delete finished jobs and drop the images of dead-lettered jobs older than
+    # `age` seconds; returns how many jobs were deleted
+    def purge_finished(self, age):
+        cutoff = time.time() - age
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM jobs WHERE status = ? AND updated < ?", (DONE, cutoff))
+            self._db.execute(
+                "UPDATE jobs SET blob = NULL WHERE status = ? AND updated < ? AND blob IS NOT NULL", (DEAD, cutoff)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class WorkerPool:
+    def __init__(self, queue, handler, workers=4, poll_interval=0.5, retention=24 * 3600):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._stop = threading.Event()
+        self._threads = []
+        # job id -> attempt number of the jobs this pool is running
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, name="job-maintenance", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    # Renew the leases of running jobs well before they expire, and purge finished jobs
+    def _maintain(self):
+        next_purge = time.monotonic()
+        while not self._stop.wait(self.queue.visibility_timeout / 3):
+            with self._running_lock:
+                running = list(self._running.items())
+            for job_id, attempts in running:
+                try:
+                    if not self.queue.renew(job_id, attempts):
+                        logger.warning("Lost the lease on job %s (attempt %d)", job_id, attempts)
+                except Exception as e:
+                    logger.warning("Could not renew job %s: %s", job_id, e)
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + PURGE_INTERVAL
+                try:
+                    self.queue.purge_finished(self.retention)
+                except Exception as e:
+                    logger.warning("Could not purge finished jobs: %s", e)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim()
+            except Exception as e:
+                logger.warning("Could not claim job: %s", e)
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            with self._running_lock:
+                self._running[job["id"]] = job["attempts"]
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                logger.warning("Job %s failed (attempt %d): %s", job["id"], job["attempts"], e)
+                recorded = self.queue.fail(job["id"], job["attempts"], e, retry=not isinstance(e, NON_RETRYABLE))
+            else:
+                recorded = self.queue.complete(job["id"], job["attempts"], result)
+            finally:
+                with self._running_lock:
+                    self._running.pop(job["id"], None)
+            if not recorded:
+                logger.warning("Job %s attempt %d finished after its lease was taken over; result dropped",
+                               job["id"], job["attempts"])
+
+
+# Run the analysis pipeline for a queued messaging request
+def analysis_job_handler(job):
+    # Imported here so the queue itself can be used without loading the pipeline
+    from analysis_service import analyze, result_to_dict
+
+    payload = job["payload"]
+    result = analyze(
+        job["blob"], payload["mime_type"], payload["mode"], payload.get("user_type", "regular"),
+        payload.get("question", ""), channel="queue",
+        user_key=payload.get("reply_to") or (f"user:{payload['user_id']}" if payload.get("user_id") else None),
+        language=payload.get("language"),
+    )
+    return {**result_to_dict(result), "reply_to": payload.get("reply_to")}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+# Get the process-wide job queue, opening it on first use
+def get_job_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(
+                    config.data_path("jobs.sqlite3"),
+                    visibility_timeout=config.QUEUE_VISIBILITY_TIMEOUT,
+                    max_attempts=config.QUEUE_MAX_ATTEMPTS,
+                    max_depth=config.QUEUE_MAX_DEPTH,
+                )
+    return _queue
+
+# Start a worker pool that drains the shared queue with the analysis pipeline
+def start_workers(workers=None):
+    pool = WorkerPool(
+        get_job_queue(), analysis_job_handler, workers=workers or config.QUEUE_WORKERS,
+        retention=config.QUEUE_RESULT_RETENTION_HOURS * 3600,
+    )
+    pool.start()
+    return pool
+
+
+# Run standalone workers:  python job_queue.py
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    pool = start_workers()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info("Queue stats: %s", get_job_queue().stats())
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,104 @@
+import logging
+import threading
+from collections import defaultdict
+
+import config
+from upload_memory import payload_bytes
+
+# Optional OCR pre-pass for drug and cosmetic labels. A single easyocr reader is
+# loaded in a background thread when the app starts and shared by all sessions.
+# When the label text is read with high confidence, the model gets a small
+# text-only request instead of the full photo; otherwise the image is sent as
+# before. Per-mode counters show how often the fast path fires.
+
+logger = logging.getLogger(__name__)
+
+OCR_MODES = ("Drug", "Medicine", "Cosmetic")
+
+_reader = None
+_reader_error = None
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {"attempts": 0, "text_only": 0, "image_fallback": 0})
+
+
+def _load_reader():
+    global _reader, _reader_error
+    try:
+        import easyocr
+        _reader = easyocr.Reader(config.OCR_LANGUAGES, gpu=False, verbose=False)
+        logger.info("OCR reader ready")
+    except Exception as e:
+        _reader_error = e
+        logger.warning("OCR reader unavailable: %s", e)
+
+# Start loading the OCR reader in the background (only once per process)
+def start_ocr_warmup():
+    global _warmup_thread
+    if not config.OCR_ENABLED:
+        return
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_load_reader, name="ocr-warmup", daemon=True)
+            _warmup_thread.start()
+
+# Load the shared reader now, for offline jobs; None when easyocr is unavailable
+def load_ocr_reader():
+    with _warmup_lock:
+        if _reader is None and _reader_error is None and _warmup_thread is None:
+            _load_reader()
+    if _warmup_thread is not None:
+        _warmup_thread.join()
+    return _reader
+
+# The shared reader, or None while it is still loading (or failed to load)
+def get_ocr_reader():
+    return _reader
+
+# Whether the OCR pre-pass applies to the selected category
+def ocr_applies(mode):
+    return config.OCR_ENABLED and any(name in mode for name in OCR_MODES)
+
+# Read the label text from an image; returns (text, confidence)
+def extract_label_text(image_bytes, reader=None):
+    reader = reader or get_ocr_reader()
+    if reader is None:
+        return "", 0.0
+    results = reader.readtext(payload_bytes(image_bytes), paragraph=False)
+    words = [(text.strip(), confidence) for _, text, confidence in results if text.strip()]
+    if not words:
+        return "", 0.0
+    total_chars = sum(len(text) for text, _ in words)
+    # Weight each fragment's confidence by its length so stray single characters don't dominate
+    confidence = sum(len(text) * conf for text, conf in words) / total_chars
+    return "\n".join(text for text, _ in words), confidence
+
+# Try the OCR fast path for one request; returns the label text, or None to send the image
+def label_text_for(mode, image_bytes):
+    if not ocr_applies(mode) or get_ocr_reader() is None:
+        return None
+    key = next(name for name in OCR_MODES if name in mode)
+    try:
+        text, confidence = extract_label_text(image_bytes)
+    except Exception as e:
+        logger.warning("OCR failed, sending image instead: %s", e)
+        text, confidence = "", 0.0
+    use_text = confidence >= config.OCR_MIN_CONFIDENCE and len(text) >= config.OCR_MIN_CHARS
+    with _stats_lock:
+        stats = _stats[key]
+        stats["attempts"] += 1
+        stats["text_only" if use_text else "image_fallback"] += 1
+    return text if use_text else None
+
+# Build the text part that replaces the image in a text-only request
+def label_text_part(label_text):
+    return (
+        "The product label was read from the user's photo. Label text (OCR):\n"
+        f"\"\"\"\n{label_text}\n\"\"\""
+    )
+
+# Per-mode counts of OCR attempts, text-only requests and image fallbacks
+def ocr_stats():
+    with _stats_lock:
+        return {mode: dict(counts) for mode, counts in _stats.items()}
@@ -0,0 +1,246 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# Lightweight per-request tracing. A RequestTrace times each stage of a check
+# (upload read, image preparation, cache lookups, OCR, model call, rendering) and
+# records payload size, token counts, where the answer came from and errors,
+# tagged by mode and user type. Finished traces feed process-wide Prometheus-style
+# histograms and counters and are written as one JSON log line per request.
+#
+# Everything is in-process and lock-protected counters only, so it is cheap
+# enough to leave on in production.
+
+request_logger = logging.getLogger("nurtureai.requests")
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_trace = contextvars.ContextVar("nurtureai_trace", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def observe(self, name, labels, value, buckets=STAGE_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.total:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            if name not in seen:
+                lines.append(f"# TYPE {name} gauge")
+                seen.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+registry = MetricsRegistry()
+
+
+class RequestTrace:
+    def __init__(self, mode="", user_type="", channel="web"):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.tags = {"mode": mode, "user_type": user_type, "channel": channel}
+        self.stages = {}
+        self.fields = {"payload_bytes": 0, "prompt_tokens": 0, "response_tokens": 0, "source": "model"}
+        self.error = None
+        self.started = time.perf_counter()
+        self._token = None
+
+    # Time a stage; repeated stages add up
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            if self.error is None:
+                self.fail(name, e)
+            raise
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - started)
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def add_tokens(self, prompt_tokens, response_tokens):
+        self.fields["prompt_tokens"] += prompt_tokens or 0
+        self.fields["response_tokens"] += response_tokens or 0
+
+    def fail(self, stage, error):
+        self.error = {"stage": stage, "type": type(error).__name__, "message": str(error)[:200]}
+
+    def __enter__(self):
+        self._token = _current_trace.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and self.error is None:
+            self.fail("unknown", exc)
+        _current_trace.reset(self._token)
+        self.finish()
+        return False
+
+    # Record the trace in the registry and write the structured log line
+    def finish(self):
+        total = time.perf_counter() - self.started
+        tags = {key: value for key, value in self.tags.items() if key != "channel"}
+        for name, seconds in self.stages.items():
+            registry.observe("nurtureai_stage_seconds", {**tags, "stage": name}, seconds)
+        registry.observe("nurtureai_request_seconds", tags, total)
+        registry.increment("nurtureai_requests_total", {**self.tags, "source": self.fields["source"]})
+        registry.increment("nurtureai_payload_bytes_total", tags, self.fields["payload_bytes"])
+        registry.increment("nurtureai_tokens_total", {**tags, "kind": "prompt"}, self.fields["prompt_tokens"])
+        registry.increment("nurtureai_tokens_total", {**tags, "kind": "response"}, self.fields["response_tokens"])
+        if self.fields["source"] != "model":
+            registry.increment("nurtureai_cache_hits_total", {**tags, "source": self.fields["source"]})
+        if self.error is not None:
+            registry.increment("nurtureai_errors_total", {**tags, "stage": self.error["stage"]})
+
+        if config.METRICS_LOG_REQUESTS:
+            request_logger.info(json.dumps({
+                "request_id": self.request_id,
+                **self.tags,
+                **self.fields,
+                "total_ms": round(total * 1000, 1),
+                "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+                "error": self.error,
+            }, ensure_ascii=False))
+
+
+# The trace of the request being handled on this thread/task, if any
+def current_trace():
+    return _current_trace.get()
+
+# Time a stage of the current request (or record it untagged when there is none)
+@contextmanager
+def stage(name):
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace.stage(name):
+            yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("nurtureai_stage_seconds", {"stage": name}, time.perf_counter() - started)
+
+# Add model token usage to the current request
+def record_tokens(prompt_tokens, response_tokens):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_tokens(prompt_tokens, response_tokens)
+
+# Prometheus text for every metric recorded in this process
+def render_metrics():
+    return registry.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+# Serve /metrics on NURTUREAI_METRICS_PORT from a background thread (once per process).
+# Used by the Streamlit app, which can't add its own routes; the API serves /metrics itself.
+def start_metrics_server():
+    global _server
+    if not config.METRICS_PORT:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", config.METRICS_PORT), _MetricsHandler)
+            except OSError as e:
+                # Don't retry on every rerun (e.g. another process already owns the port)
+                logging.getLogger(__name__).warning("Metrics server not started: %s", e)
+                _server = False
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server or None
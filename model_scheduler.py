@@ -0,0 +1,243 @@
+import contextvars
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+import config
+from metrics import registry
+from rate_limit import get_model_rate_limiter
+from resilience import ModelUnavailable
+
+# Shared, bounded executor for model calls. A fixed pool of workers makes the
+# upstream calls; requests wait in one FIFO queue per user (a web session, a
+# messaging number, an API client), and the workers take from the users in
+# turn, so one user's batch can't starve everyone else. Waiting callers get
+# their queue position and an estimated wait to show instead of a bare
+# spinner, and when the queue is too deep or the wait too long new requests
+# are refused up front instead of piling up threads and memory.
+#
+# Every call takes a token from the shared rate limiter in the worker, just
+# before it runs, so all model traffic (web, API, batch, jobs, translations,
+# broadcasts) stays within the quota, and callers wait in the bounded queue
+# rather than on the token bucket. A call that can't get a token within the
+# maximum wait fails with Overloaded.
+
+# Service time assumed until real calls have been measured
+INITIAL_SERVICE_SECONDS = 5.0
+# How often a waiting caller is told its position (s)
+POLL_INTERVAL = 0.5
+
+_DONE = object()
+
+
+class Overloaded(ModelUnavailable):
+    pass
+
+
+class Ticket:
+    def __init__(self, scheduler, user_key, fn):
+        self.user_key = user_key
+        self._scheduler = scheduler
+        self._fn = fn
+        # Run in the caller's context so stages and tokens land on its request trace
+        self._context = contextvars.copy_context()
+        self._chunks = queue.Queue()
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.result_value = None
+        self.error = None
+
+    def _run(self):
+        try:
+            self.result_value = self._context.run(self._fn, self._chunks.put)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._chunks.put(_DONE)
+            self.done.set()
+
+    # Finish without running
+    def _fail(self, error):
+        self.error = error
+        self._chunks.put(_DONE)
+        self.done.set()
+
+    # Stop waiting: a ticket that hasn't started is taken off the queue
+    def cancel(self):
+        self._scheduler._remove(self)
+
+    # Block until a worker picks the ticket up, reporting on_wait(requests_ahead,
+    # estimated_wait_seconds) while it is queued and on_wait(None, None) once it starts
+    def wait_started(self, on_wait=None):
+        try:
+            while not self.started.wait(POLL_INTERVAL if on_wait else None):
+                on_wait(*self._scheduler.position(self))
+        except BaseException:
+            self.cancel()
+            raise
+        if on_wait is not None:
+            on_wait(None, None)
+
+    # Block until the call finishes (at most `timeout` seconds) and return its result
+    def result(self, timeout=None):
+        try:
+            if not self.done.wait(timeout):
+                raise TimeoutError("The model call did not finish in time")
+        except BaseException:
+            self.cancel()
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result_value
+
+    # Yield the chunks the call emits as they arrive, then raise its error if it failed
+    def stream(self):
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is _DONE:
+                    break
+                yield chunk
+        except BaseException:
+            self.cancel()
+            raise
+        if self.error is not None:
+            raise self.error
+
+
+class FairScheduler:
+    def __init__(self, workers, max_queued=200, max_per_user=8, max_wait=120.0, limiter=None):
+        self.workers = workers
+        self.limiter = limiter
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.max_wait = max_wait
+        self._queues = {}
+        self._turns = deque()
+        self._queued = 0
+        self._running = 0
+        self._service_seconds = INITIAL_SERVICE_SECONDS
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"model-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # Queue fn(emit) for a user; emit(chunk) passes streamed chunks back to the caller.
+    # Raises Overloaded when the queue is full or the wait would be too long.
+    def submit(self, user_key, fn):
+        ticket = Ticket(self, user_key, fn)
+        with self._condition:
+            self._start()
+            pending = self._queues.get(user_key)
+            if pending is not None and len(pending) >= self.max_per_user:
+                registry.increment("nurtureai_model_shed_total", {"reason": "per_user"})
+                raise Overloaded("You already have several checks waiting. Please wait for them to finish.")
+            if self._queued >= self.max_queued or self._estimate(self._queued) > self.max_wait:
+                registry.increment("nurtureai_model_shed_total", {"reason": "overload"})
+                raise Overloaded(
+                    f"NurtureAI is very busy right now ({self._queued} checks waiting). Please try again in a few minutes."
+                )
+            if pending is None:
+                pending = self._queues[user_key] = deque()
+                self._turns.append(user_key)
+            pending.append(ticket)
+            self._queued += 1
+            self._condition.notify()
+        return ticket
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queued:
+                    self._condition.wait()
+                user_key = self._turns.popleft()
+                pending = self._queues[user_key]
+                ticket = pending.popleft()
+                if pending:
+                    self._turns.append(user_key)
+                else:
+                    del self._queues[user_key]
+                self._queued -= 1
+                self._running += 1
+            # The token wait counts as service time, so estimates reflect the quota
+            started = time.perf_counter()
+            if self.limiter is not None and not self.limiter.acquire(timeout=self.max_wait):
+                registry.increment("nurtureai_model_shed_total", {"reason": "rate_limit"})
+                ticket.started.set()
+                ticket._fail(Overloaded("NurtureAI is very busy right now. Please try again in a few minutes."))
+            else:
+                ticket.started.set()
+                ticket._run()
+            elapsed = time.perf_counter() - started
+            with self._condition:
+                self._running -= 1
+                # Moving average of how long a call holds a worker
+                self._service_seconds += 0.1 * (elapsed - self._service_seconds)
+            registry.observe("nurtureai_model_queue_service_seconds", {}, elapsed)
+
+    def _remove(self, ticket):
+        with self._condition:
+            pending = self._queues.get(ticket.user_key)
+            if pending is None or ticket not in pending:
+                return
+            pending.remove(ticket)
+            self._queued -= 1
+            if not pending:
+                del self._queues[ticket.user_key]
+                self._turns.remove(ticket.user_key)
+
+    # Seconds until a request with `ahead` requests before it starts
+    def _estimate(self, ahead):
+        if self._running + ahead < self.workers:
+            return 0.0
+        return math.ceil((ahead + 1) / self.workers) * self._service_seconds
+
+    # (requests ahead of this ticket, estimated wait in seconds), or (0, 0.0) once started.
+    # Users are served in turn, so other users' tickets ahead are those up to the same depth.
+    def position(self, ticket):
+        with self._condition:
+            pending = self._queues.get(ticket.user_key)
+            if pending is None or ticket not in pending:
+                return 0, 0.0
+            depth = pending.index(ticket)
+            own_turn = self._turns.index(ticket.user_key)
+            ahead = depth
+            for turn, user_key in enumerate(self._turns):
+                if user_key != ticket.user_key:
+                    ahead += min(len(self._queues[user_key]), depth + (1 if turn < own_turn else 0))
+            return ahead, self._estimate(ahead)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._queued,
+                "users_waiting": len(self._queues),
+                "service_seconds": round(self._service_seconds, 2),
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# Get the shared scheduler, creating it on first use
+def get_model_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = FairScheduler(
+                    workers=config.MODEL_WORKERS,
+                    max_queued=config.MODEL_QUEUE_MAX,
+                    max_per_user=config.MODEL_QUEUE_PER_USER,
+                    max_wait=config.MODEL_QUEUE_MAX_WAIT,
+                    limiter=get_model_rate_limiter(),
+                )
+    return _scheduler
@@ -0,0 +1,211 @@
+import html
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+import config
+from ingredient_rules import normalize_text
+
+# Local calorie and macro calculation for the calorie checker. The model only
+# lists what is on the plate (name, portion, grams); the numbers come from a
+# versioned per-100 g nutrition table of common Nigerian staples. Lookups and
+# sums run as NumPy array operations, so totals are deterministic and a whole
+# meal log costs about the same as a single plate.
+
+DEFAULT_NUTRITION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrition_table.json")
+
+NUTRIENTS = ("calories", "protein", "carbs", "fat")
+
+# Portion assumed for a known food listed without grams or a calorie estimate,
+# unless the table gives the food its own "serving"
+DEFAULT_SERVING_GRAMS = 150.0
+
+MealItem = namedtuple("MealItem", "name portion grams matched calories protein carbs fat")
+
+# "ITEM: Jollof rice | 1 plate | 300 | 480" (the last field is the model's own
+# calorie estimate, only used for foods the table does not know)
+_ITEM_LINE = re.compile(r"^\s*(?:[-*•]\s*|\d+[.)]\s*)?\**ITEM\**\s*:\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+_ASSESSMENT = re.compile(r"^\s*\**ASSESSMENT\**\s*:\s*(.*?)\s*(?=⚠️|\Z)", re.IGNORECASE | re.MULTILINE | re.DOTALL)
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+class NutritionTable:
+    def __init__(self, foods, version=None):
+        self.version = version
+        self.names = [food["name"] for food in foods]
+        # One row per food, one column per nutrient, in units per gram
+        self.values = np.array([[food[n] for n in NUTRIENTS] for food in foods], dtype=np.float64) / 100.0
+        self.servings = np.array([food.get("serving", DEFAULT_SERVING_GRAMS) for food in foods], dtype=np.float64)
+        self._index = {}
+        for row, food in enumerate(foods):
+            for term in [food["name"]] + list(food.get("synonyms", [])):
+                normalized = normalize_text(term)
+                if normalized:
+                    self._index.setdefault(normalized, row)
+        # Longest terms first, so "fried plantain" wins over "plantain"
+        self._terms = sorted(self._index, key=len, reverse=True)
+        self._resolved = {}
+
+    @classmethod
+    def load(cls, path=DEFAULT_NUTRITION_PATH):
+        with open(path, encoding="utf-8") as f:
+            table = json.load(f)
+        return cls(table["foods"], version=table.get("version"))
+
+    # Row for a food name: an exact name or synonym, else the longest known term
+    # contained in it as whole words; -1 when the food is unknown
+    def find(self, name):
+        normalized = normalize_text(name)
+        row = self._resolved.get(normalized)
+        if row is None:
+            row = self._index.get(normalized, -1)
+            if row < 0:
+                padded = f" {normalized} "
+                row = next((self._index[term] for term in self._terms if f" {term} " in padded), -1)
+            if len(self._resolved) < 10000:
+                self._resolved[normalized] = row
+        return row
+
+    def rows_for(self, names):
+        return np.fromiter((self.find(name) for name in names), dtype=np.intp, count=len(names))
+
+    # Nutrients for each (row, grams) pair as an (items, nutrients) array, plus
+    # the mask of items the table knows; unknown items are left at zero
+    def nutrients(self, rows, grams):
+        rows = np.asarray(rows, dtype=np.intp)
+        grams = np.asarray(grams, dtype=np.float64)
+        known = rows >= 0
+        amounts = np.zeros((len(rows), len(NUTRIENTS)))
+        amounts[known] = self.values[rows[known]] * grams[known, None]
+        return amounts, known
+
+
+class MealEstimate:
+    def __init__(self, items, totals, assessment=""):
+        self.items = items
+        self.totals = totals
+        self.assessment = assessment
+
+    @property
+    def unmatched(self):
+        return [item.name for item in self.items if item.matched is None]
+
+    def to_dict(self):
+        return {
+            "items": [item._asdict() for item in self.items],
+            "totals": self.totals,
+            "assessment": self.assessment,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([MealItem(**item) for item in data["items"]], data["totals"], data.get("assessment", ""))
+
+
+# Pull the item lines and assessment out of a calorie response
+def parse_meal(response):
+    items = []
+    for match in _ITEM_LINE.finditer(response or ""):
+        fields = [field.strip("* ") for field in match.group(1).split("|")]
+        name = fields[0]
+        if not name:
+            continue
+        portion = fields[1] if len(fields) > 1 else ""
+        grams = _first_number(fields[2]) if len(fields) > 2 else None
+        estimate = _first_number(fields[3]) if len(fields) > 3 else None
+        items.append((name, portion, grams or 0.0, estimate))
+    assessment = _ASSESSMENT.search(response or "")
+    return items, assessment.group(1).strip() if assessment else ""
+
+def _first_number(text):
+    match = _NUMBER.search(text or "")
+    return float(match.group(0).replace(",", ".")) if match else None
+
+
+# Compute the calorie and macro breakdown for a calorie response, or None when
+# it does not list any items (e.g. an answer cached before this format)
+def estimate_meal(response, table=None):
+    parsed, assessment = parse_meal(response)
+    if not parsed:
+        return None
+    table = table or get_nutrition_table()
+    names = [name for name, _, _, _ in parsed]
+    grams = np.array([g for _, _, g, _ in parsed], dtype=np.float64)
+    rows = table.rows_for(names)
+    estimates = np.array([e if e is not None else np.nan for _, _, _, e in parsed], dtype=np.float64)
+    # Known foods listed without grams: the weight implied by the model's calorie
+    # estimate, else a standard serving
+    missing = (rows >= 0) & (grams <= 0)
+    if missing.any():
+        per_gram = table.values[rows[missing], 0]
+        implied = np.divide(estimates[missing], per_gram, out=np.full(len(per_gram), np.nan), where=per_gram > 0)
+        grams[missing] = np.where(np.isnan(implied), table.servings[rows[missing]], implied)
+    amounts, known = table.nutrients(rows, grams)
+    # Foods missing from the table fall back to the model's own calorie estimate
+    amounts[~known, 0] = np.nan_to_num(estimates[~known])
+    totals = amounts.sum(axis=0)
+
+    items = [
+        MealItem(name, portion, round(float(g)), table.names[row] if row >= 0 else None,
+                 *(round(float(v), 1) for v in amount))
+        for (name, portion, _, _), g, row, amount in zip(parsed, grams, rows, amounts)
+    ]
+    return MealEstimate(items, {n: round(float(v), 1) for n, v in zip(NUTRIENTS, totals)}, assessment)
+
+
+# Plain-text breakdown in the "Item - X calories" style of the original prompt
+def calorie_report(meal):
+    lines = []
+    for number, item in enumerate(meal.items, 1):
+        portion = ", ".join(part for part in (item.portion, f"{item.grams} g" if item.grams else "") if part)
+        approx = "" if item.matched else "~"
+        lines.append(f"{number}. {item.name}" + (f" ({portion})" if portion else "") + f" - {approx}{item.calories:.0f} calories")
+    totals = meal.totals
+    lines.append("")
+    lines.append(
+        f"Total: {totals['calories']:.0f} calories "
+        f"(protein {totals['protein']:.0f} g, carbs {totals['carbs']:.0f} g, fat {totals['fat']:.0f} g)"
+    )
+    if meal.assessment:
+        lines.append("")
+        lines.append(meal.assessment)
+    return "\n".join(lines)
+
+# HTML breakdown using the app's .calorie-table and .calorie-total styles
+def calorie_table_html(meal):
+    rows = []
+    for item in meal.items:
+        name = html.escape(item.name)
+        if item.matched is None:
+            name += " <small>(model estimate)</small>"
+        macros = "".join(f"<td>{getattr(item, n):.0f} g</td>" if item.matched else "<td>–</td>" for n in NUTRIENTS[1:])
+        rows.append(
+            f"<tr><td>{name}</td><td>{html.escape(item.portion)}</td><td>{item.grams} g</td>"
+            f"<td>{item.calories:.0f}</td>{macros}</tr>"
+        )
+    totals = meal.totals
+    return (
+        "<table class='calorie-table'>"
+        "<tr><th>Item</th><th>Portion</th><th>Weight</th><th>Calories</th><th>Protein</th><th>Carbs</th><th>Fat</th></tr>"
+        + "".join(rows)
+        + "</table>"
+        f"<div class='calorie-total'>Total: {totals['calories']:.0f} calories · protein {totals['protein']:.0f} g"
+        f" · carbs {totals['carbs']:.0f} g · fat {totals['fat']:.0f} g</div>"
+    )
+
+
+_table = None
+_table_lock = threading.Lock()
+
+# Get the shared nutrition table, loading it on first use
+def get_nutrition_table():
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = NutritionTable.load(config.NUTRITION_PATH or DEFAULT_NUTRITION_PATH)
+    return _table
@@ -0,0 +1,257 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from itertools import combinations
+
+import numpy as np
+from PIL import Image, ImageOps
+
+import config
+from response_cache import normalize_question
+from upload_memory import payload_file
+
+# Near-duplicate lookup for product photos. Each analyzed upload is reduced to a
+# 64-bit difference hash (dHash); two photos of the same box taken by different
+# phones land within several bits of each other. Lookups use multi-index hashing:
+# the hash is split into four 16-bit chunks, and any hash within distance r must
+# match at least one chunk within r // 4 bits, so only a handful of buckets are
+# probed no matter how many hashes are stored. Buckets are kept per scope and
+# hold only row positions; the responses stay in SQLite, which expires and trims
+# them with the same TTL and byte budget as the response cache.
+#
+# At the distances re-shots actually land at, the 64-bit hash alone also matches
+# different products with similar packaging, so each candidate must also be close
+# on a finer 256-bit dHash (the detail hash, stored next to the response) before
+# its verdict is reused. The detail hash tells packs apart by their printed text
+# and layout, which the coarse hash is too small to see.
+
+HASH_BITS = 64
+DETAIL_SIZE = 16
+DETAIL_BITS = DETAIL_SIZE * DETAIL_SIZE
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Adds between expiry and size checks (the table may run over its budget by this many rows)
+EVICT_EVERY = 256
+
+
+# Compute the difference hash of an image (size * size bits; 64 by default)
+def dhash(image, size=8):
+    image = ImageOps.exif_transpose(image)
+    small = image.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+# Compute the 64-bit dHash and the 256-bit detail hash straight from uploaded image bytes
+def dhash_bytes(image_bytes):
+    with Image.open(payload_file(image_bytes)) as image:
+        image.draft("L", (64, 64))
+        return dhash(image), dhash(image, DETAIL_SIZE)
+
+# Number of differing bits between two hashes
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+# Convert a similarity (0-1) to the largest Hamming distance it allows between `bits`-bit hashes
+def max_distance_for(similarity, bits=HASH_BITS):
+    return max(0, int(bits * (1.0 - similarity)))
+
+# Verdicts are only shared between requests with the same prompt (mode + user type) and question
+def make_scope(input_prompt, user_input):
+    text = input_prompt + "\0" + normalize_question(user_input)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+# XOR masks that turn a chunk value into every value within `radius` bits of it
+def _neighbour_masks(radius):
+    masks = [0]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), flips):
+            masks.append(sum(1 << bit for bit in bits))
+    return masks
+
+# Hamming distances between each of `hashes` (a uint64 array) and `phash`
+def _distances(hashes, phash):
+    bits = np.unpackbits((hashes ^ np.uint64(phash)).view(np.uint8))
+    return bits.reshape(len(hashes), HASH_BITS).sum(axis=1)
+
+
+class PerceptualIndex:
+    def __init__(self, path, similarity=0.85, detail_similarity=0.86, ttl_seconds=7 * 24 * 3600,
+                 max_bytes=64 * 1024 * 1024):
+        self.max_distance = max_distance_for(similarity)
+        self.max_detail_distance = max_distance_for(detail_similarity, DETAIL_BITS)
+        self._masks = _neighbour_masks(self.max_distance // CHUNKS)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._adds = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS image_hashes ("
+            " id INTEGER PRIMARY KEY,"
+            " phash INTEGER NOT NULL,"
+            " scope TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL DEFAULT 0,"
+            " detail BLOB)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(image_hashes)")}
+        if "created" not in columns:
+            # Rows from before the TTL existed count as expired
+            self._db.execute("ALTER TABLE image_hashes ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("ALTER TABLE image_hashes ADD COLUMN created REAL NOT NULL DEFAULT 0")
+        if "detail" not in columns:
+            # Rows from before the detail hash existed can't be confirmed and are never reused
+            self._db.execute("ALTER TABLE image_hashes ADD COLUMN detail BLOB")
+        self._db.execute("CREATE INDEX IF NOT EXISTS image_hashes_created ON image_hashes (created)")
+        with self._lock:
+            self._evict(time.time())
+            self._load()
+
+    # Rebuild the in-memory index from the table. Only (hash, row id, created)
+    # is kept in memory, bucketed by scope; responses are read from SQLite on a hit.
+    def _load(self):
+        self._hashes = array("Q")
+        self._rowids = array("q")
+        self._created = array("d")
+        self._scopes = {}
+        for rowid, phash, scope, created in self._db.execute(
+            "SELECT id, phash, scope, created FROM image_hashes ORDER BY id"
+        ):
+            self._index(rowid, phash & 0xFFFFFFFFFFFFFFFF, scope, created)
+        self._live = len(self._hashes)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _index(self, rowid, phash, scope, created):
+        position = len(self._hashes)
+        self._hashes.append(phash)
+        self._rowids.append(rowid)
+        self._created.append(created)
+        tables = self._scopes.get(scope)
+        if tables is None:
+            tables = self._scopes[scope] = [dict() for _ in range(CHUNKS)]
+        for i in range(CHUNKS):
+            chunk = (phash >> (i * CHUNK_BITS)) & CHUNK_MASK
+            bucket = tables[i].get(chunk)
+            if bucket is None:
+                bucket = tables[i][chunk] = array("I")
+            bucket.append(position)
+
+    # Find the closest stored verdict for the same scope whose detail hash is close
+    # too; returns (response, distance) or None
+    def lookup(self, phash, scope, detail):
+        oldest = time.time() - self.ttl_seconds
+        with self._lock:
+            tables = self._scopes.get(scope)
+            if tables is None:
+                return None
+            found = array("I")
+            for i in range(CHUNKS):
+                chunk = (phash >> (i * CHUNK_BITS)) & CHUNK_MASK
+                get = tables[i].get
+                for mask in self._masks:
+                    bucket = get(chunk ^ mask)
+                    if bucket is not None:
+                        found.extend(bucket)
+            if not found:
+                return None
+            # Candidates are checked in one pass: the radius re-shots need yields
+            # thousands of them once hundreds of thousands of hashes are stored. A hash
+            # found through several chunks is deduplicated after the distance filter.
+            positions = np.frombuffer(found, dtype=np.uint32)
+            distances = _distances(np.frombuffer(self._hashes, dtype=np.uint64)[positions], phash)
+            keep = (distances <= self.max_distance) & (np.frombuffer(self._created)[positions] >= oldest)
+            positions, first = np.unique(positions[keep], return_index=True)
+            distances = distances[keep][first]
+            # Closest first; a row evicted by another process is skipped
+            for k in np.argsort(distances, kind="stable"):
+                position, distance = int(positions[k]), int(distances[k])
+                row = self._db.execute(
+                    "SELECT response, detail FROM image_hashes WHERE id = ?", (self._rowids[position],)
+                ).fetchone()
+                if row is None or row[1] is None:
+                    continue
+                if hamming(detail, int.from_bytes(row[1], "big")) <= self.max_detail_distance:
+                    return row[0], distance
+        return None
+
+    # Remember the verdict for an analyzed image
+    def add(self, phash, scope, response, detail):
+        now = time.time()
+        with self._lock:
+            # SQLite integers are signed 64-bit, so store the hash in two's complement
+            stored = phash - (1 << HASH_BITS) if phash >= 1 << (HASH_BITS - 1) else phash
+            cursor = self._db.execute(
+                "INSERT INTO image_hashes (phash, scope, response, size, created, detail)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    stored, scope, response, len(response.encode("utf-8")), now,
+                    detail.to_bytes(DETAIL_BITS // 8, "big"),
+                ),
+            )
+            self._index(cursor.lastrowid, phash, scope, now)
+            self._live += 1
+            self._adds += 1
+            if self._adds % EVICT_EVERY == 0:
+                self._evict(now)
+                # Drop evicted rows from memory once they make up half the index
+                if self._live * 2 < len(self._hashes):
+                    self._load()
+
+    # Drop expired rows and trim the table to its byte budget (oldest first)
+    # (caller holds the lock)
+    def _evict(self, now):
+        self._db.execute("DELETE FROM image_hashes WHERE created < ?", (now - self.ttl_seconds,))
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM image_hashes").fetchone()
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            doomed = []
+            for rowid, size in self._db.execute("SELECT id, size FROM image_hashes ORDER BY id"):
+                doomed.append((rowid,))
+                excess -= size
+                if excess <= 0:
+                    break
+            self._db.executemany("DELETE FROM image_hashes WHERE id = ?", doomed)
+            count -= len(doomed)
+        self._live = count
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Build the index from the shared settings
+def create_perceptual_index():
+    return PerceptualIndex(
+        config.data_path("perceptual_index.sqlite3"),
+        similarity=config.PHASH_SIMILARITY,
+        detail_similarity=config.PHASH_DETAIL_SIMILARITY,
+        ttl_seconds=config.CACHE_TTL_SECONDS,
+        max_bytes=config.CACHE_MAX_BYTES,
+    )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+# Get the process-wide near-duplicate index, loading it on first use
+def get_perceptual_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = create_perceptual_index()
+    return _index
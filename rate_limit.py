@@ -0,0 +1,61 @@
+import threading
+import time
+
+import config
+
+# Token-bucket limiter matching the Gemini API quota. Every model call takes one
+# token; tokens refill continuously at `rate` per second up to `capacity`, so
+# short bursts are allowed but the long-run call rate never exceeds the quota.
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # Take a token without waiting; returns False if none are available
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    # Take a token, waiting up to `timeout` seconds (forever if None); returns False on timeout
+    def acquire(self, tokens=1, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+# Get the process-wide limiter for model calls
+def get_model_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = TokenBucket(config.MODEL_RATE_PER_MINUTE / 60.0, config.MODEL_BURST)
+    return _limiter
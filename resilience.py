@@ -0,0 +1,236 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import config
+from metrics import registry
+from rate_limit import get_model_rate_limiter
+
+# Tail-latency protection for model calls. Each call gets a per-mode deadline;
+# if the first attempt hasn't answered by the recent p95 for that mode a second,
+# hedged attempt is fired and whichever answers first wins. A circuit breaker
+# trips on bursts of errors and timeouts, so while the upstream is unhealthy
+# callers fail fast (and fall back to cached or rule-based answers) instead of
+# queueing behind hung calls. A hedge is an extra model call, so it only fires
+# when the rate limiter has a token to spare.
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept per mode for the hedge delay
+LATENCY_WINDOW = 200
+# Samples needed before the observed percentile is trusted; until then the
+# hedge fires at half the deadline
+MIN_LATENCY_SAMPLES = 20
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+class ModelTimeout(ModelUnavailable, TimeoutError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, window, cooldown, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.cooldown = cooldown
+        self._clock = clock
+        self._failures = deque()
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._clock() - self._opened_at >= self.cooldown else "open"
+
+    # Whether a call may go upstream; after the cooldown one probe call is let through
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Model circuit breaker closed")
+            self._opened_at = None
+            self._probing = False
+            self._failures.clear()
+
+    def record_failure(self):
+        with self._lock:
+            now = self._clock()
+            if self._opened_at is not None:
+                # A failed probe keeps the breaker open for another cooldown
+                if self._probing:
+                    self._opened_at = now
+                    self._probing = False
+                return
+            self._failures.append(now)
+            while self._failures and now - self._failures[0] > self.window:
+                self._failures.popleft()
+            if len(self._failures) >= self.failure_threshold:
+                self._opened_at = now
+                self._failures.clear()
+                registry.increment("nurtureai_breaker_trips_total", {})
+                logger.warning("Model circuit breaker opened after %d failures", self.failure_threshold)
+
+
+class LatencyTracker:
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    # The given percentile of recent latencies, or None with too few samples
+    def percentile(self, pct):
+        with self._lock:
+            if len(self._samples) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+class ResilientCaller:
+    def __init__(self, breaker, deadlines, default_deadline, hedge=True, hedge_percentile=95.0,
+                 hedge_min_delay=1.0, max_workers=32, limiter=None):
+        self.breaker = breaker
+        self.limiter = limiter
+        self.deadlines = deadlines
+        self.default_deadline = default_deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self._latency = {}
+        self._latency_lock = threading.Lock()
+        # Attempts run on their own threads so a hung call can be abandoned at the deadline
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-call")
+
+    def deadline_for(self, mode):
+        return self.deadlines.get(mode, self.default_deadline)
+
+    def _tracker(self, mode):
+        with self._latency_lock:
+            tracker = self._latency.get(mode)
+            if tracker is None:
+                tracker = self._latency[mode] = LatencyTracker()
+            return tracker
+
+    def hedge_delay(self, mode):
+        deadline = self.deadline_for(mode)
+        observed = self._tracker(mode).percentile(self.hedge_percentile)
+        delay = observed if observed is not None else deadline / 2
+        return min(max(delay, self.hedge_min_delay), deadline)
+
+    def _submit(self, mode, call, timeout):
+        # Copy the context so token counts land on the caller's request trace
+        context = contextvars.copy_context()
+        started = time.perf_counter()
+
+        def attempt():
+            result = context.run(call, timeout)
+            self._tracker(mode).record(time.perf_counter() - started)
+            return result
+
+        return self._executor.submit(attempt)
+
+    # Run call(timeout) within the mode's deadline, hedging once if it is slow.
+    # Raises ModelUnavailable while the breaker is open and ModelTimeout at the deadline.
+    def call(self, mode, call):
+        if not self.breaker.allow():
+            registry.increment("nurtureai_model_rejected_total", {"mode": mode})
+            raise ModelUnavailable("The analysis service is busy right now. Please try again in a minute.")
+
+        deadline = self.deadline_for(mode)
+        expires = time.monotonic() + deadline
+        pending = {self._submit(mode, call, deadline)}
+        hedge_at = time.monotonic() + self.hedge_delay(mode) if self.hedge else None
+        error = None
+        while pending:
+            now = time.monotonic()
+            if now >= expires:
+                break
+            wake = min(expires, hedge_at) if hedge_at is not None else expires
+            done, pending = wait(pending, timeout=wake - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.breaker.record_success()
+                    return future.result()
+                error = future.exception()
+            if hedge_at is not None and (time.monotonic() >= hedge_at or not pending):
+                # Fire the backup attempt when the first is slow (or has already failed)
+                hedge_at = None
+                if self.limiter is not None and not self.limiter.try_acquire():
+                    registry.increment("nurtureai_model_hedges_skipped_total", {"mode": mode})
+                    continue
+                registry.increment("nurtureai_model_hedges_total", {"mode": mode})
+                pending.add(self._submit(mode, call, max(0.1, expires - time.monotonic())))
+
+        self.breaker.record_failure()
+        if pending:
+            registry.increment("nurtureai_model_timeouts_total", {"mode": mode})
+            raise ModelTimeout(f"The analysis took longer than {deadline:.0f}s. Please try again.")
+        raise error
+
+    # Stream with the breaker and a deadline on the first chunk; later chunks are
+    # bounded by the client's own request timeout
+    def stream(self, mode, open_stream):
+        if not self.breaker.allow():
+            registry.increment("nurtureai_model_rejected_total", {"mode": mode})
+            raise ModelUnavailable("The analysis service is busy right now. Please try again in a minute.")
+
+        deadline = self.deadline_for(mode)
+        chunks = open_stream(deadline)
+        first = self._executor.submit(contextvars.copy_context().run, next, chunks, None)
+        done, _ = wait([first], timeout=deadline)
+        if not done:
+            self.breaker.record_failure()
+            registry.increment("nurtureai_model_timeouts_total", {"mode": mode})
+            raise ModelTimeout(f"The analysis took longer than {deadline:.0f}s. Please try again.")
+        try:
+            chunk = first.result()
+            while chunk is not None:
+                yield chunk
+                chunk = next(chunks, None)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+
+_caller = None
+_caller_lock = threading.Lock()
+
+# Get the shared caller, creating it on first use
+def get_resilient_caller():
+    global _caller
+    if _caller is None:
+        with _caller_lock:
+            if _caller is None:
+                _caller = ResilientCaller(
+                    breaker=CircuitBreaker(config.BREAKER_FAILURES, config.BREAKER_WINDOW, config.BREAKER_COOLDOWN),
+                    deadlines=config.MODEL_DEADLINES,
+                    default_deadline=config.MODEL_TIMEOUT_SECONDS,
+                    hedge=config.HEDGE_ENABLED,
+                    hedge_percentile=config.HEDGE_PERCENTILE,
+                    hedge_min_delay=config.HEDGE_MIN_DELAY,
+                    max_workers=config.MODEL_MAX_CONCURRENCY * 2,
+                    limiter=get_model_rate_limiter(),
+                )
+    return _caller
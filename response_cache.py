@@ -0,0 +1,136 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+# Two-tier cache for model responses: an in-process LRU in front of a SQLite file
+# with TTL and size-based eviction. Keys are content hashes, so the same photo,
+# prompt and question map to the same entry across sessions and restarts.
+
+
+# Normalize the user's question so trivial differences don't miss the cache
+def normalize_question(user_input):
+    return " ".join((user_input or "").lower().split())
+
+# Build the cache key from the image bytes, the selected prompt and the question
+def make_cache_key(image_bytes, input_prompt, user_input):
+    digest = hashlib.sha256()
+    for part in (image_bytes, input_prompt.encode("utf-8"), normalize_question(user_input).encode("utf-8")):
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path, memory_items=256, ttl_seconds=7 * 24 * 3600, max_bytes=64 * 1024 * 1024):
+        self.memory_items = memory_items
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    # Look up a cached response, promoting disk hits into memory
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created = row
+            if now - created > self.ttl_seconds:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._remember(key, value, created)
+            self.hits += 1
+            return value
+
+    # Store a response in both tiers
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._remember(key, value, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(now)
+
+    # Drop expired rows and trim the disk tier to its byte budget (least recently used first)
+    def _evict(self, now):
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_items": len(self._memory)}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# Build the cache from the shared settings
+def create_response_cache():
+    return ResponseCache(
+        config.data_path("response_cache.sqlite3"),
+        memory_items=config.CACHE_MEMORY_ITEMS,
+        ttl_seconds=config.CACHE_TTL_SECONDS,
+        max_bytes=config.CACHE_MAX_BYTES,
+    )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Get the process-wide response cache, creating it on first use
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_response_cache()
+    return _cache
@@ -0,0 +1,99 @@
+import threading
+
+from metrics import registry
+
+# Process-wide single-flight for model calls. After a broadcast many sessions
+# ask about the same product at the same moment; the first request for a key
+# makes the upstream call and every identical request that arrives while it is
+# in flight waits for that call and gets the same result (or the same error).
+#
+# A waiter that gives up (timeout) leaves without disturbing the call or the
+# other waiters. If the leading request is cancelled rather than failing (a
+# BaseException such as a Streamlit rerun), the waiters retry and one of them
+# takes over as the new leader.
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name="model"):
+        self.name = name
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "shared": 0, "abandoned": 0, "timeouts": 0}
+
+    # Run fn() once for all concurrent calls with the same key.
+    # Returns (result, shared) where shared is True when another call's result was reused.
+    def do(self, key, fn, timeout=None):
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self._stats["calls"] += 1
+                else:
+                    flight.waiters += 1
+            if leader:
+                return self._lead(key, flight, fn), False
+
+            try:
+                finished = flight.done.wait(timeout)
+            finally:
+                with self._lock:
+                    flight.waiters -= 1
+            if not finished:
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise TimeoutError(f"Timed out after {timeout:g}s waiting for an identical request")
+            if flight.abandoned:
+                continue
+            if flight.error is not None:
+                raise flight.error
+            with self._lock:
+                self._stats["shared"] += 1
+            registry.increment("nurtureai_singleflight_saved_total", {"name": self.name})
+            return flight.result, True
+
+    def _lead(self, key, flight, fn):
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        except BaseException:
+            flight.abandoned = True
+            with self._lock:
+                self._stats["abandoned"] += 1
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    # Upstream calls made, calls saved by sharing, abandoned leaders and waiter timeouts
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._flights)}
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+# Get the shared single-flight group for model calls
+def get_single_flight():
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
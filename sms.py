@@ -0,0 +1,161 @@
+import math
+import re
+import unicodedata
+from collections import namedtuple
+
+import config
+
+# SMS rendering for analysis results. The web answer is emoji-heavy (✅, ❌, ⚠️)
+# and a single non-GSM character switches a whole SMS to UCS-2, which cuts a
+# segment from 160 to 70 characters. This turns a safe_response into compact
+# GSM-7 text: markers become words, markdown and typographic characters are
+# simplified, the disclaimer is shortened, and the text is split into
+# concatenated segments with the segment count and cost reported.
+
+SHORT_DISCLAIMER = "Not medical advice. Ask your health worker."
+
+# GSM 03.38 basic character set (1 septet each)
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Extension table characters take an escape plus the character (2 septets)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+SINGLE_SEGMENT = {"GSM-7": 160, "UCS-2": 70}
+MULTI_SEGMENT = {"GSM-7": 153, "UCS-2": 67}
+
+SmsMessage = namedtuple("SmsMessage", "text encoding segments segment_count characters cost")
+
+_MARKERS = (
+    ("❌ Not Safe", "NOT SAFE"),
+    ("✅ Safe", "SAFE"),
+    ("❌", "NOT SAFE:"),
+    ("✅", "SAFE:"),
+    ("⚠️", ""),
+    ("⚠", ""),
+    ("ℹ️", ""),
+    ("⚡", ""),
+)
+_REPLACEMENTS = {
+    "‘": "'", "’": "'", "‚": "'", "“": '"', "”": '"', "„": '"',
+    "–": "-", "—": "-", "‑": "-", "•": "-", "·": "-", "…": "...",
+    "×": "x", "≈": "~", "°": " deg", "µ": "u", " ": " ", "\t": " ",
+    # Hausa hooked letters have no decomposition
+    "ƙ": "k", "Ƙ": "K", "ɗ": "d", "Ɗ": "D", "ɓ": "b", "Ɓ": "B", "ƴ": "y", "Ƴ": "Y",
+}
+_LINK = re.compile(r"\[([^\]]+)\]\([^)]+\)")
+_HEADING = re.compile(r"^\s*#+\s*", re.MULTILINE)
+_BULLET = re.compile(r"^\s*[*+]\s+", re.MULTILINE)
+_EMPHASIS = re.compile(r"(\*\*|__|\*|`)")
+_SPACES = re.compile(r"[ ]{2,}")
+_BLANK_LINES = re.compile(r"\n{2,}")
+
+
+def septets(char):
+    if char in GSM7_BASIC:
+        return 1
+    if char in GSM7_EXTENDED:
+        return 2
+    return None
+
+def is_gsm7(text):
+    return all(septets(char) is not None for char in text)
+
+# Replace a character that GSM-7 can't encode with the closest one that it can
+def _to_gsm_char(char):
+    if septets(char) is not None:
+        return char
+    if char in _REPLACEMENTS:
+        return _REPLACEMENTS[char]
+    # Drop accents that GSM-7 lacks (Yoruba ẹ -> e, Igbo ụ -> u)
+    decomposed = "".join(c for c in unicodedata.normalize("NFKD", char) if not unicodedata.combining(c))
+    if decomposed and all(septets(c) is not None for c in decomposed):
+        return decomposed
+    # Emoji, symbols and other scripts are dropped
+    return ""
+
+# Compact GSM-7 text for a response: no disclaimer, markdown or emoji
+def compact_text(response):
+    text = (response or "").split("⚠️", 1)[0]
+    for marker, word in _MARKERS:
+        text = text.replace(marker, word)
+    text = _LINK.sub(r"\1", text)
+    text = _HEADING.sub("", text)
+    text = _BULLET.sub("- ", text)
+    text = _EMPHASIS.sub("", text)
+    text = "".join(_to_gsm_char(char) for char in text)
+    lines = [_SPACES.sub(" ", line).strip() for line in text.splitlines()]
+    return _BLANK_LINES.sub("\n", "\n".join(lines)).strip()
+
+def encoding_for(text):
+    return "GSM-7" if is_gsm7(text) else "UCS-2"
+
+def _length(text, encoding):
+    if encoding == "GSM-7":
+        return sum(septets(char) for char in text)
+    # UCS-2 counts UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+# Split text into concatenated-SMS segments, never inside a GSM-7 escape sequence
+def segment(text, encoding=None):
+    encoding = encoding or encoding_for(text)
+    if _length(text, encoding) <= SINGLE_SEGMENT[encoding]:
+        return [text] if text else []
+    limit = MULTI_SEGMENT[encoding]
+    segments, current, size = [], [], 0
+    for char in text:
+        width = _length(char, encoding)
+        if size + width > limit:
+            segments.append("".join(current))
+            current, size = [], 0
+        current.append(char)
+        size += width
+    if current:
+        segments.append("".join(current))
+    return segments
+
+# Shorten text to fit in max_segments, cutting at a sentence or word boundary
+def _fit(text, suffix, max_segments, encoding):
+    budget = (SINGLE_SEGMENT[encoding] if max_segments == 1 else MULTI_SEGMENT[encoding] * max_segments)
+    budget -= _length(suffix, encoding)
+    if _length(text, encoding) <= budget:
+        return text
+    room, end = budget - 3, 0
+    for char in text:
+        room -= _length(char, encoding)
+        if room < 0:
+            break
+        end += 1
+    cut = text[:end]
+    sentence_end = max(cut.rfind(". "), cut.rfind(".\n"))
+    if sentence_end > len(cut) // 2:
+        return cut[:sentence_end + 1]
+    return cut.rsplit(" ", 1)[0].rstrip(",;:-") + "..."
+
+# Render a safe_response as an SMS: compact GSM-7 text ending in the short disclaimer
+# (or a translated one), trimmed to max_segments, with its segments, segment count and cost
+def render_sms(response, max_segments=None, segment_cost=None, disclaimer=None):
+    max_segments = max_segments or config.SMS_MAX_SEGMENTS
+    segment_cost = config.SMS_SEGMENT_COST if segment_cost is None else segment_cost
+    body = compact_text(response)
+    suffix = "\n" + compact_text(disclaimer or SHORT_DISCLAIMER)
+    encoding = encoding_for(body + suffix)
+    text = _fit(body, suffix, max_segments, encoding) + suffix
+    segments = segment(text, encoding)
+    return SmsMessage(
+        text=text,
+        encoding=encoding,
+        segments=segments,
+        segment_count=len(segments),
+        characters=_length(text, encoding),
+        cost=round(len(segments) * segment_cost, 4),
+    )
+
+# Segment count for text sent as-is, e.g. to compare with the raw response
+def segment_count(text):
+    encoding = encoding_for(text)
+    length = _length(text, encoding)
+    if length <= SINGLE_SEGMENT[encoding]:
+        return 1 if length else 0
+    return math.ceil(length / MULTI_SEGMENT[encoding])
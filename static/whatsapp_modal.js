@@ -0,0 +1,17 @@
+function showWhatsAppModal() {
+    document.getElementById('whatsapp-modal').style.display = 'flex';
+}
+
+function hideWhatsAppModal() {
+    document.getElementById('whatsapp-modal').style.display = 'none';
+}
+
+function openWhatsAppChat() {
+    window.open('__WHATSAPP_CHAT_LINK__', '_blank');
+    hideWhatsAppModal();
+}
+
+function shareResultsOnWhatsApp() {
+    window.open('__WHATSAPP_SHARE_LINK__', '_blank');
+    hideWhatsAppModal();
+}
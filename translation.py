@@ -0,0 +1,330 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+import config
+from gemini_client import get_gemini_client
+from metrics import registry, stage
+from model_scheduler import get_model_scheduler
+from prompts import translation_prompt
+from resilience import LatencyTracker, get_resilient_caller
+
+# Localized results through a persistent translation memory. Responses are
+# split into sentences; a sentence already in the memory for the language is
+# served locally, either exactly (same normalized text) or fuzzily (a near
+# duplicate found through a MinHash/LSH index over character trigrams). Only
+# the sentences never seen before go to the model, all in one batched call,
+# and their translations are stored for next time. Disclaimers, verdict lines
+# and the common warnings recur in nearly every answer, so after warm-up most
+# of a translated answer costs no model call at all.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "translation_memory.json")
+
+ENGLISH = "English"
+LANGUAGES = {
+    "en": "English",
+    "english": "English",
+    "ha": "Hausa",
+    "hausa": "Hausa",
+    "yo": "Yoruba",
+    "yoruba": "Yoruba",
+    "ig": "Igbo",
+    "igbo": "Igbo",
+    "pcm": "Nigerian Pidgin",
+    "pidgin": "Nigerian Pidgin",
+    "nigerian pidgin": "Nigerian Pidgin",
+}
+
+# MinHash signature size, split into LSH bands of BAND_ROWS values each. With
+# 8 bands of 8 a pair at Jaccard 0.9 shares a band 99% of the time and a pair
+# at 0.5 about 3% of the time; candidates are then checked exactly.
+PERMUTATIONS = 64
+BAND_ROWS = 8
+_PRIME = (1 << 31) - 1
+# Shorter sentences only match exactly ("Safe." must never match "Unsafe.")
+MIN_FUZZY_CHARS = 20
+
+# Words with little meaning of their own. A fuzzy match may differ only in these
+# (and punctuation): every other word, such as an ingredient or drug name, a
+# verdict ("harmful", "helpful") or a negation, must be exactly the same.
+_FUNCTION_WORDS = frozenset(
+    "a an the this that these those it its is are was were be been being am of to in on at by as so very also "
+    "just there here which who please your you".split()
+)
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+_WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+_SPACES = re.compile(r"\s+")
+
+# Bullets, numbering, headings and the ✅/❌/⚠️ markers stay outside the translated text
+_PREFIX = re.compile(r"^\s*(?:(?:[-*+•]|\d+[.)]|#+)\s+)?(?:[✅❌⚠ℹ⚡]️?\s*)*")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])(\s+)(?=[A-Z0-9\"'(*])")
+_LETTER = re.compile(r"[^\W\d_]")
+_NUMBERED_LINE = re.compile(r"^\s*(\d+)[.)]\s*(.+?)\s*$", re.MULTILINE)
+
+
+def normalize_language(value):
+    return LANGUAGES.get((value or "").strip().lower(), ENGLISH)
+
+# Key for exact matches: case, width and spacing differences are ignored
+def normalize_sentence(text):
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", text).casefold()).strip()
+
+def _shingles(key):
+    padded = f" {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Numbers and content words of a sentence in order, which a fuzzy match must share
+def _meaning_markers(key):
+    return _NUMBER.findall(key), [word for word in _WORD.findall(key) if word not in _FUNCTION_WORDS]
+
+# Split text into pieces: (text, True) for a sentence to translate, (text, False)
+# for prefixes, separators and anything without letters, which is kept as it is
+def split_sentences(text):
+    pieces = []
+    for number, line in enumerate(text.split("\n")):
+        if number:
+            pieces.append(("\n", False))
+        prefix = _PREFIX.match(line).group(0)
+        if prefix:
+            pieces.append((prefix, False))
+        body = line[len(prefix):]
+        stripped = body.rstrip()
+        for index, part in enumerate(_SENTENCE_BREAK.split(stripped)):
+            pieces.append((part, index % 2 == 0 and bool(_LETTER.search(part))))
+        if len(stripped) < len(body):
+            pieces.append((body[len(stripped):], False))
+    return pieces
+
+
+class MinHasher:
+    def __init__(self, permutations=PERMUTATIONS, seed=1):
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, _PRIME, size=permutations).astype(np.uint64)
+        self._b = generator.randint(0, _PRIME, size=permutations).astype(np.uint64)
+
+    # One minimum per hash function over the shingles' 31-bit hashes
+    def signature(self, shingles):
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) % _PRIME for s in shingles), dtype=np.uint64, count=len(shingles)
+        )
+        return ((np.outer(self._a, hashes) + self._b[:, None]) % _PRIME).min(axis=1)
+
+
+class TranslationMemory:
+    def __init__(self, path, seed_path=None, fuzzy_threshold=0.9):
+        self.fuzzy_threshold = fuzzy_threshold
+        self._hasher = MinHasher()
+        self._bands = PERMUTATIONS // BAND_ROWS
+        # language -> {normalized source: translation}
+        self._entries = {}
+        # language -> one {band bytes: [normalized sources]} per band
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " language TEXT NOT NULL,"
+            " source_key TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " target TEXT NOT NULL,"
+            " origin TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " PRIMARY KEY (language, source_key))"
+        )
+        if seed_path:
+            self._seed(seed_path)
+        for language, key, target in self._db.execute("SELECT language, source_key, target FROM translations"):
+            self._index(language, key, target)
+
+    # Load reviewed translations; entries already in the memory are kept
+    def _seed(self, path):
+        with open(path, encoding="utf-8") as f:
+            seed = json.load(f)
+        now = time.time()
+        rows = [
+            (language, normalize_sentence(entry["source"]), entry["source"], entry["target"], "seed", now)
+            for language, entries in seed["translations"].items()
+            for entry in entries
+        ]
+        self._db.executemany("INSERT OR IGNORE INTO translations VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def _band_keys(self, key):
+        signature = self._hasher.signature(_shingles(key))
+        return [signature[band * BAND_ROWS:(band + 1) * BAND_ROWS].tobytes() for band in range(self._bands)]
+
+    def _index(self, language, key, target):
+        entries = self._entries.setdefault(language, {})
+        known = key in entries
+        entries[key] = target
+        if known or len(key) < MIN_FUZZY_CHARS:
+            return
+        buckets = self._buckets.setdefault(language, [{} for _ in range(self._bands)])
+        for band, band_key in enumerate(self._band_keys(key)):
+            buckets[band].setdefault(band_key, []).append(key)
+
+    # (translation, "exact" or "fuzzy"), or (None, None) when the sentence is unknown
+    def lookup(self, language, sentence):
+        key = normalize_sentence(sentence)
+        with self._lock:
+            target = self._entries.get(language, {}).get(key)
+            if target is not None:
+                return target, "exact"
+            buckets = self._buckets.get(language)
+            if buckets is None or len(key) < MIN_FUZZY_CHARS:
+                return None, None
+            candidates = set()
+            for band, band_key in enumerate(self._band_keys(key)):
+                candidates.update(buckets[band].get(band_key, ()))
+            best, best_score = None, self.fuzzy_threshold
+            shingles, markers = _shingles(key), _meaning_markers(key)
+            for candidate in candidates:
+                other = _shingles(candidate)
+                score = len(shingles & other) / len(shingles | other)
+                if score >= best_score and _meaning_markers(candidate) == markers:
+                    best, best_score = candidate, score
+            if best is None:
+                return None, None
+            return self._entries[language][best], "fuzzy"
+
+    def add(self, language, source, target, origin="model"):
+        key = normalize_sentence(source)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)",
+                (language, key, source, target, origin, time.time()),
+            )
+            self._index(language, key, target)
+
+    # Stored sentences per language
+    def sizes(self):
+        with self._lock:
+            return {language: len(entries) for language, entries in self._entries.items()}
+
+
+class Translator:
+    def __init__(self, memory, enabled=True):
+        self.memory = memory
+        self.enabled = enabled
+        self._counts = {}
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    # Text in the given language; sentences the model could not translate (within
+    # `timeout` seconds, if given) stay in English
+    def translate(self, text, language, user_key=None, timeout=None):
+        language = normalize_language(language)
+        if not self.enabled or language == ENGLISH or not text:
+            return text
+        started = time.perf_counter()
+        with stage("translate"):
+            pieces = split_sentences(text)
+            translations, counts = {}, {"exact": 0, "fuzzy": 0, "model": 0, "untranslated": 0}
+            pending = []
+            for piece, translatable in pieces:
+                if not translatable or piece in translations:
+                    continue
+                target, match = self.memory.lookup(language, piece)
+                if target is None:
+                    translations[piece] = None
+                    pending.append(piece)
+                else:
+                    translations[piece] = target
+                    counts[match] += 1
+
+            if pending:
+                for sentence, target in zip(pending, self._translate_batch(pending, language, user_key, timeout)):
+                    if target is None:
+                        counts["untranslated"] += 1
+                        continue
+                    translations[sentence] = target
+                    counts["model"] += 1
+                    self.memory.add(language, sentence, target)
+
+            result = "".join((translations.get(piece) or piece) if translatable else piece for piece, translatable in pieces)
+        self._record(language, counts, bool(pending), time.perf_counter() - started)
+        return result
+
+    # Translations for sentences (None where the model gave none) from one model call
+    def _translate_batch(self, sentences, language, user_key, timeout=None):
+        numbered = "\n".join(f"{number}. {sentence}" for number, sentence in enumerate(sentences, 1))
+        contents = [translation_prompt.format(language=language), numbered]
+        caller = get_resilient_caller()
+        client = get_gemini_client()
+        try:
+            ticket = get_model_scheduler().submit(
+                user_key or object(),
+                lambda emit: caller.call("Translation", lambda timeout: client.generate(contents, timeout=timeout)),
+            )
+            reply = ticket.result(timeout=timeout)
+        except Exception as e:
+            registry.increment("nurtureai_translation_failures_total", {"language": language})
+            logger.warning("Leaving %d sentences untranslated into %s: %s", len(sentences), language, e)
+            return [None] * len(sentences)
+        lines = {int(number): line for number, line in _NUMBERED_LINE.findall(reply)}
+        return [lines.get(number) for number in range(1, len(sentences) + 1)]
+
+    def _record(self, language, counts, model_call, seconds):
+        for match, count in counts.items():
+            if count:
+                registry.increment("nurtureai_translation_segments_total", {"language": language, "match": match}, count)
+        registry.observe("nurtureai_translation_seconds", {"language": language}, seconds)
+        with self._lock:
+            totals = self._counts.setdefault(
+                language, {"requests": 0, "model_calls": 0, "exact": 0, "fuzzy": 0, "model": 0, "untranslated": 0, "seconds": 0.0}
+            )
+            totals["requests"] += 1
+            totals["model_calls"] += int(model_call)
+            totals["seconds"] += seconds
+            for match, count in counts.items():
+                totals[match] += count
+            tracker = self._latency.get(language)
+            if tracker is None:
+                tracker = self._latency[language] = LatencyTracker()
+        tracker.record(seconds)
+
+    # Per language: sentence counts by source, the share served from memory and latency
+    def stats(self):
+        sizes = self.memory.sizes()
+        with self._lock:
+            counts = {language: dict(totals) for language, totals in self._counts.items()}
+        report = {}
+        for language, totals in counts.items():
+            sentences = totals["exact"] + totals["fuzzy"] + totals["model"] + totals["untranslated"]
+            p95 = self._latency[language].percentile(95)
+            report[language] = {
+                **{k: v for k, v in totals.items() if k != "seconds"},
+                "memory_size": sizes.get(language, 0),
+                "hit_rate": round((totals["exact"] + totals["fuzzy"]) / sentences, 3) if sentences else None,
+                "mean_ms": round(1000 * totals["seconds"] / totals["requests"], 1),
+                "p95_ms": round(1000 * p95, 1) if p95 is not None else None,
+            }
+        return report
+
+
+_translator = None
+_translator_lock = threading.Lock()
+
+# Get the shared translator, opening the translation memory on first use
+def get_translator():
+    global _translator
+    if _translator is None:
+        with _translator_lock:
+            if _translator is None:
+                memory = TranslationMemory(
+                    config.data_path("translation_memory.sqlite3"),
+                    seed_path=config.TRANSLATION_SEED_PATH or DEFAULT_SEED_PATH,
+                    fuzzy_threshold=config.TRANSLATION_FUZZY_THRESHOLD,
+                )
+                _translator = Translator(memory, enabled=config.TRANSLATION_ENABLED)
+    return _translator
@@ -0,0 +1,302 @@
+import io
+import logging
+import mmap
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+import config
+from metrics import registry
+
+# Memory accounting for the web app's upload buffers. Each session holds its
+# prepared uploads (the normalized images that are both previewed and sent to the
+# model; one for a single upload, one per file of a batch) here instead of in its
+# session state. The accountant tracks what every
+# session and the whole process keep in memory: a payload that is too large, or
+# that would push its session or the process over budget, is written to an
+# unlinked temporary file and memory-mapped, so its pages can be dropped by the
+# OS under pressure instead of counting against the container's RSS. A spilled
+# payload is read through the mapping and is copied to bytes only for the call
+# that needs bytes (the Gemini SDK, OCR); the preview shows a small rendition of
+# it. Sessions that have been idle for a while lose their buffers (they are
+# prepared again from the upload if the session comes back). Each session's
+# peak is recorded as it rises and the budget's totals are exported as gauges,
+# so capacity can be planned from real traffic.
+
+logger = logging.getLogger(__name__)
+
+# A session's prepared upload. `prepared.data` is bytes, or a read-only mmap when spilled.
+HeldUpload = namedtuple("HeldUpload", "upload_id prepared image_hash spilled upload_bytes")
+
+# Buckets (bytes) for the per-session peak histogram
+PEAK_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(-2, 9))
+# Longest edge (px) of the preview shown for a spilled payload
+PREVIEW_MAX_EDGE = 640
+
+
+# Bytes for a buffer that may be memory-mapped, for APIs that only take bytes.
+# Call it right at the call so the copy of a spilled payload is short-lived.
+# Anything else (bytes, decoded numpy images) is returned unchanged.
+def payload_bytes(data):
+    return bytes(data) if isinstance(data, (mmap.mmap, memoryview)) else data
+
+
+# Read-only file over a buffer, with its own position and without copying it
+class _BufferReader(io.RawIOBase):
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        # Release the view so the mapping can be closed
+        self._view.release()
+        super().close()
+
+
+# A file object for a payload (for PIL and the like), without copying a spilled one
+def payload_file(data):
+    return io.BytesIO(data) if isinstance(data, bytes) else io.BufferedReader(_BufferReader(data))
+
+
+# What to show as a payload's preview. Streamlit keeps the image it is given for
+# as long as the preview is on screen: bytes are kept by reference, but a spilled
+# payload would be copied, so it gets a small JPEG rendition instead.
+def preview_image(data, max_edge=PREVIEW_MAX_EDGE):
+    if isinstance(data, bytes):
+        return data
+    with payload_file(data) as f, Image.open(f) as image:
+        image.draft("RGB", (max_edge, max_edge))
+        image.thumbnail((max_edge, max_edge))
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class _Session:
+    __slots__ = ("held", "peak_bytes", "last_used")
+
+    def __init__(self):
+        # upload id -> HeldUpload: one for a single upload, or one per file of a batch
+        self.held = {}
+        self.peak_bytes = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def memory_bytes(self):
+        return sum(0 if h.spilled else len(h.prepared.data) for h in self.held.values())
+
+    # Memory the session uses: its prepared images plus the raw uploads Streamlit keeps
+    @property
+    def total_bytes(self):
+        return self.memory_bytes + sum(h.upload_bytes for h in self.held.values())
+
+
+class UploadBudget:
+    def __init__(self, session_bytes, total_bytes, spill_bytes, idle_seconds=900.0, spill_dir=None):
+        self.session_bytes = session_bytes
+        self.total_bytes = total_bytes
+        self.spill_bytes = spill_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = spill_dir
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self.peak_memory_bytes = 0
+        self.peak_session_bytes = 0
+        self.spills = 0
+        self.evictions = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    # Write a payload to an unlinked temporary file and map it read-only. The
+    # file's space is freed once the mapping is garbage-collected.
+    def _spill(self, data):
+        with tempfile.TemporaryFile(dir=self.spill_dir) as f:
+            f.write(data)
+            f.flush()
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Drop one held upload, or all of a session's when `upload_id` is None,
+    # keeping the session's peak (caller holds the lock)
+    def _free(self, state, upload_id=None):
+        for key in [upload_id] if upload_id is not None else list(state.held):
+            held = state.held.pop(key, None)
+            if held is None:
+                continue
+            if held.spilled:
+                self.spilled_bytes -= len(held.prepared.data)
+            else:
+                self.memory_bytes -= len(held.prepared.data)
+
+    # Forget a session (caller holds the lock)
+    def _finish(self, session):
+        state = self._sessions.pop(session, None)
+        if state is not None:
+            self._free(state)
+
+    # Keep a prepared upload for a session. With `replace` (a single upload) it
+    # replaces everything the session held; without it (a file of a batch) it is
+    # kept alongside the others, and the whole batch counts against the session's
+    # budget. `upload_bytes` is the size of the raw upload, which Streamlit keeps
+    # in memory for as long as the file stays in the uploader.
+    def hold(self, session, upload_id, prepared, image_hash, upload_bytes=0, replace=True):
+        size = len(prepared.data)
+        with self._lock:
+            state = self._sessions.get(session)
+            held = state.held if state is not None else {}
+            # What the session keeps next to this upload, and what the upload frees
+            kept = [h for key, h in held.items() if not replace and key != upload_id]
+            kept_memory = sum(0 if h.spilled else len(h.prepared.data) for h in kept)
+            kept_session = kept_memory + sum(h.upload_bytes for h in kept)
+            freed_memory = (state.memory_bytes if state is not None else 0) - kept_memory
+            spill = size > 0 and (
+                size > self.spill_bytes
+                or kept_session + upload_bytes + size > self.session_bytes
+                or self.memory_bytes - freed_memory + size > self.total_bytes
+            )
+        if spill:
+            prepared = prepared._replace(data=self._spill(prepared.data))
+        held = HeldUpload(upload_id, prepared, image_hash, spill, upload_bytes)
+
+        with self._lock:
+            state = self._sessions.setdefault(session, _Session())
+            self._free(state, None if replace else upload_id)
+            # While preparing, the decoded pixels (about 3 bytes each) sat next to
+            # both buffers and everything else the session holds
+            preparing = state.total_bytes + upload_bytes + prepared.width * prepared.height * 3 + size
+            state.held[upload_id] = held
+            state.last_used = time.monotonic()
+            new_peak = preparing if preparing > state.peak_bytes else None
+            state.peak_bytes = max(state.peak_bytes, preparing)
+            self.peak_session_bytes = max(self.peak_session_bytes, state.peak_bytes)
+            if spill:
+                self.spilled_bytes += size
+                self.spills += 1
+            else:
+                self.memory_bytes += size
+            self.peak_memory_bytes = max(self.peak_memory_bytes, self.memory_bytes)
+        if new_peak is not None:
+            registry.observe("nurtureai_upload_session_peak_bytes", {}, new_peak, buckets=PEAK_BUCKETS)
+        if spill:
+            registry.increment("nurtureai_upload_spills_total", {})
+            logger.info("Spilled a %d-byte upload to disk", size)
+        self._export()
+        return held
+
+    # The session's held upload `upload_id` (None once replaced, released or evicted)
+    def get(self, session, upload_id):
+        with self._lock:
+            state = self._sessions.get(session)
+            held = state.held.get(upload_id) if state is not None else None
+            if held is not None:
+                state.last_used = time.monotonic()
+            return held
+
+    # Free the session's held uploads other than `upload_ids` (files removed from a batch)
+    def retain(self, session, upload_ids):
+        with self._lock:
+            state = self._sessions.get(session)
+            if state is not None:
+                for upload_id in set(state.held) - set(upload_ids):
+                    self._free(state, upload_id)
+        self._export()
+
+    # Free a session's buffers now (its upload was removed); the session's peak is
+    # kept until it goes idle
+    def release(self, session):
+        with self._lock:
+            state = self._sessions.get(session)
+            if state is not None:
+                self._free(state)
+        self._export()
+
+    # Free the buffers of sessions idle for longer than `idle_seconds`; returns how many
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [session for session, state in self._sessions.items() if state.last_used < cutoff]
+            for session in idle:
+                self._finish(session)
+            self.evictions += len(idle)
+        if idle:
+            registry.increment("nurtureai_upload_evictions_total", {}, len(idle))
+            self._export()
+        return len(idle)
+
+    # Evict idle sessions every `interval` seconds
+    def start_sweeper(self, interval=60.0):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    logger.warning("Upload eviction failed: %s", e)
+
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=run, name="upload-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def stats(self):
+        with self._lock:
+            peaks = sorted(state.peak_bytes for state in self._sessions.values())
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": self.memory_bytes,
+                "spilled_bytes": self.spilled_bytes,
+                "peak_memory_bytes": self.peak_memory_bytes,
+                "peak_session_bytes": self.peak_session_bytes,
+                "p95_session_bytes": peaks[int(0.95 * (len(peaks) - 1))] if peaks else None,
+                "spills": self.spills,
+                "evictions": self.evictions,
+            }
+
+    # Publish the budget's current totals as gauges
+    def _export(self):
+        for name, value in self.stats().items():
+            if name not in ("spills", "evictions") and value is not None:
+                registry.set_gauge(f"nurtureai_upload_{name}", {}, value)
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+# Get the process-wide upload budget, starting its idle sweeper on first use
+def get_upload_budget():
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                _budget = UploadBudget(
+                    session_bytes=config.UPLOAD_SESSION_MAX_BYTES,
+                    total_bytes=config.UPLOAD_TOTAL_MAX_BYTES,
+                    spill_bytes=config.UPLOAD_SPILL_BYTES,
+                    idle_seconds=config.UPLOAD_IDLE_SECONDS,
+                    spill_dir=config.UPLOAD_SPILL_DIR,
+                )
+                _budget.start_sweeper(max(1.0, min(60.0, config.UPLOAD_IDLE_SECONDS / 2)))
+    return _budget
@@ -0,0 +1,325 @@
+import logging
+import os
+import sqlite3
+import queue
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+import config
+from embedding_cache import get_embedder
+from metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, one process per data directory
+    fcntl = None
+
+# Vector store of past verdicts. Every completed analysis with product text (the
+# label text and/or question) is embedded and stored with its mode, user type,
+# verdict and full response. Similar products asked about later either reuse a
+# stored answer directly (very close match) or get the closest verdicts added to
+# the prompt as grounding.
+#
+# Vectors live in a FAISS index file that is opened memory-mapped at startup, so
+# nothing is re-embedded or rebuilt. SQLite is the source of truth: rows past the
+# file's watermark (added by any process) are kept in a small in-memory delta
+# index, and a background merge folds them into a new file once the delta grows
+# past NURTUREAI_VERDICTS_MERGE_EVERY (or an eighth of the index). Writes are
+# queued to a couple of background workers, so a finished analysis never waits
+# for the embedding call.
+
+logger = logging.getLogger(__name__)
+
+# Rows read per step when merging
+MERGE_BATCH = 4096
+
+StoredVerdict = namedtuple("StoredVerdict", "id score mode user_type product_text verdict response")
+
+
+# Coarse verdict label for a response
+def verdict_label(text):
+    if "❌" in text:
+        return "unsafe"
+    if "✅" in text:
+        return "safe"
+    return "info"
+
+# Product text used for embedding: the label text plus the question. Without label text
+# the question alone doesn't identify the product, so nothing is stored or retrieved.
+def product_text_for(label_text, user_input):
+    if not label_text or not label_text.strip():
+        return ""
+    return "\n".join(part.strip() for part in (label_text, user_input) if part and part.strip())
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+class VerdictStore:
+    def __init__(self, index_path, db_path, embed, merge_every=64):
+        self.index_path = index_path
+        self.embed = embed
+        self.merge_every = merge_every
+        self._lock_path = index_path + ".lock"
+        self._lock = threading.Lock()
+        self._merger = None
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            " id INTEGER PRIMARY KEY,"
+            " mode TEXT NOT NULL,"
+            " user_type TEXT NOT NULL,"
+            " product_text TEXT NOT NULL,"
+            " verdict TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS verdicts_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._main = None
+        self._main_version = None
+        self._delta = None
+        self._delta_up_to = 0
+        self._dimension = None
+        with self._lock:
+            self._refresh()
+
+    # flock on the lock file, so one process at a time merges and swaps the index file
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open_main(self):
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            return faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Index types without mmap support are read into memory instead
+            return faiss.read_index(self.index_path)
+
+    def _watermark(self):
+        row = self._db.execute("SELECT value FROM verdicts_meta WHERE key = 'indexed_up_to'").fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _version(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    # Catch up with other processes (caller holds the lock): reopen the index file
+    # after a merge, and load rows added since into the delta. The watermark is
+    # read before the file, so a merge in between can only make rows show up in
+    # both (search keeps one), never in neither.
+    def _refresh(self):
+        version = self._version(self.index_path)
+        if version != self._main_version:
+            watermark = self._watermark()
+            self._main = self._open_main()
+            self._main_version = version
+            self._dimension = self._main.d if self._main is not None else self._dimension
+            self._delta, self._delta_up_to = None, watermark
+        for row_id, vector in self._db.execute(
+            "SELECT id, vector FROM verdicts WHERE id > ? ORDER BY id", (self._delta_up_to,)
+        ):
+            self._add_to_delta(row_id, np.frombuffer(vector, dtype="float32"))
+            self._delta_up_to = row_id
+
+    # Stored vectors are already normalized
+    def _add_to_delta(self, row_id, vector):
+        vector = vector.reshape(1, -1)
+        if self._delta is None:
+            self._dimension = self._dimension or vector.shape[1]
+            self._delta = faiss.IndexIDMap2(faiss.IndexFlatIP(self._dimension))
+        self._delta.add_with_ids(vector, np.array([row_id], dtype="int64"))
+
+    # Fold every row past the watermark into the index file. Runs under the file
+    # lock, so concurrent merges in other processes neither lose nor repeat rows;
+    # searches keep using the mapped index until the new file is swapped in.
+    def merge(self):
+        with self._file_lock():
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT id, vector FROM verdicts WHERE id > ? ORDER BY id", (self._watermark(),)
+                ).fetchall()
+            if not rows:
+                return False
+            merged = faiss.read_index(self.index_path) if os.path.exists(self.index_path) else None
+            for start in range(0, len(rows), MERGE_BATCH):
+                batch = rows[start:start + MERGE_BATCH]
+                vectors = np.stack([np.frombuffer(vector, dtype="float32") for _, vector in batch])
+                if merged is None:
+                    merged = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+                merged.add_with_ids(vectors, np.array([row_id for row_id, _ in batch], dtype="int64"))
+            tmp_path = self.index_path + ".tmp"
+            faiss.write_index(merged, tmp_path)
+            os.replace(tmp_path, self.index_path)
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO verdicts_meta (key, value) VALUES ('indexed_up_to', ?)", (int(rows[-1][0]),)
+                )
+                self._refresh()
+        return True
+
+    # Merge in the background once the delta is large enough (caller holds the lock).
+    # The delta may grow to an eighth of the index, so the rewrites add up to
+    # linear cost in the number of verdicts rather than quadratic.
+    def _maybe_merge(self):
+        pending = self._delta.ntotal if self._delta is not None else 0
+        indexed = self._main.ntotal if self._main is not None else 0
+        if pending < max(self.merge_every, indexed // 8):
+            return
+        if self._merger is not None and self._merger.is_alive():
+            return
+
+        def run():
+            try:
+                self.merge()
+            except Exception as e:
+                logger.warning("Verdict index merge failed: %s", e)
+
+        self._merger = threading.Thread(target=run, name="verdict-merge", daemon=True)
+        self._merger.start()
+
+    def __len__(self):
+        with self._lock:
+            return (self._main.ntotal if self._main is not None else 0) + (self._delta.ntotal if self._delta is not None else 0)
+
+    # Store a completed analysis
+    def add(self, mode, user_type, product_text, response):
+        vector = _normalize(self.embed(product_text, "retrieval_document"))[0]
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO verdicts (mode, user_type, product_text, verdict, response, vector, created)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (mode, user_type, product_text, verdict_label(response), response, vector.tobytes(), time.time()),
+            )
+            self._refresh()
+            self._maybe_merge()
+
+    # Top-k stored verdicts for similar products with the same mode and user type
+    def search(self, mode, user_type, product_text, k=3):
+        vector = _normalize(self.embed(product_text, "retrieval_query"))
+        with self._lock:
+            self._refresh()
+            candidates = {}
+            for index in (self._main, self._delta):
+                if index is None or index.ntotal == 0:
+                    continue
+                # Over-fetch because results from other modes are filtered out below
+                scores, ids = index.search(vector, min(index.ntotal, k * 8))
+                for score, row_id in zip(scores[0], ids[0]):
+                    if row_id >= 0:
+                        candidates[int(row_id)] = max(float(score), candidates.get(int(row_id), -1.0))
+            if not candidates:
+                return []
+            placeholders = ",".join("?" * len(candidates))
+            rows = self._db.execute(
+                f"SELECT id, mode, user_type, product_text, verdict, response FROM verdicts"
+                f" WHERE id IN ({placeholders}) AND mode = ? AND user_type = ?",
+                (*candidates, mode, user_type),
+            ).fetchall()
+        results = [StoredVerdict(row[0], candidates[row[0]], *row[1:]) for row in rows]
+        results.sort(key=lambda v: v.score, reverse=True)
+        return results[:k]
+
+    def close(self):
+        merger = self._merger
+        if merger is not None:
+            merger.join()
+        self.merge()
+        with self._lock:
+            self._db.close()
+
+
+# Build the grounding text added to the prompt from similar past verdicts
+def grounding_text(verdicts):
+    lines = ["Previous NurtureAI verdicts for similar products (use for consistency, verify against the image):"]
+    for v in verdicts:
+        summary = " ".join(v.response.split())[:400]
+        lines.append(f"- Product: {v.product_text[:200]!r} -> {v.verdict.upper()}: {summary}")
+    return "\n".join(lines)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+# Get the shared verdict store, opening it on first use
+def get_verdict_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VerdictStore(
+                    config.data_path("verdicts.faiss"),
+                    config.data_path("verdicts.sqlite3"),
+                    embed=get_embedder().embed,
+                    merge_every=config.VERDICTS_MERGE_EVERY,
+                )
+    return _store
+
+# Find past verdicts for a product; returns (direct_answer, grounding) where either may be None
+def retrieve_verdicts(mode, user_type, product_text):
+    if not config.VERDICTS_ENABLED or not product_text:
+        return None, None
+    try:
+        matches = get_verdict_store().search(mode, user_type, product_text, k=config.VERDICTS_TOP_K)
+    except Exception as e:
+        logger.warning("Verdict retrieval failed: %s", e)
+        return None, None
+    if matches and matches[0].score >= config.VERDICTS_DIRECT_SIMILARITY:
+        return matches[0].response, None
+    grounded = [m for m in matches if m.score >= config.VERDICTS_GROUNDING_SIMILARITY]
+    return None, (grounding_text(grounded) if grounded else None)
+
+_pending = None
+_pending_lock = threading.Lock()
+
+def _store_worker():
+    while True:
+        mode, user_type, product_text, response = _pending.get()
+        try:
+            get_verdict_store().add(mode, user_type, product_text, response)
+        except Exception as e:
+            logger.warning("Could not store verdict: %s", e)
+
+# Store a finished analysis in the background so the user isn't kept waiting.
+# The queue is bounded; when it is full (embedding calls failing or slow) the
+# verdict is dropped rather than piling up threads.
+def store_verdict_async(mode, user_type, product_text, response):
+    global _pending
+    if not config.VERDICTS_ENABLED or not product_text:
+        return
+    if _pending is None:
+        with _pending_lock:
+            if _pending is None:
+                _pending = queue.Queue(maxsize=config.VERDICTS_STORE_QUEUE)
+                for i in range(config.VERDICTS_STORE_WORKERS):
+                    threading.Thread(target=_store_worker, name=f"verdict-store-{i}", daemon=True).start()
+    try:
+        _pending.put_nowait((mode, user_type, product_text, response))
+    except queue.Full:
+        registry.increment("nurtureai_verdicts_dropped_total", {"mode": mode})
+        logger.warning("Verdict store queue is full; not storing this verdict")